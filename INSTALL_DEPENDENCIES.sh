@@ -1,4 +1,4 @@
 #!/bin/bash
 # One-line install for all dependencies
-pip install torch transformers flask flask-cors tqdm boto3 accelerate flash-attn --no-build-isolation
+pip install torch "transformers>=4.42,<4.54" flask flask-cors tqdm boto3 accelerate flash-attn --no-build-isolation
 
@@ -8,6 +8,9 @@ import os
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import logging
+import queue
+import threading
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,6 +19,13 @@ logger = logging.getLogger(__name__)
 # Global variables for model and tokenizer
 model_dict = None
 
+# Dynamic batching: conversations generated together per model.generate() call
+MAX_BATCH_SIZE = int(os.environ.get("MEDARION_MAX_BATCH_SIZE", "8"))
+# Single invocations arriving within this window are merged into one batch (0 disables)
+MICRO_BATCH_WAIT_MS = float(os.environ.get("MEDARION_MICRO_BATCH_WAIT_MS", "10"))
+micro_batcher = None
+micro_batcher_lock = threading.Lock()
+
 def model_fn(model_dir):
     """
     Load the model and tokenizer from the model directory.
@@ -103,6 +113,9 @@ def model_fn(model_dir):
             tokenizer.pad_token = tokenizer.eos_token
             logger.info("Set pad_token to eos_token")
         
+        # Decoder-only batched generation needs prompts padded on the left
+        tokenizer.padding_side = "left"
+        
         # Load model
         logger.info("Loading model...")
         logger.info("This may take several minutes for large models...")
@@ -175,83 +188,143 @@ def model_fn(model_dir):
         logger.error(f"Full traceback:\n{traceback.format_exc()}")
         raise
 
+def _validate_conversation(item):
+    if not isinstance(item, dict) or "messages" not in item:
+        raise ValueError("Missing 'messages' field in request")
+    return item
+
 def input_fn(request_body, request_content_type):
     """
     Parse and validate the input request.
     
+    A single conversation is a JSON object with "messages". A batch is either a
+    JSON list of such objects, {"inputs": [...]}, or JSON Lines (one object per
+    line, as sent by batch transform with BatchStrategy=MultiRecord).
+    
     Args:
         request_body: Raw request body (bytes or string)
         request_content_type: Content type of the request
         
     Returns:
-        Parsed input data as dictionary
+        Parsed input data as dictionary, or a list of dictionaries for batches
     """
+    if isinstance(request_body, bytes):
+        request_body = request_body.decode('utf-8')
+    
     if request_content_type == "application/json":
-        if isinstance(request_body, bytes):
-            input_data = json.loads(request_body.decode('utf-8'))
-        else:
-            input_data = json.loads(request_body)
+        input_data = json.loads(request_body)
         
-        # Validate required fields
-        if "messages" not in input_data:
-            raise ValueError("Missing 'messages' field in request")
+        if isinstance(input_data, dict) and isinstance(input_data.get("inputs"), list):
+            input_data = input_data["inputs"]
         
-        return input_data
+        # Validate required fields
+        if isinstance(input_data, list):
+            return [_validate_conversation(item) for item in input_data]
+        return _validate_conversation(input_data)
+    elif request_content_type == "application/jsonlines":
+        return [_validate_conversation(json.loads(line)) for line in request_body.splitlines() if line.strip()]
     else:
-        raise ValueError(f"Unsupported content type: {request_content_type}. Expected 'application/json'")
+        raise ValueError(f"Unsupported content type: {request_content_type}. Expected 'application/json' or 'application/jsonlines'")
 
 def predict_fn(input_data, model_dict):
     """
     Generate prediction using the loaded model.
     
     Args:
-        input_data: Parsed input data from input_fn
+        input_data: Parsed input data from input_fn (one conversation or a list)
+        model_dict: Dictionary containing model and tokenizer from model_fn
+        
+    Returns:
+        Dictionary with generated text and usage information, or a list of
+        such dictionaries (same order) for batch input
+    """
+    if isinstance(input_data, list):
+        logger.info(f"Batch request: {len(input_data)} conversations")
+        return predict_batch(input_data, model_dict)
+    
+    if MICRO_BATCH_WAIT_MS > 0:
+        return get_micro_batcher(model_dict).submit(input_data)
+    return predict_batch([input_data], model_dict)[0]
+
+def _generation_params(input_data):
+    """Sampling parameters with safe defaults; conversations sharing them can be batched"""
+    return (
+        float(input_data.get("temperature", 0.7)),
+        int(input_data.get("max_tokens", 4000)),
+        float(input_data.get("top_p", 1.0)),
+        float(input_data.get("repetition_penalty", 1.1)),
+    )
+
+def predict_batch(items, model_dict):
+    """
+    Generate responses for several conversations, batching those with identical
+    sampling parameters into shared model.generate() calls.
+    
+    Args:
+        items: List of parsed conversations (each with "messages")
+        model_dict: Dictionary containing model and tokenizer from model_fn
+        
+    Returns:
+        List of response dictionaries in the same order as items
+    """
+    groups = {}
+    for index, item in enumerate(items):
+        groups.setdefault(_generation_params(item), []).append(index)
+    
+    results = [None] * len(items)
+    for params, indexes in groups.items():
+        for start in range(0, len(indexes), MAX_BATCH_SIZE):
+            chunk = indexes[start:start + MAX_BATCH_SIZE]
+            responses = generate_batch([items[i].get("messages", []) for i in chunk], params, model_dict)
+            for index, response in zip(chunk, responses):
+                results[index] = response
+    return results
+
+def format_prompt(tokenizer, messages):
+    """Render messages with the chat template, falling back to plain formatting"""
+    if hasattr(tokenizer, "apply_chat_template") and tokenizer.chat_template:
+        try:
+            return tokenizer.apply_chat_template(
+                messages,
+                tokenize=False,
+                add_generation_prompt=True
+            )
+        except Exception as e:
+            logger.warning(f"Chat template failed: {e}, using fallback")
+    return format_messages_fallback(messages)
+
+def generate_batch(conversations, params, model_dict):
+    """
+    Left-pad a batch of conversations and generate them in one model.generate() call.
+    
+    Args:
+        conversations: List of message lists
+        params: (temperature, max_tokens, top_p, repetition_penalty) shared by the batch
         model_dict: Dictionary containing model and tokenizer from model_fn
         
     Returns:
-        Dictionary with generated text and usage information
+        List of OpenAI-compatible response dictionaries
     """
     model = model_dict["model"]
     tokenizer = model_dict["tokenizer"]
     device = model_dict["device"]
+    temperature, max_tokens, top_p, repetition_penalty = params
     
-    # Extract parameters
-    messages = input_data.get("messages", [])
-    temperature = float(input_data.get("temperature", 0.7))
-    max_tokens = int(input_data.get("max_tokens", 4000))
-    top_p = float(input_data.get("top_p", 1.0))
-    
-    logger.info(f"Generating with temperature={temperature}, max_tokens={max_tokens}")
+    logger.info(f"Generating {len(conversations)} response(s) with temperature={temperature}, max_tokens={max_tokens}")
     
     try:
-        # Format messages using chat template if available
-        if hasattr(tokenizer, "apply_chat_template") and tokenizer.chat_template:
-            try:
-                # Use the chat template
-                prompt = tokenizer.apply_chat_template(
-                    messages,
-                    tokenize=False,
-                    add_generation_prompt=True
-                )
-                logger.info("Used chat template for formatting")
-            except Exception as e:
-                logger.warning(f"Chat template failed: {e}, using fallback")
-                # Fallback formatting
-                prompt = format_messages_fallback(messages)
-        else:
-            # Fallback formatting
-            prompt = format_messages_fallback(messages)
+        prompts = [format_prompt(tokenizer, messages) for messages in conversations]
         
-        # Tokenize input
+        # Tokenize (left padding keeps every prompt adjacent to its generated tokens)
         inputs = tokenizer(
-            prompt,
+            prompts,
             return_tensors="pt",
+            padding=True,
             truncation=True,
             max_length=32768  # Mistral max context
         ).to(device)
         
-        input_token_count = inputs["input_ids"].shape[1]
-        logger.info(f"Input tokens: {input_token_count}")
+        padded_length = inputs["input_ids"].shape[1]
         
         # Generate
         with torch.no_grad():
@@ -263,39 +336,43 @@ def predict_fn(input_data, model_dict):
                 do_sample=temperature > 0,
                 pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
                 eos_token_id=tokenizer.eos_token_id,
-                repetition_penalty=float(input_data.get("repetition_penalty", 1.1))
+                repetition_penalty=repetition_penalty
             )
         
-        # Decode generated text (skip input tokens)
-        generated_tokens = outputs[0][input_token_count:]
-        generated_text = tokenizer.decode(
-            generated_tokens,
-            skip_special_tokens=True
-        )
-        
-        # Calculate token counts
-        completion_token_count = len(generated_tokens)
-        total_token_count = input_token_count + completion_token_count
-        
-        logger.info(f"Generated {completion_token_count} tokens")
-        
-        # Format response in OpenAI-compatible format
-        response = {
-            "choices": [{
-                "message": {
-                    "role": "assistant",
-                    "content": generated_text.strip()
-                },
-                "finish_reason": "stop"
-            }],
-            "usage": {
-                "prompt_tokens": input_token_count,
-                "completion_tokens": completion_token_count,
-                "total_tokens": total_token_count
-            }
-        }
+        responses = []
+        for row, output in enumerate(outputs):
+            input_token_count = int(inputs["attention_mask"][row].sum())
+            
+            # Sequences that finished early are padded; keep tokens up to and including EOS
+            generated_tokens = output[padded_length:].tolist()
+            hit_eos = tokenizer.eos_token_id in generated_tokens
+            if hit_eos:
+                generated_tokens = generated_tokens[:generated_tokens.index(tokenizer.eos_token_id) + 1]
+            while generated_tokens and generated_tokens[-1] == tokenizer.pad_token_id != tokenizer.eos_token_id:
+                generated_tokens.pop()
+            
+            generated_text = tokenizer.decode(generated_tokens, skip_special_tokens=True)
+            completion_token_count = len(generated_tokens)
+            
+            # Format response in OpenAI-compatible format
+            responses.append({
+                "choices": [{
+                    "message": {
+                        "role": "assistant",
+                        "content": generated_text.strip()
+                    },
+                    # Without an EOS the row ran into max_new_tokens
+                    "finish_reason": "stop" if hit_eos else "length"
+                }],
+                "usage": {
+                    "prompt_tokens": input_token_count,
+                    "completion_tokens": completion_token_count,
+                    "total_tokens": input_token_count + completion_token_count
+                }
+            })
         
-        return response
+        logger.info(f"Generated {len(responses)} response(s)")
+        return responses
         
     except Exception as e:
         logger.error(f"Error during prediction: {str(e)}")
@@ -303,6 +380,70 @@ def predict_fn(input_data, model_dict):
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise
 
+class MicroBatcher:
+    """
+    Gathers single-conversation invocations that arrive within MICRO_BATCH_WAIT_MS
+    of each other and runs them through predict_batch() together.
+    Useful when the model server calls predict_fn from several threads.
+    """
+    
+    def __init__(self, model_dict, wait_ms=MICRO_BATCH_WAIT_MS, max_batch_size=MAX_BATCH_SIZE):
+        self.model_dict = model_dict
+        self.wait_seconds = wait_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self.thread.start()
+    
+    def submit(self, input_data):
+        """Queue one conversation and block until its batch has been generated"""
+        job = {"input": input_data, "done": threading.Event(), "result": None, "error": None}
+        self.pending.put(job)
+        job["done"].wait()
+        if job["error"] is not None:
+            raise job["error"]
+        return job["result"]
+    
+    def _loop(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.wait_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                results = predict_batch([job["input"] for job in batch], self.model_dict)
+                for job, result in zip(batch, results):
+                    job["result"] = result
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0]["error"] = e
+                else:
+                    # One bad conversation must not fail its neighbours: retry each on its own
+                    logger.warning(f"Batch of {len(batch)} failed ({e}); retrying requests individually")
+                    for job in batch:
+                        try:
+                            job["result"] = predict_batch([job["input"]], self.model_dict)[0]
+                        except Exception as job_error:
+                            job["error"] = job_error
+            finally:
+                for job in batch:
+                    job["done"].set()
+
+def get_micro_batcher(model_dict):
+    """Create the shared MicroBatcher on first use"""
+    global micro_batcher
+    with micro_batcher_lock:
+        if micro_batcher is None:
+            micro_batcher = MicroBatcher(model_dict)
+        return micro_batcher
+
 def output_fn(prediction, response_content_type):
     """
     Format the prediction for the response.
@@ -312,12 +453,15 @@ def output_fn(prediction, response_content_type):
         response_content_type: Expected content type for response
         
     Returns:
-        Formatted response (JSON string)
+        Formatted response (JSON string, or JSON Lines for batch output)
     """
     if response_content_type == "application/json":
         return json.dumps(prediction, ensure_ascii=False)
+    elif response_content_type == "application/jsonlines":
+        items = prediction if isinstance(prediction, list) else [prediction]
+        return "\n".join(json.dumps(item, ensure_ascii=False) for item in items)
     else:
-        raise ValueError(f"Unsupported content type: {response_content_type}. Expected 'application/json'")
+        raise ValueError(f"Unsupported content type: {response_content_type}. Expected 'application/json' or 'application/jsonlines'")
 
 def format_messages_fallback(messages):
     """
@@ -18,7 +18,7 @@ pip install torch torchvision torchaudio --index-url https://download.pytorch.or
 # Install Flask and transformers
 echo ""
 echo "[3/4] Installing Flask and Transformers..."
-pip install flask transformers accelerate
+pip install flask "transformers>=4.42,<4.54" accelerate
 
 # Verify installations
 echo ""
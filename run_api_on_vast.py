@@ -9,9 +9,14 @@ Author: Medarion Systems
 - Fine-tuned Medarion model (augmented with healthcare data)
 - Safe & stable model loading
 - Automatic dependency installation
+- Binds immediately; model loads in the background with progress on /health
 - Prevents gibberish text output
 - Proper Medarion identity preservation
 - Optimized for African healthcare markets
+- Continuous batching of concurrent /chat and /generate requests
+- Optional asyncio ASGI mode with admission queue and backpressure
+- Prometheus /metrics for latency and token throughput
+- Optional response cache (memory + SQLite) for repeated low-temperature questions
 - Runs cleanly on GPU (port 5000)
 ====================================================================
 """
@@ -19,53 +24,171 @@ Author: Medarion Systems
 import os
 import sys
 import subprocess
+import threading
 
 # =========================================================
 # 0️⃣  Auto-install dependencies if missing
 # =========================================================
-def install_dependencies():
-    """Install required packages if not available"""
+# The batching engine's in-place KV cache subclasses transformers' Cache, whose
+# constructor and layout changed in 4.54 (per-layer caches) and again in 5.x
+TRANSFORMERS_MIN_VERSION = (4, 42)
+TRANSFORMERS_MAX_VERSION = (4, 54)  # Exclusive
+TRANSFORMERS_REQUIREMENT = "transformers>=4.42,<4.54"
+
+
+def transformers_version_supported():
+    """True when an installed transformers falls inside the tested range"""
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        installed = tuple(int(part) for part in version("transformers").split(".")[:2])
+    except (PackageNotFoundError, ValueError):
+        return False
+    return TRANSFORMERS_MIN_VERSION <= installed < TRANSFORMERS_MAX_VERSION
+
+
+def missing_dependencies():
+    """(package, pip arguments) for every required package that is absent or, for transformers, out of range"""
+    from importlib.util import find_spec
+
     required_packages = {
         'torch': 'torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu121',
         'flask': 'flask',
-        'transformers': 'transformers accelerate',
+        'transformers': TRANSFORMERS_REQUIREMENT + ' accelerate',
         'boto3': 'boto3'
     }
-    
+    if os.getenv("MEDARION_SERVER_MODE", "flask").lower() == "asgi":
+        required_packages['uvicorn'] = 'uvicorn'
+
     missing = []
     for package, install_cmd in required_packages.items():
-        try:
-            __import__(package)
-        except ImportError:
+        # find_spec locates a package without importing it, so checking stays cheap
+        if find_spec(package) is None or (package == 'transformers' and not transformers_version_supported()):
             missing.append((package, install_cmd))
-    
-    if missing:
-        print("=" * 70)
-        print("📦 Installing missing dependencies...")
-        print("=" * 70)
-        for package, install_cmd in missing:
-            print(f"   Installing {package}...")
-            try:
-                subprocess.check_call([sys.executable, "-m", "pip", "install"] + install_cmd.split())
-                print(f"   ✅ {package} installed")
-            except subprocess.CalledProcessError as e:
-                print(f"   ❌ Failed to install {package}: {e}")
-                print("   Please install manually: pip install " + install_cmd)
-                sys.exit(1)
-        print("=" * 70)
-        print("✅ All dependencies installed!")
-        print("=" * 70)
-        print()
-
-# Install dependencies before importing
-install_dependencies()
+    return missing
+
+
+def install_dependencies(missing, state):
+    """pip install each missing package, recording progress in `state`; raises on the first failure"""
+    print("=" * 70)
+    print("📦 Installing missing dependencies...")
+    print("=" * 70)
+    for i, (package, install_cmd) in enumerate(missing):
+        state.update(progress=i / len(missing), package=package)
+        print(f"   Installing {package}...")
+        try:
+            subprocess.check_call([sys.executable, "-m", "pip", "install"] + install_cmd.split())
+        except subprocess.CalledProcessError as e:
+            print(f"   ❌ Failed to install {package}: {e}")
+            print("   Please install manually: pip install " + install_cmd)
+            raise
+        print(f"   ✅ {package} installed")
+    print("=" * 70)
+    print("✅ All dependencies installed!")
+    print("=" * 70)
+    print()
+
+
+def install_then_restart(missing):
+    """
+    Install `missing` while a stdlib HTTP server already holds the port and reports
+    the "installing_dependencies" stage on /health, then re-exec the script so the
+    real server starts against the freshly installed packages (an upgraded
+    transformers cannot be swapped into a process that already imported it).
+    If installation fails the stage server keeps reporting the error.
+    """
+    import json
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    state = {"status": "loading", "progress": 0.0, "package": None, "error": None, "started_at": time.time()}
+
+    class StageHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/ping":
+                self._reply(200, "text/plain", b"pong")
+                return
+            payload = {
+                "status": "error" if state["status"] == "failed" else "loading",
+                "stage": "installing_dependencies",
+                "progress": state["progress"],
+                "package": state["package"],
+                "elapsed_seconds": round(time.time() - state["started_at"], 1),
+                "error": state["error"] or "Model not loaded",
+                "inference_ready": False,
+            }
+            self._reply(503, "application/json", json.dumps(payload).encode("utf-8"))
+
+        do_POST = do_GET
+
+        def _reply(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if status == 503:
+                self.send_header("Retry-After", "5")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", PORT), StageHandler)
+    server.daemon_threads = True
+    print(f"🌐 Listening on port {PORT} while dependencies install (GET /health for progress)")
+    threading.Thread(target=server.serve_forever, name="install-progress", daemon=True).start()
+    try:
+        install_dependencies(missing, state)
+    except Exception as e:
+        state.update(status="failed", error=f"Dependency installation failed: {e}")
+        threading.Event().wait()  # Keep reporting the failure until the process is stopped
+    server.shutdown()
+    server.server_close()
+    os.environ["MEDARION_DEPENDENCIES_INSTALLED"] = "1"  # Guards against a restart loop
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
+# Use internal port for Cloudflare tunnel
+# Since we're using Cloudflare tunnel, we can use any available port
+# Port 5000 is commonly free and works well with tunnels
+PORT = 5000  # Internal port (will be accessed via Cloudflare tunnel)
+
+# Installing only when run as the server keeps importing this module side-effect free;
+# the port is bound before pip starts so /health reports the install as a loading stage
+if __name__ == "__main__":
+    _missing = missing_dependencies()
+    if _missing and os.getenv("MEDARION_DEPENDENCIES_INSTALLED") == "1":
+        sys.exit(f"❌ Still missing after installation: {', '.join(package for package, _ in _missing)}")
+    if _missing:
+        install_then_restart(_missing)
 
 # Now import the packages
 import torch
-from flask import Flask, request, jsonify
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from flask import Flask, Response, request, jsonify, stream_with_context
+from transformers import (
+    AutoTokenizer,
+    AutoModelForCausalLM,
+    LogitsProcessorList,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+    StoppingCriteria,
+    TemperatureLogitsWarper,
+    TopPLogitsWarper,
+)
 import tarfile
 import shutil
+import queue
+import asyncio
+from collections import OrderedDict
+import json
+import re
+import time
+import uuid
+import hashlib
+import sqlite3
+
+from transformers import DynamicCache
+from transformers.cache_utils import Cache
 
 # =========================================================
 # 1️⃣  Configuration
@@ -82,10 +205,34 @@ S3_REGION = "us-east-2"
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID", "YOUR_AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", "YOUR_AWS_SECRET_ACCESS_KEY")
 
-# Use internal port for Cloudflare tunnel
-# Since we're using Cloudflare tunnel, we can use any available port
-# Port 5000 is commonly free and works well with tunnels
-PORT = 5000  # Internal port (will be accessed via Cloudflare tunnel)
+# Continuous batching: max sequences sharing one decode step
+MAX_BATCH_SIZE = int(os.getenv("MEDARION_MAX_BATCH_SIZE", "16"))
+
+# Initial per-sequence column capacity of the decode batch's KV buffers (grown by doubling)
+KV_CACHE_INITIAL_TOKENS = int(os.getenv("MEDARION_KV_CACHE_TOKENS", "1024"))
+
+# Prefix KV-cache reuse: token budget for cached prompt prefixes (~128 KB per token for Mistral 7B fp16)
+PREFIX_CACHE_MAX_TOKENS = int(os.getenv("MEDARION_PREFIX_CACHE_TOKENS", "8192"))
+PREFIX_CACHE_MIN_TOKENS = 32  # Shorter shared prefixes are not worth a lookup
+
+# Serving mode: "flask" (threaded development server) or "asgi" (asyncio + uvicorn with admission control)
+SERVER_MODE = os.getenv("MEDARION_SERVER_MODE", "flask").lower()
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MEDARION_MAX_CONCURRENT", str(MAX_BATCH_SIZE)))
+MAX_QUEUED_REQUESTS = int(os.getenv("MEDARION_MAX_QUEUED", "64"))
+QUEUE_TIMEOUT = float(os.getenv("MEDARION_QUEUE_TIMEOUT", "30"))  # Seconds waiting for a slot before 503
+REQUEST_TIMEOUT = float(os.getenv("MEDARION_REQUEST_TIMEOUT", "300"))  # Seconds of generation before 504
+DRAIN_TIMEOUT = float(os.getenv("MEDARION_DRAIN_TIMEOUT", "60"))  # Seconds to finish in-flight work on shutdown
+RETRY_AFTER_SECONDS = 5
+
+# Optional pre-converted safetensors copy of the weights (memory-mapped on load for fast restarts)
+SAFETENSORS_DIR = os.getenv("MEDARION_SAFETENSORS_DIR", os.path.join(WORKDIR, "safetensors"))
+CONVERT_TO_SAFETENSORS = os.getenv("MEDARION_CONVERT_SAFETENSORS", "0") == "1"
+
+# Response cache for repeated deterministic / low-temperature requests (size 0 disables)
+RESPONSE_CACHE_SIZE = int(os.getenv("MEDARION_RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("MEDARION_RESPONSE_CACHE_TTL", "86400"))  # Seconds
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("MEDARION_RESPONSE_CACHE_MAX_TEMPERATURE", "0.3"))
+RESPONSE_CACHE_PATH = os.getenv("MEDARION_RESPONSE_CACHE_PATH", os.path.join(WORKDIR, "response_cache.sqlite3"))  # "" = memory only
 
 # =========================================================
 # 1.5️⃣  Download and Extract Model from S3
@@ -151,6 +298,7 @@ def setup_model_from_s3():
                 
                 def __call__(self, bytes_amount):
                     self.downloaded += bytes_amount
+                    set_load_stage("downloading", round(self.downloaded / self.total_size, 3))
                     percent = int((self.downloaded / self.total_size) * 100)
                     if percent != self.last_percent and percent % 10 == 0:
                         print(f"   Progress: {percent}% ({self.downloaded / (1024**3):.2f} GB / {self.total_size / (1024**3):.2f} GB)")
@@ -164,6 +312,7 @@ def setup_model_from_s3():
             raise
     
     # Extract model
+    set_load_stage("extracting", 0.0)
     print(f"   📂 Extracting model (this may take 5-10 minutes)...")
     try:
         with tarfile.open(TAR_FILE, 'r:gz') as tar:
@@ -177,6 +326,8 @@ def setup_model_from_s3():
             for member in members:
                 tar.extract(member, MODEL_DIR)
                 extracted += 1
+                if extracted % 100 == 0:
+                    set_load_stage("extracting", round(extracted / total, 3))
                 if extracted % 1000 == 0:
                     print(f"   Extracted {extracted}/{total} files...")
             
@@ -196,8 +347,153 @@ def setup_model_from_s3():
     print("=" * 70)
     print()
 
-# Setup model before loading
-setup_model_from_s3()
+
+# =========================================================
+# 1.6️⃣  Metrics (Prometheus text exposition format)
+# =========================================================
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+THROUGHPUT_BUCKETS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 200, 500)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class MetricCounter:
+    """Monotonic counter, optionally split by label values"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        if not values and not self.labels:
+            values = {(): 0}
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in sorted(values.items())]
+
+
+class MetricHistogram:
+    """Cumulative-bucket histogram"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+            self.total += value
+            self.count += 1
+
+    def samples(self):
+        with self.lock:
+            counts, total, count = list(self.counts), self.total, self.count
+        lines = [
+            f'{self.name}_bucket{{le="{bound}"}} {bucket_count}'
+            for bound, bucket_count in zip(self.buckets, counts)
+        ]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class MetricGauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def samples(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        return [f"{self.name} {value}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+KNOWN_ENDPOINTS = {"/health", "/ping", "/metrics", "/generate", "/chat"}
+
+
+def endpoint_label(path):
+    # Unknown paths share one label so scanners cannot blow up series cardinality
+    return path if path in KNOWN_ENDPOINTS else "other"
+
+
+REQUESTS_TOTAL = METRICS.register(MetricCounter(
+    "medarion_requests_total", "HTTP requests by endpoint and status code", labels=("endpoint", "status")))
+QUEUE_WAIT_SECONDS = METRICS.register(MetricHistogram(
+    "medarion_queue_wait_seconds", "Time from submission until the engine starts prefill", LATENCY_BUCKETS))
+PREFILL_SECONDS = METRICS.register(MetricHistogram(
+    "medarion_prefill_seconds", "Prefill time including the first sampled token", LATENCY_BUCKETS))
+DECODE_SECONDS = METRICS.register(MetricHistogram(
+    "medarion_decode_seconds", "Time from the first to the last generated token", LATENCY_BUCKETS))
+TIME_TO_FIRST_TOKEN_SECONDS = METRICS.register(MetricHistogram(
+    "medarion_time_to_first_token_seconds", "Time from submission to the first generated token", LATENCY_BUCKETS))
+DECODE_TOKENS_PER_SECOND = METRICS.register(MetricHistogram(
+    "medarion_decode_tokens_per_second", "Per-request decode throughput", THROUGHPUT_BUCKETS))
+PROMPT_TOKENS = METRICS.register(MetricHistogram(
+    "medarion_prompt_tokens", "Prompt size in tokens", TOKEN_BUCKETS))
+COMPLETION_TOKENS = METRICS.register(MetricHistogram(
+    "medarion_completion_tokens", "Generated tokens per request", TOKEN_BUCKETS))
+GENERATIONS_TOTAL = METRICS.register(MetricCounter(
+    "medarion_generations_total", "Finished engine requests by finish reason", labels=("finish_reason",)))
+STOP_PATTERN_TRUNCATIONS = METRICS.register(MetricCounter(
+    "medarion_stop_pattern_truncations_total", "Responses cut at a training-data, script or footer stop pattern"))
+GIBBERISH_REJECTIONS = METRICS.register(MetricCounter(
+    "medarion_gibberish_rejections_total", "Responses replaced or cut because they were mostly non-alphanumeric"))
+RESPONSE_CACHE_REQUESTS = METRICS.register(MetricCounter(
+    "medarion_response_cache_requests_total", "Response cache lookups by result", labels=("result",)))
+
 
 # =========================================================
 # 2️⃣  Flask setup
@@ -241,6 +537,249 @@ def check_ip():
     return None
 
 
+MEDARION_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are Medarion, an AI assistant specialized in African healthcare market intelligence. You provide insights on healthcare companies, investors, deals, grants, clinical trials, and regulatory information across Africa. You are knowledgeable about market trends, investment patterns, and healthcare innovation in African markets. Always identify yourself as Medarion when asked about your identity."
+}
+
+
+def format_messages_fallback(messages):
+    """Fallback message formatting when chat template is not available (matching inference.py)"""
+    formatted = []
+    for msg in messages:
+        role = msg.get("role", "user")
+        content = msg.get("content", "")
+        if role == "system":
+            formatted.append(f"System: {content}")
+        elif role == "user":
+            formatted.append(f"User: {content}")
+        elif role == "assistant":
+            formatted.append(f"Assistant: {content}")
+        else:
+            formatted.append(f"{role.capitalize()}: {content}")
+    formatted.append("Assistant:")
+    return "\n".join(formatted)
+
+
+def build_chat_prompt(messages, verbose=True):
+    """Render messages with the chat template if available (matching working inference.py)"""
+    if hasattr(tokenizer, "apply_chat_template") and tokenizer.chat_template:
+        try:
+            prompt = tokenizer.apply_chat_template(
+                messages,
+                tokenize=False,
+                add_generation_prompt=True
+            )
+            if verbose:
+                print("[API] Used chat template for formatting")
+            return prompt
+        except Exception as e:
+            if verbose:
+                print(f"[API] Chat template failed: {e}, using fallback")
+    return format_messages_fallback(messages)
+
+
+# Stop at training data patterns, JavaScript code, and footer/boilerplate text BEFORE cleaning
+# This prevents the model from outputting training format, JavaScript, or footer text
+# Whitespace runs are capped (\s{0,8} rather than \s*) so every match has a bounded
+# length the incremental scanner's lookback can cover
+STOP_PATTERNS = [
+    r'###\s{0,8}Instruction\s{0,8}:',
+    r'###\s{0,8}Response\s{0,8}:',
+    r'###\s{0,8}Institution\s{0,8}:',
+    r'###\s{0,8}Example\s{0,8}:',
+    r'###\s{0,8}Training\s{0,8}:',
+    r'###\s{0,8}Data\s{0,8}:',
+    r'\(function\s{0,8}\(',
+    r'function\s{0,8}\(w,\s{0,8}d,\s{0,8}s',
+    r'w\[l\]\s{0,8}=\s{0,8}w\[p\]',
+    r'getElementsByTagName',
+    r'\.push\(arguments\)',
+    # Footer/boilerplate patterns (training data artifacts)
+    r'\|\s{0,8}Medarion\s{1,8}AI\s{1,8}Health\s{1,8}Assistant\s{0,8}\|',
+    r'\|\s{0,8}Powered\s{1,8}by\s{1,8}Medarion',
+    r'\|\s{0,8}Visit\s{1,8}www\.medarion\.com',
+    r'\|\s{0,8}©\s{1,8}\d{4}\s{1,8}Medarion',
+    r'\|\s{0,8}Terms\s{1,8}of\s{1,8}Use\s{1,8}&\s{1,8}Privacy\s{1,8}Policy',
+    r'\|\s{0,8}Contact\s{1,8}us:',
+    r'\|\s{0,8}Report\s{1,8}abuse:',
+    r'\|\s{0,8}Disclaimer:',
+    r'\|\s{0,8}Follow\s{1,8}us\s{1,8}on\s{1,8}social\s{1,8}media',
+    r'\|\s{0,8}Subscribe\s{1,8}to\s{1,8}our\s{1,8}newsletter',
+]
+# One alternation: a single left-to-right search returns the earliest marker of any kind
+STOP_PATTERN_RE = re.compile("|".join(f"(?:{pattern})" for pattern in STOP_PATTERNS), re.IGNORECASE)
+STOP_SCAN_LOOKBACK = 80  # Chars re-scanned before new text so split markers are found; exceeds the longest match (73)
+STOP_PATTERN_MIN_INDEX = 11  # Built-in markers starting in the first 10 chars are ignored (scanning continues past them)
+
+FALLBACK_RESPONSE = "I apologize, but I couldn't generate a proper response. Please try again."
+
+
+def find_stop_pattern(text, min_index=STOP_PATTERN_MIN_INDEX):
+    """Return the index of the earliest stop pattern starting at min_index or later, or None"""
+    return StopPatternScanner(min_index=min_index).feed(text)
+
+
+class StopPatternScanner:
+    """
+    Incremental search for the combined stop-pattern regex.
+
+    Text is fed as it is decoded; each call only scans the new text plus a short
+    lookback, so the whole response is scanned once instead of once per token.
+    Matches starting before `min_index` are skipped and the search resumes at
+    their end, so a later marker in the same text is still found.
+    """
+
+    def __init__(self, pattern=STOP_PATTERN_RE, lookback=STOP_SCAN_LOOKBACK, min_index=0):
+        self.pattern = pattern
+        self.lookback = lookback
+        self.min_index = min_index
+        self.text = ""
+        self.match_index = None
+        self.skip_to = 0  # End of the last ignored leading match
+
+    def feed(self, delta):
+        """Append decoded text; returns the earliest match index so far, or None"""
+        if self.match_index is not None:
+            return self.match_index
+        start = max(self.skip_to, len(self.text) - self.lookback)
+        self.text += delta
+        match = self.pattern.search(self.text, start)
+        while match and match.start() < self.min_index:
+            self.skip_to = max(match.end(), match.start() + 1)
+            match = self.pattern.search(self.text, self.skip_to)
+        if match:
+            self.match_index = match.start()
+        return self.match_index
+
+    def scan(self, text):
+        """Feed the full text so far, rescanning from scratch if it is not an extension"""
+        if not text.startswith(self.text):
+            self.text, self.match_index, self.skip_to = "", None, 0
+        return self.feed(text[len(self.text):])
+
+
+def parse_stop_sequences(stop):
+    """Normalize an OpenAI-style `stop` value (string or list of strings) to a list"""
+    if not stop:
+        return []
+    if isinstance(stop, str):
+        stop = [stop]
+    return [sequence for sequence in stop if isinstance(sequence, str) and sequence]
+
+
+def custom_stop_scanner(stop_sequences):
+    """Scanner for a request's literal stop strings, or None if it has none"""
+    if not stop_sequences:
+        return None
+    pattern = re.compile("|".join(re.escape(sequence) for sequence in stop_sequences))
+    lookback = max(STOP_SCAN_LOOKBACK, max(len(sequence) for sequence in stop_sequences))
+    return StopPatternScanner(pattern=pattern, lookback=lookback)
+
+
+def truncate_at_stop_sequences(text, stop_sequences):
+    """Cut text before the earliest literal stop string (OpenAI `stop` semantics)"""
+    indexes = [text.find(sequence) for sequence in stop_sequences]
+    indexes = [index for index in indexes if index >= 0]
+    return text[:min(indexes)] if indexes else text
+
+
+class IncrementalDetokenizer:
+    """Decodes a growing list of token ids without re-decoding the whole sequence each step"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.token_ids = []
+        self.text = ""
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def add(self, token_id):
+        """Append one token; returns the newly decoded text (may be empty)"""
+        self.token_ids.append(token_id)
+        prefix_text = self.tokenizer.decode(self.token_ids[self.prefix_offset:self.read_offset], skip_special_tokens=True)
+        new_text = self.tokenizer.decode(self.token_ids[self.prefix_offset:], skip_special_tokens=True)
+        if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+            return ""  # Wait for the rest of a multi-byte character
+        delta = new_text[len(prefix_text):]
+        self.text += delta
+        self.prefix_offset, self.read_offset = self.read_offset, len(self.token_ids)
+        return delta
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """
+    Halts decoding the moment the generated text contains a stop pattern
+    (training-data markers, JavaScript snippets, footer boilerplate) or one of
+    the request's own OpenAI-style `stop` strings.
+
+    Built-in patterns found within the first 10 characters are ignored, matching
+    the post-hoc truncation in finish_chat(). Single sequence only; the batching
+    engine calls feed_token() directly, model.generate() goes through __call__.
+    """
+
+    def __init__(self, tokenizer, stop_sequences=(), use_builtin_patterns=True):
+        self.detokenizer = IncrementalDetokenizer(tokenizer)
+        self.builtin_scanner = StopPatternScanner(min_index=STOP_PATTERN_MIN_INDEX) if use_builtin_patterns else None
+        self.custom_scanner = custom_stop_scanner(stop_sequences)
+        self.triggered = False
+
+    def feed_token(self, token_id):
+        if self.triggered:
+            return True
+        if not self.detokenizer.add(token_id):
+            return False
+        text = self.detokenizer.text.lstrip()
+        if self.builtin_scanner is not None:
+            if self.builtin_scanner.scan(text) is not None:
+                self.triggered = True
+        if self.custom_scanner is not None and self.custom_scanner.scan(text) is not None:
+            self.triggered = True
+        return self.triggered
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.feed_token(int(input_ids[0, -1]))
+
+
+def valid_char_percent(text):
+    """Percentage of alphanumeric characters, used to reject gibberish output"""
+    if not text:
+        return 0.0
+    return len(re.findall(r'[a-zA-Z0-9]', text)) / len(text) * 100
+
+
+# Chat-template markers the model sometimes echoes into its answer
+CHAT_ARTIFACTS = ("[/INST]", "<|assistant|>")
+SENTENCE_BOUNDARY_RE = re.compile(r"[.!?](?=\s)")
+
+
+def chat_artifact_span(text):
+    """
+    (start, end) of the answer inside decoded /chat text: leading template markers
+    (and the whitespace around them) are skipped, and a marker after the answer has
+    started ends it, since the model is then opening a new turn. `end` is None when
+    no such marker follows. Both /chat paths use this, so streamed and JSON answers agree.
+    """
+    start = len(text) - len(text.lstrip())
+    while True:
+        marker = next((m for m in CHAT_ARTIFACTS if text.startswith(m, start)), None)
+        if marker is None:
+            break
+        start += len(marker)
+        start += len(text[start:]) - len(text[start:].lstrip())
+    hits = [i for i in (text.find(m, start) for m in CHAT_ARTIFACTS) if i >= 0]
+    return start, min(hits) if hits else None
+
+
+def cut_before_stop_pattern(text, stop_index):
+    """Length of `text` kept when a stop pattern starts at `stop_index`: back to the last sentence end"""
+    before_stop = text[:stop_index]
+    last_sentence_end = max(before_stop.rfind('.'), before_stop.rfind('!'), before_stop.rfind('?'))
+    if last_sentence_end > 0:
+        return last_sentence_end + 1
+    return len(before_stop.rstrip())
+
+
 def clean_response(text):
     """
     Clean response to remove trailing gibberish and ensure complete sentences
@@ -332,90 +871,1187 @@ def clean_response(text):
     return text
 
 
+# Longest partial stop marker (e.g. "| Terms of Use & Privacy Policy") held back while streaming
+STREAM_HOLDBACK_CHARS = STOP_SCAN_LOOKBACK
+# Amount of unsent text inspected by the incremental gibberish check
+STREAM_GIBBERISH_WINDOW = 120
+
+
+class StreamingResponseFilter:
+    """
+    Applies the /chat post-processing incrementally so text can be streamed as it is decoded.
+
+    It makes the same cuts as finish_chat(): leading chat-template markers are
+    dropped and a later one ends the answer, and a stop pattern cuts back to the
+    last complete sentence before it. Because of that cut-back, text is released
+    a sentence at a time, still holding back a short tail that might be the start
+    of a stop pattern. A gibberish window ends the stream early; clean_response()
+    only trims the unsent tail at the end.
+    """
+
+    def __init__(self, stop_sequences=()):
+        self.text = ""
+        self.emitted = 0
+        self.cut = None  # Length of self.text the answer ends at, once known
+        self.rejected = False
+        self.scanner = StopPatternScanner(min_index=STOP_PATTERN_MIN_INDEX)
+        self.custom_scanner = custom_stop_scanner(stop_sequences)
+        self.holdback = max([STREAM_HOLDBACK_CHARS] + [len(sequence) for sequence in stop_sequences])
+
+    @property
+    def done(self):
+        return self.cut is not None or self.rejected
+
+    def update(self, text):
+        """Feed the full decoded text so far; returns the newly releasable delta"""
+        text = text.replace("</s>", "").replace("<s>", "")
+        # Nothing is released until the holdback is exceeded, so `start` is settled before any emission
+        start, artifact_end = chat_artifact_span(text)
+        self.text = text[start:]
+
+        # Hard ends: a client stop string (cut exactly) or a template marker opening a new turn
+        hard_end = artifact_end - start if artifact_end is not None else None
+        if self.custom_scanner is not None:
+            custom_index = self.custom_scanner.scan(self.text)
+            if custom_index is not None and (hard_end is None or custom_index < hard_end):
+                hard_end = custom_index
+        stop_index = self.scanner.scan(self.text)
+        if stop_index is not None and (hard_end is None or stop_index < hard_end):
+            STOP_PATTERN_TRUNCATIONS.inc()
+            self.cut = cut_before_stop_pattern(self.text, stop_index)
+            print(f"[API] Stream stopped at pattern after {stop_index} chars")
+        elif hard_end is not None:
+            self.cut = len(self.text[:hard_end].rstrip())
+        if self.cut is not None:
+            # finish() releases the cleaned remainder; generation is cancelled right after this
+            return ""
+
+        pending = self.text[self.emitted:]
+        if len(pending) >= STREAM_GIBBERISH_WINDOW and valid_char_percent(pending) < 30:
+            self.rejected = True
+            GIBBERISH_REJECTIONS.inc()
+            print("[API] Warning: Streamed response turned to gibberish, stopping")
+            return ""
+
+        # A later stop pattern may cut back to any sentence end, so only whole sentences go out.
+        # Their final punctuation waits for the next one: clean_response() strips it from the
+        # end of the answer, and sent text cannot be taken back
+        limit = len(self.text) - self.holdback
+        boundary = self.emitted
+        for match in SENTENCE_BOUNDARY_RE.finditer(self.text, self.emitted, max(self.emitted, limit)):
+            boundary = match.start()
+        return self._release(boundary)
+
+    def finish(self):
+        """Flush whatever remains once generation has ended"""
+        if self.rejected:
+            return "" if self.emitted else FALLBACK_RESPONSE
+
+        text = self.text[:self.cut].rstrip() if self.cut is not None else self.text.rstrip()
+        cleaned = clean_response(text)
+        sent = self.text[:self.emitted]
+        if self.emitted == 0 and len(cleaned.strip()) < 3:
+            return FALLBACK_RESPONSE
+        if self.emitted == 0 and valid_char_percent(cleaned) < 30:
+            GIBBERISH_REJECTIONS.inc()
+            return FALLBACK_RESPONSE
+        # Cleaning may trim characters that were already sent; only the remainder can be added
+        if cleaned.startswith(sent):
+            return self._release(len(cleaned), cleaned)
+        return ""
+
+    def _release(self, end, text=None):
+        text = self.text if text is None else text
+        if end <= self.emitted:
+            return ""
+        delta = text[self.emitted:end]
+        self.emitted = end
+        return delta
+
+
 # =========================================================
-# 3️⃣  Load model (same approach as working diagnostic)
+# 2.5️⃣  Continuous batching engine
 # =========================================================
-print("====================================================================")
-print(f"🚀 Starting {MODEL_NAME} API Server on Vast.ai")
-print("====================================================================")
-
-# Verify model folder
-if not os.path.exists(MODEL_DIR):
-    raise FileNotFoundError(f"❌ Model folder not found at: {MODEL_DIR}")
-
-# Check tokenizer files
-tok_path = os.path.join(MODEL_DIR, "tokenizer.json")
-if not os.path.exists(tok_path):
-    raise FileNotFoundError(f"❌ Missing tokenizer.json in {MODEL_DIR}")
-
-print("🔍 Loading tokenizer...")
-tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR, trust_remote_code=False)
-
-if tokenizer.pad_token is None:
-    tokenizer.pad_token = tokenizer.eos_token
-
-print("🔍 Loading model weights (this may take a while)...")
-print("   Using exact same approach that worked in diagnostics...")
-
-try:
-    # Use exact same parameters as working inference.py from reference
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"Using device: {device}")
-    
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_DIR,
-        torch_dtype=torch.float16 if device.type == "cuda" else torch.float32,
-        device_map="auto" if device.type == "cuda" else None,
-        trust_remote_code=False,
-        low_cpu_mem_usage=True
-    )
-    
-    # Move to device if not using device_map
-    if device.type == "cpu" or model.device.type == "cpu":
-        model = model.to(device)
-    
-    model.eval()
-    print("✅ Model loaded successfully!")
-    print(f"   Model device: {next(model.parameters()).device}")
-    print(f"   Model dtype: {next(model.parameters()).dtype}")
+def _to_legacy_cache(past_key_values):
+    """Return the KV cache as a tuple of (key, value) tensors per layer"""
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+
+def _from_legacy_cache(past_key_values):
+    """Wrap a legacy tuple cache in the Cache object the model expects"""
+    return DynamicCache.from_legacy_cache(past_key_values)
+
+
+class SlotKVCache(Cache):
+    """
+    Preallocated KV cache for the decode batch, written in place.
+
+    Row i holds the i-th active sequence, right-aligned so that every row ends
+    at the shared write column `end`. A decode step writes each sequence's new
+    keys/values into that column and attention reads a view of the columns
+    spanning the longest sequence, with the leading columns of shorter rows
+    masked out (the same left padding generate() uses). Nothing is padded,
+    stacked or copied per token: buffers are only compacted or regrown when
+    `end` reaches their capacity, and a retiring sequence's row is refilled by
+    moving the last row into it. Only touched from the engine thread.
+    """
+
+    def __init__(self, max_rows, initial_tokens=KV_CACHE_INITIAL_TOKENS):
+        super().__init__()
+        self.max_rows = max_rows
+        self.initial_tokens = initial_tokens
+        self.key_buffers = []  # Per layer: (rows, kv_heads, capacity, head_dim)
+        self.value_buffers = []
+        self.lengths = []  # Cached positions per active row
+        self.end = 0  # Column the next decode token is written to
+        self.window = 0  # Longest active sequence during the current step
+
+    @property
+    def rows(self):
+        return len(self.lengths)
+
+    @property
+    def capacity(self):
+        return self.key_buffers[0].shape[2] if self.key_buffers else 0
+
+    def _reserve(self, rows, columns, template):
+        """Grow the buffers (at least doubling) to hold `rows` sequences ending before column `columns`"""
+        have_rows = self.key_buffers[0].shape[0] if self.key_buffers else 0
+        have_columns = self.capacity
+        if rows <= have_rows and columns <= have_columns:
+            return
+        if rows > have_rows:
+            rows = min(self.max_rows, max(rows, 2 * have_rows))
+        else:
+            rows = have_rows
+        columns = max(columns, 2 * have_columns if columns > have_columns else have_columns, self.initial_tokens)
+        start = self.end - max(self.lengths, default=0)
+        for layer, (key, value) in enumerate(template):
+            shape = (rows, key.shape[1], columns, key.shape[3])
+            new_key = torch.zeros(shape, dtype=key.dtype, device=key.device)
+            new_value = torch.zeros(shape, dtype=value.dtype, device=value.device)
+            if self.rows:
+                new_key[:self.rows, :, start:self.end] = self.key_buffers[layer][:self.rows, :, start:self.end]
+                new_value[:self.rows, :, start:self.end] = self.value_buffers[layer][:self.rows, :, start:self.end]
+            if layer < len(self.key_buffers):
+                self.key_buffers[layer], self.value_buffers[layer] = new_key, new_value
+            else:
+                self.key_buffers.append(new_key)
+                self.value_buffers.append(new_value)
+
+    def _layer_buffers(self):
+        return [(key, value) for key, value in zip(self.key_buffers, self.value_buffers)]
+
+    def _shift(self, delta):
+        """Move every row's cached columns `delta` columns right (negative: left)"""
+        start = self.end - max(self.lengths)
+        for buffer in self.key_buffers + self.value_buffers:
+            buffer[:self.rows, :, start + delta:self.end + delta] = buffer[:self.rows, :, start:self.end].clone()
+        self.end += delta
+
+    def admit(self, past_key_values, length):
+        """Copy a prefilled legacy cache of `length` positions into a new last row"""
+        if not self.rows:
+            self.end = length
+        shift = max(0, length - self.end)
+        self._reserve(self.rows + 1, self.end + shift + 1, self._layer_buffers() or past_key_values)
+        if shift:
+            self._shift(shift)
+        row = self.rows
+        for layer, (key, value) in enumerate(past_key_values):
+            self.key_buffers[layer][row, :, self.end - length:self.end] = key[0, :, :length]
+            self.value_buffers[layer][row, :, self.end - length:self.end] = value[0, :, :length]
+        self.lengths.append(length)
+        return row
+
+    def remove(self, row):
+        """Retire a row by moving the last row into its place"""
+        last = self.rows - 1
+        if row != last:
+            length = self.lengths[last]
+            for buffer in self.key_buffers + self.value_buffers:
+                buffer[row, :, self.end - length:self.end] = buffer[last, :, self.end - length:self.end]
+            self.lengths[row] = length
+        self.lengths.pop()
+
+    def clear(self):
+        self.lengths = []
+        self.end = self.window = 0
+
+    def prepare_step(self, device):
+        """Make room for one more column; return the step's attention mask and position ids"""
+        self.window = max(self.lengths)
+        if self.end + 1 > self.capacity:
+            # Compact so the longest row starts at column 0, then keep at least half
+            # a window of headroom so compactions stay rare relative to decode steps
+            self._shift(self.window - self.end)
+            self._reserve(self.rows, self.end + max(self.end // 2, 64) + 1, self._layer_buffers())
+        attention_mask = torch.zeros((self.rows, self.window + 1), dtype=torch.long, device=device)
+        for i, length in enumerate(self.lengths):
+            attention_mask[i, self.window - length:] = 1
+        position_ids = torch.tensor([[length] for length in self.lengths], device=device)
+        return attention_mask, position_ids
+
+    def finish_step(self):
+        self.end += 1
+        self.lengths = [length + 1 for length in self.lengths]
+
+    def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+        """Called by each attention layer: store the new token in place and return the step's view"""
+        keys, values = self.key_buffers[layer_idx], self.value_buffers[layer_idx]
+        keys[:self.rows, :, self.end] = key_states[:, :, -1]
+        values[:self.rows, :, self.end] = value_states[:, :, -1]
+        start = self.end - self.window
+        return keys[:self.rows, :, start:self.end + 1], values[:self.rows, :, start:self.end + 1]
+
+    def get_seq_length(self, layer_idx=0):
+        return self.window
+
+    def get_max_length(self):
+        return None
+
+    def get_max_cache_shape(self):
+        return None
+
+
+def _common_prefix_length(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+def _slice_cache(past_key_values, length):
+    """Keep the first `length` positions of a legacy KV cache (views, no copy)"""
+    return tuple((key[:, :, :length, :], value[:, :, :length, :]) for key, value in past_key_values)
+
+
+class PrefixCache:
+    """
+    LRU of prefill KV caches keyed by prompt token ids.
+
+    Lookups match the longest common token prefix with any stored prompt, so the
+    shared Medarion system prompt and earlier turns of a conversation are not
+    prefilled again. Pinned entries (the system prompt) are never evicted; the
+    rest are evicted least-recently-used once the token budget is exceeded.
+    Only touched from the engine thread.
+    """
+
+    def __init__(self, max_tokens=PREFIX_CACHE_MAX_TOKENS, min_tokens=PREFIX_CACHE_MIN_TOKENS):
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.entries = OrderedDict()  # tuple(token_ids) -> (past_key_values, pinned)
+        self.cached_tokens = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    def lookup(self, input_ids):
+        """Return (prefix_length, past_key_values) for the best reusable prefix, or (0, None)"""
+        best_key, best_length = None, 0
+        for key in self.entries:
+            length = _common_prefix_length(key, input_ids)
+            if length > best_length:
+                best_key, best_length = key, length
+        # At least one token must still go through the model to produce next-token logits
+        best_length = min(best_length, len(input_ids) - 1)
+        if best_key is None or best_length < self.min_tokens:
+            self.misses += 1
+            return 0, None
+
+        self.entries.move_to_end(best_key)
+        self.hits += 1
+        self.reused_tokens += best_length
+        past, _ = self.entries[best_key]
+        return best_length, _slice_cache(past, best_length)
+
+    def insert(self, input_ids, past_key_values, pinned=False):
+        key = tuple(input_ids)
+        if len(key) < self.min_tokens or key in self.entries:
+            return
+        if not pinned and len(key) > self.max_tokens:
+            return
+        self.entries[key] = (past_key_values, pinned)
+        self.cached_tokens += len(key)
+        self._evict()
+
+    def _evict(self):
+        for key in list(self.entries):
+            if self.cached_tokens <= self.max_tokens:
+                break
+            if self.entries[key][1]:
+                continue
+            del self.entries[key]
+            self.cached_tokens -= len(key)
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "cached_tokens": self.cached_tokens,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens,
+        }
+
+
+class GenerationRequest:
+    """
+    A single sequence tracked by the batching engine.
+
+    Sampling parameters mirror the model.generate() arguments previously used
+    by /chat and /generate so responses stay equivalent.
+    """
+
+    def __init__(self, input_ids, max_new_tokens, temperature=0.7, top_p=1.0,
+                 repetition_penalty=1.1, no_repeat_ngram_size=0, stream=False,
+                 timeout=REQUEST_TIMEOUT, stop_sequences=(), stop_patterns=True):
+        self.input_ids = list(input_ids)
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = temperature > 0
+
+        self.logits_processor = LogitsProcessorList()
+        if repetition_penalty and repetition_penalty != 1.0:
+            self.logits_processor.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+        if no_repeat_ngram_size > 0:
+            self.logits_processor.append(NoRepeatNGramLogitsProcessor(no_repeat_ngram_size))
+        if self.do_sample:
+            self.logits_processor.append(TemperatureLogitsWarper(temperature))
+            if top_p < 1.0:
+                self.logits_processor.append(TopPLogitsWarper(top_p))
+
+        # Checked after every sampled token so stop markers end decoding immediately
+        self.stop_sequences = list(stop_sequences)
+        self.cache_key = None  # Set by the handler when the finished response may be cached
+        self.stopping_criteria = None
+        if stop_patterns or self.stop_sequences:
+            self.stopping_criteria = StopSequenceCriteria(
+                tokenizer, self.stop_sequences, use_builtin_patterns=stop_patterns)
+
+        self.generated_ids = []
+        self.finish_reason = None
+        self.error = None
+        self.done = threading.Event()
+        self.cancelled = False
+        # Timestamps for latency metrics (time.monotonic)
+        self.submitted_at = time.monotonic()
+        self.admitted_at = None
+        self.first_token_at = None
+        self.deadline = time.monotonic() + timeout if timeout else None
+        # Streaming consumers read token ids as they are sampled; None marks the end
+        self.token_queue = queue.Queue() if stream else None
+
+    def cancel(self):
+        """Ask the engine to retire this sequence at the next step boundary"""
+        self.cancelled = True
+
+    @property
+    def expired(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    @property
+    def cache_length(self):
+        # The most recent token has been sampled but not yet fed through the model
+        return len(self.input_ids) + len(self.generated_ids) - 1
+
+
+class ContinuousBatchingEngine:
+    """
+    Step-level scheduler that shares one forward pass across all in-flight requests.
+
+    New requests are prefilled and admitted between decode steps, and finished
+    sequences are retired immediately instead of waiting for the longest one.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=MAX_BATCH_SIZE, pinned_prefixes=()):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max(1, max_batch_size)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.pending = queue.Queue()
+        self.active = []  # Index i is row i of the shared KV cache
+        self.kv = SlotKVCache(self.max_batch_size)
+        self.prefix_cache = PrefixCache()
+        # Prefill shared prefixes before the loop starts so no request races the warm-up
+        for prefix_ids in pinned_prefixes:
+            self._pin_prefix(prefix_ids)
+        self._thread = threading.Thread(target=self._loop, name="batching-engine", daemon=True)
+        self._thread.start()
+
+    def submit(self, req):
+        """Queue a request; it joins the running batch at the next step boundary"""
+        req.submitted_at = time.monotonic()
+        self.pending.put(req)
+        return req
+
+    def generate(self, req):
+        """Submit a request and block the calling handler thread until it finishes"""
+        self.submit(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req
+
+    def _loop(self):
+        while True:
+            if not self.active:
+                # Nothing in flight: sleep until a request arrives
+                self._admit(self.pending.get())
+            while len(self.active) < self.max_batch_size:
+                try:
+                    self._admit(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            self._retire_cancelled()
+            if not self.active:
+                continue
+            try:
+                self._decode_step()
+            except Exception as e:
+                print(f"[Engine] Decode step failed: {e}")
+                for req in self.active:
+                    self._finish(req, error=e)
+                self.active = []
+                self.kv.clear()
+
+    def _retire_cancelled(self):
+        """Drop sequences whose client went away or whose time budget ran out"""
+        for req in self.active:
+            if req.cancelled:
+                self._finish(req, finish_reason="cancelled")
+            elif req.expired:
+                self._finish(req, finish_reason="timeout")
+        self._drop_finished()
+
+    def _drop_finished(self):
+        """Remove retired sequences, keeping self.active aligned with the KV cache rows"""
+        for row in range(len(self.active) - 1, -1, -1):
+            if self.active[row].done.is_set():
+                self.kv.remove(row)
+                self.active[row] = self.active[-1]
+                self.active.pop()
+
+    def _pin_prefix(self, prefix_ids):
+        with torch.no_grad():
+            input_ids = torch.tensor([list(prefix_ids)], device=self.model.device)
+            out = self.model(input_ids=input_ids, use_cache=True)
+        self.prefix_cache.insert(prefix_ids, _to_legacy_cache(out.past_key_values), pinned=True)
+        print(f"[Engine] Cached KV for shared prefix ({len(prefix_ids)} tokens)")
+
+    def _admit(self, req):
+        """Run prefill for a new request and add it to the decode batch"""
+        if req.cancelled:
+            self._finish(req, finish_reason="cancelled")
+            return
+        if req.expired:
+            self._finish(req, finish_reason="timeout")
+            return
+        req.admitted_at = time.monotonic()
+        QUEUE_WAIT_SECONDS.observe(req.admitted_at - req.submitted_at)
+        PROMPT_TOKENS.observe(len(req.input_ids))
+        try:
+            # Start prefill from the longest cached prefix and only run the remaining tokens
+            prefix_length, past = self.prefix_cache.lookup(req.input_ids)
+            with torch.no_grad():
+                input_ids = torch.tensor([req.input_ids[prefix_length:]], device=self.model.device)
+                out = self.model(
+                    input_ids=input_ids,
+                    past_key_values=_from_legacy_cache(past) if past is not None else None,
+                    use_cache=True,
+                )
+            if prefix_length:
+                print(f"[Engine] Reused cached prefix: {prefix_length}/{len(req.input_ids)} prompt tokens")
+            past = _to_legacy_cache(out.past_key_values)
+            self.prefix_cache.insert(req.input_ids, past)
+            self._append_token(req, out.logits[:, -1, :])
+            if not req.done.is_set():
+                self.kv.admit(past, len(req.input_ids))
+                self.active.append(req)
+        except Exception as e:
+            print(f"[Engine] Prefill failed: {e}")
+            self._finish(req, error=e)
+
+    def _decode_step(self):
+        """Advance every active sequence by one token with a single forward pass"""
+        batch = self.active
+        device = self.model.device
+        attention_mask, position_ids = self.kv.prepare_step(device)
+        input_ids = torch.tensor([[req.generated_ids[-1]] for req in batch], device=device)
+
+        with torch.no_grad():
+            out = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=self.kv,
+                use_cache=True,
+            )
+        self.kv.finish_step()
+
+        for i, req in enumerate(batch):
+            self._append_token(req, out.logits[i:i + 1, -1, :])
+        self._drop_finished()
+
+    def _append_token(self, req, logits):
+        """Apply the request's logits processors, pick the next token and check for completion"""
+        seen = torch.tensor([req.input_ids + req.generated_ids], device=logits.device)
+        scores = req.logits_processor(seen, logits.float())
+        if req.do_sample:
+            next_token = int(torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).item())
+        else:
+            next_token = int(scores.argmax(dim=-1).item())
+        req.generated_ids.append(next_token)
+        if req.first_token_at is None:
+            req.first_token_at = time.monotonic()
+            PREFILL_SECONDS.observe(req.first_token_at - req.admitted_at)
+            TIME_TO_FIRST_TOKEN_SECONDS.observe(req.first_token_at - req.submitted_at)
+        if req.token_queue is not None:
+            req.token_queue.put(next_token)
+
+        if next_token == self.eos_token_id:
+            self._finish(req, finish_reason="stop")
+        elif req.stopping_criteria is not None and req.stopping_criteria.feed_token(next_token):
+            self._finish(req, finish_reason="stop")
+        elif len(req.generated_ids) >= req.max_new_tokens:
+            self._finish(req, finish_reason="length")
+
+    def _finish(self, req, finish_reason=None, error=None):
+        GENERATIONS_TOTAL.inc("error" if error is not None else finish_reason)
+        if req.first_token_at is not None:
+            decode_seconds = time.monotonic() - req.first_token_at
+            DECODE_SECONDS.observe(decode_seconds)
+            COMPLETION_TOKENS.observe(len(req.generated_ids))
+            if decode_seconds > 0 and len(req.generated_ids) > 1:
+                DECODE_TOKENS_PER_SECOND.observe((len(req.generated_ids) - 1) / decode_seconds)
+        req.finish_reason = finish_reason
+        req.error = error
+        req.done.set()
+        if req.token_queue is not None:
+            req.token_queue.put(None)
+
+
+# =========================================================
+# 2.7️⃣  Response cache for repeated questions
+# =========================================================
+# Request fields (besides the messages/prompt) that change the generated answer
+RESPONSE_CACHE_PARAM_KEYS = ("max_tokens", "max_new_tokens", "temperature", "top_p", "repetition_penalty", "stop")
+
+
+def response_cache_key(endpoint, data):
+    """
+    Cache key for a normalized /chat or /generate body, or None if the request
+    must not be cached (streaming, opted out, or sampled above the temperature limit).
+    """
+    if response_cache is None or data.get("stream") or data.get("cache") is False:
+        return None
+    try:
+        if float(data.get("temperature", 0.7)) > RESPONSE_CACHE_MAX_TEMPERATURE:
+            return None
+    except (TypeError, ValueError):
+        return None
+
+    normalized = {
+        "endpoint": endpoint,
+        "model": MODEL_NAME,
+        "params": {key: data[key] for key in RESPONSE_CACHE_PARAM_KEYS if key in data},
+    }
+    if endpoint == "/chat":
+        normalized["messages"] = [
+            {"role": str(msg.get("role", "user")).strip().lower(), "content": " ".join(str(msg.get("content", "")).split())}
+            for msg in data.get("messages", [])
+        ]
+    else:
+        normalized["prompt"] = " ".join(str(data.get("prompt", "")).split())
+    encoded = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of finished response payloads.
+
+    Entries live in memory and, when a path is given, in a SQLite file so they
+    survive restarts. Both tiers are bounded by max_entries; expired entries
+    are dropped on read and purged at startup.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, path=RESPONSE_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory = OrderedDict()  # key -> (created_at, payload)
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self.db = sqlite3.connect(path, check_same_thread=False)
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created_at REAL, payload TEXT)")
+                self.db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️  Response cache disk store disabled: {e}")
+                self.db = None
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None and self.db is not None:
+                row = self.db.execute("SELECT created_at, payload FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], json.loads(row[1]))
+                    self.memory[key] = entry
+            if entry is not None and now - entry[0] > self.ttl:
+                self._delete(key)
+                entry = None
+            if entry is None:
+                RESPONSE_CACHE_REQUESTS.inc("miss")
+                return None
+            self.memory.move_to_end(key)
+            self._trim_memory()
+        RESPONSE_CACHE_REQUESTS.inc("hit")
+        return entry[1]
+
+    def put(self, key, payload):
+        created_at = time.time()
+        with self.lock:
+            self.memory[key] = (created_at, payload)
+            self.memory.move_to_end(key)
+            self._trim_memory()
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO responses (key, created_at, payload) VALUES (?, ?, ?)",
+                    (key, created_at, json.dumps(payload, ensure_ascii=False)))
+                self.db.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY created_at DESC LIMIT ?)", (self.max_entries,))
+                self.db.commit()
+
+    def _delete(self, key):
+        self.memory.pop(key, None)
+        if self.db is not None:
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.db.commit()
+
+    def _trim_memory(self):
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self.memory), "max_entries": self.max_entries, "ttl_seconds": self.ttl}
+
+
+response_cache = ResponseCache() if RESPONSE_CACHE_SIZE > 0 else None
+
+
+# =========================================================
+# 3️⃣  Load model in the background (same approach as working diagnostic)
+# =========================================================
+# The server binds immediately; /health reports this state and generation
+# endpoints answer 503 until status is "ready".
+MODEL_LOAD_STATE = {
+    "status": "starting",  # starting -> loading -> ready | failed
+    "stage": "pending",
+    "progress": None,
+    "error": None,
+    "started_at": None,
+    "ready_at": None,
+}
+engine = None
+_model_loader = None
+_model_loader_lock = threading.Lock()
+
+
+def set_load_stage(stage, progress=None):
+    MODEL_LOAD_STATE["stage"] = stage
+    MODEL_LOAD_STATE["progress"] = progress
+
+
+def model_ready():
+    return MODEL_LOAD_STATE["status"] == "ready"
+
+
+def _has_safetensors(path):
+    return os.path.isdir(path) and any(name.endswith(".safetensors") for name in os.listdir(path))
+
+
+def resolve_weights_dir():
+    """Prefer the pre-converted safetensors copy (memory-mapped on load) when it exists"""
+    if _has_safetensors(SAFETENSORS_DIR) and os.path.exists(os.path.join(SAFETENSORS_DIR, "config.json")):
+        return SAFETENSORS_DIR
+    return MODEL_DIR
+
+
+def shared_system_prefix_ids():
+    """
+    Token ids every /chat prompt starts with when the Medarion system message is added.
+    Found by rendering two probe conversations and keeping their common token prefix,
+    so it works with the chat template and the plain-text fallback alike.
+    """
+    probes = [
+        tokenizer(build_chat_prompt([MEDARION_SYSTEM_MESSAGE, {"role": "user", "content": probe}], verbose=False))["input_ids"]
+        for probe in ("Hello", "What")
+    ]
+    return probes[0][:_common_prefix_length(*probes)]
+
+
+def load_model():
+    """Download (if needed) and load tokenizer and weights, then start the batching engine"""
+    global tokenizer, model, engine
+
+    MODEL_LOAD_STATE["status"] = "loading"
+    MODEL_LOAD_STATE["started_at"] = time.time()
+    print("====================================================================")
+    print(f"🚀 Loading {MODEL_NAME} in the background")
     print("====================================================================")
-except Exception as e:
-    print(f"❌ Model load failed: {e}")
-    import traceback
-    traceback.print_exc()
-    sys.exit(1)
+
+    try:
+        weights_dir = resolve_weights_dir()
+        if weights_dir == MODEL_DIR:
+            # No converted copy yet: fetch and unpack the original checkpoint
+            set_load_stage("downloading")
+            setup_model_from_s3()
+
+        # Verify model folder
+        if not os.path.exists(weights_dir):
+            raise FileNotFoundError(f"❌ Model folder not found at: {weights_dir}")
+
+        # Check tokenizer files
+        tok_path = os.path.join(weights_dir, "tokenizer.json")
+        if not os.path.exists(tok_path):
+            raise FileNotFoundError(f"❌ Missing tokenizer.json in {weights_dir}")
+
+        set_load_stage("loading_tokenizer")
+        print("🔍 Loading tokenizer...")
+        loaded_tokenizer = AutoTokenizer.from_pretrained(weights_dir, trust_remote_code=False)
+
+        if loaded_tokenizer.pad_token is None:
+            loaded_tokenizer.pad_token = loaded_tokenizer.eos_token
+
+        set_load_stage("loading_weights")
+        print(f"🔍 Loading model weights from {weights_dir} (this may take a while)...")
+        print("   Using exact same approach that worked in diagnostics...")
+
+        # Use exact same parameters as working inference.py from reference
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        print(f"Using device: {device}")
+        
+        loaded_model = AutoModelForCausalLM.from_pretrained(
+            weights_dir,
+            torch_dtype=torch.float16 if device.type == "cuda" else torch.float32,
+            device_map="auto" if device.type == "cuda" else None,
+            trust_remote_code=False,
+            low_cpu_mem_usage=True,
+            use_safetensors=True if _has_safetensors(weights_dir) else None,
+        )
+        
+        # Move to device if not using device_map
+        if device.type == "cpu" or loaded_model.device.type == "cpu":
+            loaded_model = loaded_model.to(device)
+        
+        loaded_model.eval()
+        tokenizer, model = loaded_tokenizer, loaded_model
+        print("✅ Model loaded successfully!")
+        print(f"   Model device: {next(model.parameters()).device}")
+        print(f"   Model dtype: {next(model.parameters()).dtype}")
+
+        set_load_stage("warming_prefix_cache")
+        engine = ContinuousBatchingEngine(model, tokenizer, pinned_prefixes=[shared_system_prefix_ids()])
+        print(f"✅ Continuous batching engine started (max batch size: {engine.max_batch_size})")
+
+        MODEL_LOAD_STATE.update(status="ready", stage="ready", progress=1.0, ready_at=time.time())
+        print(f"✅ Ready in {MODEL_LOAD_STATE['ready_at'] - MODEL_LOAD_STATE['started_at']:.1f}s")
+        print("====================================================================")
+    except Exception as e:
+        MODEL_LOAD_STATE.update(status="failed", error=str(e))
+        print(f"❌ Model load failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return
+
+    if CONVERT_TO_SAFETENSORS and weights_dir != SAFETENSORS_DIR and not _has_safetensors(MODEL_DIR):
+        # One-time conversion so the next restart can memory-map the weights
+        try:
+            print(f"💾 Saving safetensors copy to {SAFETENSORS_DIR} for faster restarts...")
+            model.save_pretrained(SAFETENSORS_DIR, safe_serialization=True)
+            tokenizer.save_pretrained(SAFETENSORS_DIR)
+            print("✅ Safetensors copy saved")
+        except Exception as e:
+            print(f"⚠️  Safetensors conversion failed: {e}")
+
+
+def start_model_loading():
+    """Start the background loader once; safe to call from every entrypoint"""
+    global _model_loader
+    with _model_loader_lock:
+        if _model_loader is None:
+            _model_loader = threading.Thread(target=load_model, name="model-loader", daemon=True)
+            _model_loader.start()
+
+
+METRICS.register(MetricGauge(
+    "medarion_model_ready", "1 once the model is loaded and serving", lambda: int(model_ready())))
+METRICS.register(MetricGauge(
+    "medarion_active_sequences", "Sequences in the current decode batch", lambda: len(engine.active)))
+METRICS.register(MetricGauge(
+    "medarion_pending_requests", "Requests waiting for admission to the decode batch", lambda: engine.pending.qsize()))
 
 
 # =========================================================
-# 4️⃣  API Routes
+# 4️⃣  Request handling (shared by Flask and ASGI modes)
 # =========================================================
+class APIError(Exception):
+    """Error with an HTTP status, rendered as {"error": message} by both servers"""
 
-@app.route("/health", methods=["GET"])
-def health_check():
-    # Health check is public (no auth required) for monitoring and connectivity testing
-    # Verify model is actually loaded
-    if model is None or tokenizer is None:
-        return jsonify({
-            "status": "error",
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+def health_status():
+    """Return (payload, status) for /health"""
+    # Still starting up or failed: report load progress so orchestrators can tell "starting" from "dead"
+    if not model_ready():
+        started_at = MODEL_LOAD_STATE["started_at"]
+        return {
+            "status": "error" if MODEL_LOAD_STATE["status"] == "failed" else "loading",
             "model": MODEL_NAME,
-            "error": "Model not loaded"
-        }), 503
+            "stage": MODEL_LOAD_STATE["stage"],
+            "progress": MODEL_LOAD_STATE["progress"],
+            "elapsed_seconds": round(time.time() - started_at, 1) if started_at else 0,
+            "error": MODEL_LOAD_STATE["error"] or "Model not loaded",
+            "inference_ready": False
+        }, 503
     
     # Check if model is on GPU/CPU
     try:
         device = str(next(model.parameters()).device)
-        return jsonify({
+        return {
             "status": "ok",
             "model": MODEL_NAME,
             "device": device,
-            "inference_ready": True
-        }), 200
+            "inference_ready": True,
+            "prefix_cache": engine.prefix_cache.stats(),
+            "response_cache": response_cache.stats() if response_cache is not None else None
+        }, 200
     except Exception as e:
-        return jsonify({
+        return {
             "status": "error",
             "model": MODEL_NAME,
             "error": str(e)
-        }), 503
+        }, 503
+
+
+def require_model_ready():
+    """Gate generation endpoints until the background loader has finished"""
+    if MODEL_LOAD_STATE["status"] == "failed":
+        raise APIError(503, f"Model failed to load: {MODEL_LOAD_STATE['error']}")
+    if not model_ready():
+        raise APIError(503, f"Model is loading ({MODEL_LOAD_STATE['stage']})", retry_after=RETRY_AFTER_SECONDS)
+
+
+def _raise_for_result(result):
+    if result.finish_reason == "timeout":
+        raise APIError(504, f"Generation timed out after {REQUEST_TIMEOUT:.0f}s")
+
+
+def prepare_generate(data):
+    """Validate a /generate body and build its engine request"""
+    require_model_ready()
+    prompt = data.get("prompt", "").strip()
+
+    if not prompt:
+        raise APIError(400, "Missing 'prompt'")
+
+    # Use higher max_tokens for complete responses (no truncation)
+    max_new_tokens = int(data.get("max_new_tokens", 1024))
+    temperature = float(data.get("temperature", 0.7))
+
+    # Tokenize
+    inputs = tokenizer(prompt)
+    
+    # Generate via the shared batching engine (stops at EOS token)
+    gen_req = GenerationRequest(
+        inputs["input_ids"],
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        top_p=0.9,
+        repetition_penalty=1.15,  # Prevent repetition
+        no_repeat_ngram_size=3,  # Prevent 3-gram repetition
+        stop_sequences=parse_stop_sequences(data.get("stop")),
+    )
+    gen_req.cache_key = response_cache_key("/generate", data)
+    return prompt, gen_req
+
+
+def finish_generate(prompt, result):
+    """Build the /generate response from a finished engine request"""
+    _raise_for_result(result)
+
+    # Decode only the generated part (prompt tokens are never returned by the engine)
+    response = tokenizer.decode(result.generated_ids, skip_special_tokens=True).strip()
+    response = truncate_at_stop_sequences(response, result.stop_sequences)
+
+    # Decoding halts as soon as a stop pattern appears; drop the marker itself
+    stop_index = find_stop_pattern(response)
+    if stop_index is not None:
+        response = response[:stop_index].rstrip()
+        STOP_PATTERN_TRUNCATIONS.inc()
+    
+    # Clean up trailing gibberish and ensure complete response
+    response = clean_response(response)
+    
+    payload = {
+        "prompt": prompt,
+        "response": response
+    }
+    if result.cache_key is not None and result.finish_reason == "stop" and response:
+        response_cache.put(result.cache_key, payload)
+    return payload
+
+
+def prepare_chat(data):
+    """Validate a /chat body, render the prompt and build its engine request"""
+    require_model_ready()
+    messages = data.get("messages", [])
+    
+    if not messages:
+        raise APIError(400, "Missing 'messages'")
+    
+    # Add system message to establish Medarion's identity and purpose
+    # This ensures the fine-tuned model knows who it is and what it does
+    has_system = any(msg.get("role") == "system" for msg in messages)
+    if not has_system:
+        messages = [MEDARION_SYSTEM_MESSAGE] + messages
+        print("[API] Added system message for Medarion identity")
+    
+    prompt = build_chat_prompt(messages)
+    
+    # Tokenize (matching inference.py - with truncation and max_length)
+    inputs = tokenizer(
+        prompt,
+        truncation=True,
+        max_length=32768  # Mistral max context
+    )
+    
+    input_token_count = len(inputs["input_ids"])
+    print(f"[API] Input tokens: {input_token_count}")
+    
+    # Generation parameters (matching working inference.py)
+    max_new_tokens = int(data.get("max_tokens", data.get("max_new_tokens", 4000)))
+    temperature = float(data.get("temperature", 0.7))
+    top_p = float(data.get("top_p", 1.0))
+    repetition_penalty = float(data.get("repetition_penalty", 1.1))
+    
+    print(f"[API] Generating with temperature={temperature}, max_tokens={max_new_tokens}, top_p={top_p}, repetition_penalty={repetition_penalty}")
+    
+    gen_req = GenerationRequest(
+        inputs["input_ids"],
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        repetition_penalty=repetition_penalty,
+        stream=bool(data.get("stream", False)),
+        stop_sequences=parse_stop_sequences(data.get("stop")),
+    )
+    gen_req.cache_key = response_cache_key("/chat", data)
+    return gen_req, input_token_count
+
+
+def finish_chat(result, input_token_count):
+    """Post-process a finished /chat request into the OpenAI-compatible payload"""
+    _raise_for_result(result)
+
+    # Engine returns only generated tokens (matching inference.py)
+    generated_tokens = result.generated_ids
+    response = tokenizer.decode(
+        generated_tokens,
+        skip_special_tokens=True
+    ).strip()
+    
+    completion_token_count = len(generated_tokens)
+    print(f"[API] Generated {completion_token_count} tokens")
+    
+    # Client-supplied stop strings are cut exactly, like the OpenAI API
+    response = truncate_at_stop_sequences(response, result.stop_sequences)
+    
+    # Remove chat template artifacts (shared with StreamingResponseFilter)
+    response = response.replace("</s>", "").replace("<s>", "")
+    start, end = chat_artifact_span(response)
+    response = response[start:end].strip()
+    
+    # Stop at training data patterns, JavaScript code, and footer/boilerplate text BEFORE cleaning
+    earliest_index = find_stop_pattern(response)
+    
+    # If we found a stop pattern, keep only the complete sentences before it
+    if earliest_index is not None:
+        response = response[:cut_before_stop_pattern(response, earliest_index)].strip()
+        STOP_PATTERN_TRUNCATIONS.inc()
+        print(f"[API] Stopped at pattern, extracted {len(response)} chars")
+    
+    # Log raw response before any cleaning
+    print(f"[API] Raw generated response (before cleaning): {len(response)} chars")
+    print(f"[API] Raw response preview: {response[:200]}")
+    
+    # Clean up trailing gibberish and incomplete text (gentle cleaning)
+    # Trust the fine-tuned Medarion model output - only remove actual garbage
+    response = clean_response(response)
+    print(f"[API] After clean_response(): {len(response)} chars")
+    
+    # Final validation: Ensure response is not empty and has valid content
+    if not response or len(response.strip()) < 3:
+        response = FALLBACK_RESPONSE
+        print("[API] Warning: Empty or too short response, using fallback")
+    
+    # Additional validation: Reject responses that are mostly punctuation/special chars
+    if response and len(response.strip()) > 0:
+        valid_percent = valid_char_percent(response)
+        print(f"[API] Validation: {valid_percent:.1f}% valid chars")
+        if valid_percent < 30:  # Less than 30% valid characters
+            GIBBERISH_REJECTIONS.inc()
+            print(f"[API] Warning: Response is mostly gibberish ({valid_percent:.1f}% valid), rejecting")
+            print(f"[API] Rejected response content: {response[:200]}")
+            response = FALLBACK_RESPONSE
+            print(f"[API] Using fallback message: {response}")
+    
+    # Log response length for monitoring (fine-tuned model should produce good responses)
+    print(f"[API] Generated response: {len(response)} chars (fine-tuned Medarion model)")
+    
+    # Return OpenAI-compatible format with usage stats (matching inference.py)
+    payload = {
+        "choices": [{
+            "message": {
+                "role": "assistant",
+                "content": response
+            },
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": input_token_count,
+            "completion_tokens": completion_token_count,
+            "total_tokens": input_token_count + completion_token_count
+        }
+    }
+    # Failed generations are not cached so a retry gets a fresh attempt
+    if result.cache_key is not None and result.finish_reason == "stop" and response != FALLBACK_RESPONSE:
+        response_cache.put(result.cache_key, payload)
+    return payload
+
+
+def lookup_cached_response(endpoint, data):
+    """Return a cached payload for this request body, or None"""
+    key = response_cache_key(endpoint, data)
+    if key is None:
+        return None
+    payload = response_cache.get(key)
+    if payload is not None:
+        print(f"[API] Response cache hit for {endpoint}")
+    return payload
+
+
+def _sse_event(payload):
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+class ChatCompletionStream:
+    """
+    Turns sampled token ids into OpenAI-compatible chat.completion.chunk SSE events.
+    The caller pulls tokens from the request's token queue and feeds them in.
+    """
+
+    def __init__(self, gen_req, input_token_count):
+        self.gen_req = gen_req
+        self.input_token_count = input_token_count
+        self.completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.created = int(time.time())
+        self.response_filter = StreamingResponseFilter(gen_req.stop_sequences)
+        self.detokenizer = IncrementalDetokenizer(tokenizer)
+        self.finished = False
+
+    def _chunk(self, delta, finish_reason=None, **extra):
+        return _sse_event({
+            "id": self.completion_id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": MODEL_NAME,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            **extra,
+        })
+
+    def start(self):
+        return self._chunk({"role": "assistant"})
+
+    def feed(self, token):
+        """Add one sampled token; returns the events it releases"""
+        if not self.detokenizer.add(token):
+            return []
+
+        events = []
+        delta = self.response_filter.update(self.detokenizer.text)
+        if delta:
+            events.append(self._chunk({"content": delta}))
+        if self.response_filter.done:
+            # Stop pattern or gibberish: no point decoding further
+            self.finished = True
+            self.gen_req.cancel()
+        return events
+
+    def finish(self):
+        """Events that close the stream once generation has ended"""
+        events = []
+        if self.gen_req.error is not None:
+            events.append(_sse_event({"error": str(self.gen_req.error)}))
+        elif self.gen_req.finish_reason == "timeout":
+            events.append(_sse_event({"error": f"Generation timed out after {REQUEST_TIMEOUT:.0f}s"}))
+        else:
+            delta = self.response_filter.finish()
+            if delta:
+                events.append(self._chunk({"content": delta}))
+            completion_token_count = len(self.detokenizer.token_ids)
+            print(f"[API] Streamed {completion_token_count} tokens")
+            events.append(self._chunk({}, "stop", usage={
+                "prompt_tokens": self.input_token_count,
+                "completion_tokens": completion_token_count,
+                "total_tokens": self.input_token_count + completion_token_count
+            }))
+        events.append("data: [DONE]\n\n")
+        return events
+
+
+# =========================================================
+# 5️⃣  Flask Routes
+# =========================================================
+def api_error_response(error):
+    response = jsonify({"error": error.message})
+    response.status_code = error.status
+    if error.retry_after is not None:
+        response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+@app.after_request
+def count_request(response):
+    REQUESTS_TOTAL.inc(endpoint_label(request.path), response.status_code)
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Metrics are public (no auth required) so Prometheus can scrape them
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/health", methods=["GET"])
+def health_check():
+    # Health check is public (no auth required) for monitoring and connectivity testing
+    payload, status = health_status()
+    return jsonify(payload), status
 
 
 @app.route("/generate", methods=["POST"])
@@ -425,56 +2061,20 @@ def generate_text():
     {
         "prompt": "Hello world",
         "max_new_tokens": 100,
-        "temperature": 0.7
+        "temperature": 0.7,
+        "stop": ["###"]  # optional extra stop strings
     }
     """
     try:
         data = request.get_json(force=True)
-        prompt = data.get("prompt", "").strip()
-
-        if not prompt:
-            return jsonify({"error": "Missing 'prompt'"}), 400
-
-        # Use higher max_tokens for complete responses (no truncation)
-        max_new_tokens = int(data.get("max_new_tokens", 1024))
-        temperature = float(data.get("temperature", 0.7))
-
-        # Tokenize
-        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-        
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                do_sample=True,
-                top_p=0.9,
-                pad_token_id=tokenizer.eos_token_id,
-                eos_token_id=tokenizer.eos_token_id,  # Stop at EOS token
-                repetition_penalty=1.15,  # Prevent repetition
-                no_repeat_ngram_size=3,  # Prevent 3-gram repetition
-            )
-
-        # Decode full output
-        full_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # Extract only the generated part (remove the prompt)
-        if full_text.startswith(prompt):
-            response = full_text[len(prompt):].strip()
-        else:
-            # If prompt not at start, extract only generated tokens
-            input_len = inputs["input_ids"].shape[1]
-            gen_tokens = outputs[0][input_len:]
-            response = tokenizer.decode(gen_tokens, skip_special_tokens=True).strip()
-        
-        # Clean up trailing gibberish and ensure complete response
-        response = clean_response(response)
-        
-        return jsonify({
-            "prompt": prompt,
-            "response": response
-        })
-
+        cached = lookup_cached_response("/generate", data)
+        if cached is not None:
+            return jsonify(cached)
+        prompt, gen_req = prepare_generate(data)
+        result = engine.generate(gen_req)
+        return jsonify(finish_generate(prompt, result))
+    except APIError as e:
+        return api_error_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -485,6 +2085,33 @@ def ping():
     return "pong", 200
 
 
+def stream_chat_completion(gen_req, input_token_count):
+    """
+    Stream an OpenAI-compatible chat.completion.chunk SSE response for a queued request
+    """
+    stream = ChatCompletionStream(gen_req, input_token_count)
+
+    def events():
+        engine.submit(gen_req)
+        try:
+            yield stream.start()
+            while not stream.finished:
+                token = gen_req.token_queue.get()
+                if token is None:
+                    break
+                yield from stream.feed(token)
+            yield from stream.finish()
+        finally:
+            # Client went away or we stopped early: free the batch slot
+            gen_req.cancel()
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/chat", methods=["POST"])
 def chat():
     """
@@ -493,7 +2120,9 @@ def chat():
     {
         "messages": [
             {"role": "user", "content": "Hello"}
-        ]
+        ],
+        "stream": false,  # true returns chat.completion.chunk server-sent events
+        "stop": ["\n\nUser:"]  # optional extra stop strings (OpenAI-compatible)
     }
     """
     # Check authentication (optional - can be disabled for testing)
@@ -503,233 +2132,294 @@ def chat():
     
     try:
         data = request.get_json(force=True)
-        messages = data.get("messages", [])
-        
-        if not messages:
-            return jsonify({"error": "Missing 'messages'"}), 400
-        
-        # Add system message to establish Medarion's identity and purpose
-        # This ensures the fine-tuned model knows who it is and what it does
-        has_system = any(msg.get("role") == "system" for msg in messages)
-        if not has_system:
-            system_message = {
-                "role": "system",
-                "content": "You are Medarion, an AI assistant specialized in African healthcare market intelligence. You provide insights on healthcare companies, investors, deals, grants, clinical trials, and regulatory information across Africa. You are knowledgeable about market trends, investment patterns, and healthcare innovation in African markets. Always identify yourself as Medarion when asked about your identity."
-            }
-            messages = [system_message] + messages
-            print("[API] Added system message for Medarion identity")
-        
-        # Use chat template if available (matching working inference.py)
-        if hasattr(tokenizer, "apply_chat_template") and tokenizer.chat_template:
-            try:
-                prompt = tokenizer.apply_chat_template(
-                    messages,
-                    tokenize=False,
-                    add_generation_prompt=True
-                )
-                print("[API] Used chat template for formatting")
-            except Exception as e:
-                print(f"[API] Chat template failed: {e}, using fallback")
-                # Fallback formatting (matching inference.py)
-                formatted = []
-                for msg in messages:
-                    role = msg.get("role", "user")
-                    content = msg.get("content", "")
-                    if role == "system":
-                        formatted.append(f"System: {content}")
-                    elif role == "user":
-                        formatted.append(f"User: {content}")
-                    elif role == "assistant":
-                        formatted.append(f"Assistant: {content}")
-                    else:
-                        formatted.append(f"{role.capitalize()}: {content}")
-                formatted.append("Assistant:")
-                prompt = "\n".join(formatted)
-        else:
-            # Fallback: format manually (matching inference.py)
-            formatted = []
-            for msg in messages:
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                if role == "system":
-                    formatted.append(f"System: {content}")
-                elif role == "user":
-                    formatted.append(f"User: {content}")
-                elif role == "assistant":
-                    formatted.append(f"Assistant: {content}")
-                else:
-                    formatted.append(f"{role.capitalize()}: {content}")
-            formatted.append("Assistant:")
-            prompt = "\n".join(formatted)
-        
-        # Tokenize (matching inference.py - with truncation and max_length)
-        inputs = tokenizer(
-            prompt,
-            return_tensors="pt",
-            truncation=True,
-            max_length=32768  # Mistral max context
-        ).to(model.device)
-        
-        input_token_count = inputs["input_ids"].shape[1]
-        print(f"[API] Input tokens: {input_token_count}")
-        
-        # Generation parameters (matching working inference.py)
-        max_new_tokens = int(data.get("max_tokens", data.get("max_new_tokens", 4000)))
-        temperature = float(data.get("temperature", 0.7))
-        top_p = float(data.get("top_p", 1.0))
-        repetition_penalty = float(data.get("repetition_penalty", 1.1))
-        
-        print(f"[API] Generating with temperature={temperature}, max_tokens={max_new_tokens}, top_p={top_p}, repetition_penalty={repetition_penalty}")
-        
-        # Generate (matching working inference.py parameters)
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature if temperature > 0 else None,
-                top_p=top_p if top_p < 1.0 else None,
-                do_sample=temperature > 0,
-                pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
-                eos_token_id=tokenizer.eos_token_id,
-                repetition_penalty=repetition_penalty
-            )
-        
-        # Extract only generated tokens (matching inference.py)
-        generated_tokens = outputs[0][input_token_count:]
-        response = tokenizer.decode(
-            generated_tokens,
-            skip_special_tokens=True
-        ).strip()
-        
-        completion_token_count = len(generated_tokens)
-        print(f"[API] Generated {completion_token_count} tokens")
-        
-        # Remove chat template artifacts
-        if "[/INST]" in response:
-            response = response.split("[/INST]")[-1].strip()
-        if "<|assistant|>" in response:
-            response = response.split("<|assistant|>")[-1].strip()
-        response = response.replace("</s>", "").replace("<s>", "").strip()
-        
-        # Stop at training data patterns, JavaScript code, and footer/boilerplate text BEFORE cleaning
-        # This prevents the model from outputting training format, JavaScript, or footer text
-        stop_patterns = [
-            r'###\s*Instruction\s*:',
-            r'###\s*Response\s*:',
-            r'###\s*Institution\s*:',
-            r'###\s*Example\s*:',
-            r'###\s*Training\s*:',
-            r'###\s*Data\s*:',
-            r'\(function\s*\(',
-            r'function\s*\(w,\s*d,\s*s',
-            r'w\[l\]\s*=\s*w\[p\]',
-            r'getElementsByTagName',
-            r'\.push\(arguments\)',
-            # Footer/boilerplate patterns (training data artifacts)
-            r'\|\s*Medarion\s+AI\s+Health\s+Assistant\s*\|',
-            r'\|\s*Powered\s+by\s+Medarion',
-            r'\|\s*Visit\s+www\.medarion\.com',
-            r'\|\s*©\s+\d{4}\s+Medarion',
-            r'\|\s*Terms\s+of\s+Use\s+&\s+Privacy\s+Policy',
-            r'\|\s*Contact\s+us:',
-            r'\|\s*Report\s+abuse:',
-            r'\|\s*Disclaimer:',
-            r'\|\s*Follow\s+us\s+on\s+social\s+media',
-            r'\|\s*Subscribe\s+to\s+our\s+newsletter',
-        ]
-        
-        import re
-        earliest_stop = None
-        earliest_index = len(response)
-        
-        for pattern in stop_patterns:
-            match = re.search(pattern, response, re.IGNORECASE)
-            if match and match.start() < earliest_index:
-                earliest_index = match.start()
-                earliest_stop = match
-        
-        # If we found a stop pattern, extract only the valid part before it
-        if earliest_stop and earliest_index > 10:
-            before_stop = response[:earliest_index]
-            # Find last complete sentence
-            last_sentence_end = max(
-                before_stop.rfind('.'),
-                before_stop.rfind('!'),
-                before_stop.rfind('?')
-            )
-            if last_sentence_end > 0:
-                response = before_stop[:last_sentence_end + 1].strip()
-            else:
-                response = before_stop.strip()
-            print(f"[API] Stopped at pattern, extracted {len(response)} chars")
-        
-        # Log raw response before any cleaning
-        print(f"[API] Raw generated response (before cleaning): {len(response)} chars")
-        print(f"[API] Raw response preview: {response[:200]}")
+        cached = lookup_cached_response("/chat", data)
+        if cached is not None:
+            return jsonify(cached)
+        gen_req, input_token_count = prepare_chat(data)
+        if gen_req.token_queue is not None:
+            return stream_chat_completion(gen_req, input_token_count)
         
-        # Clean up trailing gibberish and incomplete text (gentle cleaning)
-        # Trust the fine-tuned Medarion model output - only remove actual garbage
-        response_before_clean = response
-        response = clean_response(response)
-        print(f"[API] After clean_response(): {len(response)} chars")
-        
-        # Final validation: Ensure response is not empty and has valid content
-        if not response or len(response.strip()) < 3:
-            response = "I apologize, but I couldn't generate a proper response. Please try again."
-            print("[API] Warning: Empty or too short response, using fallback")
-        
-        # Additional validation: Reject responses that are mostly punctuation/special chars
-        if response and len(response.strip()) > 0:
-            import re
-            valid_chars = len(re.findall(r'[a-zA-Z0-9]', response))
-            total_chars = len(response)
-            if total_chars > 0:
-                valid_percent = (valid_chars / total_chars) * 100
-                print(f"[API] Validation: {valid_chars}/{total_chars} valid chars = {valid_percent:.1f}%")
-                if valid_percent < 30:  # Less than 30% valid characters
-                    print(f"[API] Warning: Response is mostly gibberish ({valid_percent:.1f}% valid), rejecting")
-                    print(f"[API] Rejected response content: {response[:200]}")
-                    response = "I apologize, but I couldn't generate a proper response. Please try again."
-                    print(f"[API] Using fallback message: {response}")
-        
-        # Log response length for monitoring (fine-tuned model should produce good responses)
-        print(f"[API] Generated response: {len(response)} chars (fine-tuned Medarion model)")
-        
-        # Return OpenAI-compatible format with usage stats (matching inference.py)
-        return jsonify({
-            "choices": [{
-                "message": {
-                    "role": "assistant",
-                    "content": response
-                },
-                "finish_reason": "stop"
-            }],
-            "usage": {
-                "prompt_tokens": input_token_count,
-                "completion_tokens": completion_token_count,
-                "total_tokens": input_token_count + completion_token_count
-            }
-        })
+        # Generate (matching working inference.py parameters) in the shared decode batch
+        result = engine.generate(gen_req)
+        return jsonify(finish_chat(result, input_token_count))
         
+    except APIError as e:
+        return api_error_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 # =========================================================
-# 5️⃣  Main Entrypoint
+# 6️⃣  Async ASGI serving mode
+# =========================================================
+class _AsyncTokenChannel:
+    """Thread-safe bridge from the engine thread into an asyncio queue"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+async def _read_json(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        raise APIError(400, "Invalid JSON body")
+
+
+async def _send_response(send, status, body, content_type, retry_after=None):
+    headers = [
+        (b"content-type", content_type),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, status, payload, retry_after=None):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await _send_response(send, status, body, b"application/json", retry_after)
+
+
+async def _cancel_on_disconnect(receive, gen_req):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            gen_req.cancel()
+            return
+
+
+class AsyncInferenceServer:
+    """
+    asyncio ASGI app serving the same endpoints as the Flask app.
+
+    Generation endpoints go through a bounded admission queue: at most
+    MAX_CONCURRENT_REQUESTS run at once, up to MAX_QUEUED_REQUESTS wait for a
+    slot, and the rest are turned away with 429 + Retry-After. A request that
+    waits longer than QUEUE_TIMEOUT gets 503. On shutdown new work is refused
+    with 503 while in-flight requests drain.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS, max_queued=MAX_QUEUED_REQUESTS,
+                 queue_timeout=QUEUE_TIMEOUT, drain_timeout=DRAIN_TIMEOUT):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.drain_timeout = drain_timeout
+        self.slots = None  # Created on the serving loop at startup
+        self.waiting = 0
+        self.in_flight = 0
+        self.draining = False
+        self.drained = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        method, path = scope["method"], scope["path"]
+
+        async def counted_send(message):
+            if message["type"] == "http.response.start":
+                REQUESTS_TOTAL.inc(endpoint_label(path), message["status"])
+            await send(message)
+
+        send = counted_send
+        try:
+            if method == "GET" and path == "/health":
+                payload, status = health_status()
+                await _send_json(send, status, payload)
+            elif method == "GET" and path == "/ping":
+                await _send_response(send, 200, b"pong", b"text/plain")
+            elif method == "GET" and path == "/metrics":
+                await _send_response(send, 200, METRICS.render().encode("utf-8"), b"text/plain; version=0.0.4")
+            elif method == "POST" and path == "/chat":
+                await self._generation(receive, send, "/chat", self._chat)
+            elif method == "POST" and path == "/generate":
+                await self._generation(receive, send, "/generate", self._generate)
+            else:
+                await _send_json(send, 404, {"error": "Not found"})
+        except APIError as e:
+            await _send_json(send, e.status, {"error": e.message}, retry_after=e.retry_after)
+        except Exception as e:
+            await _send_json(send, 500, {"error": str(e)})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._ensure_primitives()
+                start_model_loading()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.drain()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _ensure_primitives(self):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_concurrent)
+            self.drained = asyncio.Event()
+
+    async def drain(self):
+        """Stop admitting requests and wait for in-flight ones to finish"""
+        self._ensure_primitives()
+        self.draining = True
+        if self.in_flight:
+            print(f"⏳ Draining {self.in_flight} in-flight request(s)...")
+            try:
+                await asyncio.wait_for(self.drained.wait(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"⚠️  Drain timed out with {self.in_flight} request(s) still running")
+
+    async def _acquire_slot(self):
+        self._ensure_primitives()
+        if self.draining:
+            raise APIError(503, "Server is shutting down", retry_after=RETRY_AFTER_SECONDS)
+        if self.waiting + self.in_flight >= self.max_concurrent + self.max_queued:
+            raise APIError(429, "Too many requests queued, try again later", retry_after=RETRY_AFTER_SECONDS)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise APIError(503, "Timed out waiting for a generation slot", retry_after=RETRY_AFTER_SECONDS)
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self.slots.release()
+        if self.draining and self.in_flight == 0:
+            self.drained.set()
+
+    async def _generation(self, receive, send, endpoint, handler):
+        data = await _read_json(receive)
+        # Cache hits are answered without taking a generation slot
+        cached = lookup_cached_response(endpoint, data)
+        if cached is not None:
+            await _send_json(send, 200, cached)
+            return
+        await self._acquire_slot()
+        try:
+            await handler(data, receive, send)
+        finally:
+            self._release_slot()
+
+    async def _run(self, gen_req, receive, consume):
+        """Submit to the engine and consume its tokens until it finishes or the client leaves"""
+        stream = gen_req.token_queue is not None
+        channel = _AsyncTokenChannel(asyncio.get_running_loop())
+        gen_req.token_queue = channel
+        engine.submit(gen_req)
+        watcher = asyncio.ensure_future(_cancel_on_disconnect(receive, gen_req))
+        try:
+            await consume(channel, stream)
+        finally:
+            watcher.cancel()
+            gen_req.cancel()
+
+    async def _generate(self, data, receive, send):
+        prompt, gen_req = prepare_generate(data)
+
+        async def consume(channel, stream):
+            while await channel.queue.get() is not None:
+                pass
+            await _send_json(send, 200, finish_generate(prompt, gen_req))
+
+        await self._run(gen_req, receive, consume)
+
+    async def _chat(self, data, receive, send):
+        gen_req, input_token_count = prepare_chat(data)
+
+        async def consume(channel, stream):
+            if not stream:
+                while await channel.queue.get() is not None:
+                    pass
+                await _send_json(send, 200, finish_chat(gen_req, input_token_count))
+                return
+
+            chat_stream = ChatCompletionStream(gen_req, input_token_count)
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ]})
+
+            async def emit(event):
+                await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+
+            await emit(chat_stream.start())
+            while not chat_stream.finished:
+                token = await channel.queue.get()
+                if token is None:
+                    break
+                for event in chat_stream.feed(token):
+                    await emit(event)
+            for event in chat_stream.finish():
+                await emit(event)
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        await self._run(gen_req, receive, consume)
+
+
+asgi_app = AsyncInferenceServer()
+
+
+def serve_asgi():
+    """Run the ASGI app under uvicorn, refusing new work as soon as a shutdown signal arrives"""
+    import uvicorn
+
+    class DrainingServer(uvicorn.Server):
+        def handle_exit(self, sig, frame):
+            asgi_app.draining = True
+            super().handle_exit(sig, frame)
+
+    config = uvicorn.Config(
+        asgi_app,
+        host="0.0.0.0",
+        port=PORT,
+        timeout_graceful_shutdown=int(DRAIN_TIMEOUT),
+        log_level="info",
+    )
+    DrainingServer(config).run()
+
+
+# =========================================================
+# 7️⃣  Main Entrypoint
 # =========================================================
 if __name__ == "__main__":
     try:
-        # Model is already loaded at module level (same as diagnostic script)
+        # Bind right away; the model loads in the background and /health reports progress
+        start_model_loading()
         print(f"🌐 API available at: http://0.0.0.0:{PORT}")
         print("📡 Endpoints:")
         print("   GET  /health")
         print("   GET  /ping")
+        print("   GET  /metrics")
         print("   POST /generate")
         print("   POST /chat")
         print("====================================================================")
 
-        app.run(host="0.0.0.0", port=PORT, debug=False)
+        if SERVER_MODE == "asgi":
+            print(f"⚡ Async mode: {MAX_CONCURRENT_REQUESTS} concurrent, {MAX_QUEUED_REQUESTS} queued, {REQUEST_TIMEOUT:.0f}s timeout")
+            serve_asgi()
+        else:
+            # threaded=True lets concurrent requests join the same decode batch
+            app.run(host="0.0.0.0", port=PORT, debug=False, threaded=True)
     except KeyboardInterrupt:
         print("\n🛑 Server stopped manually.")
     except Exception as err:
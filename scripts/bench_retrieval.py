@@ -0,0 +1,243 @@
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from quantized_index import QuantizedIndex, QuantizedIndexBuilder
+from vector_store import NumpyVectorStore
+
+CHUNKS_PATH = os.path.join("data", "chunks", "chunks.jsonl")
+OUT_DIR = os.path.join("data", "bench")
+EMBED_MODEL_NAME = "intfloat/e5-small-v2"
+BACKENDS = ("numpy-flat", "numpy-ivf", "int8", "binary", "chroma")
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux /proc, falling back to peak RSS elsewhere)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def percentile_ms(samples: List[float], pct: float) -> float:
+    return round(float(np.percentile(samples, pct)) * 1000.0, 3) if samples else 0.0
+
+
+def sample_chunks(path: str, n: int, seed: int) -> List[dict]:
+    """Reservoir-sample n chunk records without loading chunks.jsonl into memory"""
+    rng = random.Random(seed)
+    reservoir: List[dict] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if i < n:
+                reservoir.append(json.loads(line))
+            else:
+                j = rng.randint(0, i)
+                if j < n:
+                    reservoir[j] = json.loads(line)
+    return reservoir
+
+
+def synthetic_corpus(n: int, dim: int, n_queries: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Clustered unit vectors (a mixture around random topic centres) plus nearby queries"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(max(8, int(np.sqrt(n))), dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, len(centres), size=n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    queries = vectors[rng.integers(0, n, size=n_queries)] + 0.4 * rng.normal(size=(n_queries, dim)).astype(np.float32)
+    return normalize(vectors), normalize(queries)
+
+
+def sampled_corpus(path: str, n: int, n_queries: int, seed: int, batch_size: int = 64) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Real e5 embeddings of n sampled chunks. Queries are the opening words of
+    other sampled chunks, embedded with the "query: " prefix the API uses.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    records = sample_chunks(path, n + n_queries, seed)
+    docs, held_out = records[:n], records[n:]
+    model = SentenceTransformer(EMBED_MODEL_NAME)
+    vectors = model.encode(["passage: " + rec["content"] for rec in docs], batch_size=batch_size, convert_to_numpy=True, show_progress_bar=True)
+    query_texts = ["query: " + " ".join(rec["content"].split()[:12]) for rec in held_out or docs[:n_queries]]
+    queries = model.encode(query_texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    return normalize(vectors), normalize(queries), len(docs)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> List[set]:
+    truth = []
+    for start in range(0, len(queries), 256):
+        scores = queries[start : start + 256] @ vectors.T
+        top = np.argpartition(-scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+        truth.extend({f"c{i}" for i in row} for row in top)
+    return truth
+
+
+def build_backend(name: str, vectors: np.ndarray, work_dir: str, nprobe: int) -> Callable[[np.ndarray, int], List[str]]:
+    """Build one index over `vectors` (ids c0..cN) and return its search function"""
+    ids = [f"c{i}" for i in range(len(vectors))]
+    path = os.path.join(work_dir, name)
+    if name in ("numpy-flat", "numpy-ivf"):
+        store = NumpyVectorStore(path, index=name.split("-")[1], nprobe=nprobe)
+        for start in range(0, len(ids), 10_000):
+            store.upsert(ids[start : start + 10_000], vectors[start : start + 10_000])
+        store.persist()
+        return lambda q, k: store.query(q[None, :], k, include=())["ids"][0]
+    if name in ("int8", "binary"):
+        builder = QuantizedIndexBuilder(path)
+        for start in range(0, len(ids), 10_000):
+            builder.add(ids[start : start + 10_000], vectors[start : start + 10_000])
+        builder.finalize((name,))
+        index = QuantizedIndex(path, name)
+        return lambda q, k: [chunk_id for chunk_id, _ in index.search(q, k)]
+    if name == "chroma":
+        import chromadb
+
+        client = chromadb.PersistentClient(path=path)
+        coll = client.create_collection("bench", metadata={"hnsw:space": "cosine"})
+        for start in range(0, len(ids), 5_000):
+            coll.add(ids=ids[start : start + 5_000], embeddings=vectors[start : start + 5_000])
+        return lambda q, k: coll.query(query_embeddings=q[None, :], n_results=k, include=[])["ids"][0]
+    raise ValueError(f"Unknown backend {name}")
+
+
+def measure(search: Callable[[np.ndarray, int], List[str]], queries: np.ndarray, truth: Optional[List[set]], k: int, concurrency: List[int]) -> dict:
+    for q in queries[: min(10, len(queries))]:
+        search(q, k)  # warm caches / page in mmaps
+    latencies, recalls = [], []
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        got = search(q, k)
+        latencies.append(time.perf_counter() - t0)
+        if truth is not None:
+            recalls.append(len(truth[i] & set(got)) / max(1, len(truth[i])))
+    result = {
+        "latency_ms": {p: percentile_ms(latencies, float(p[1:])) for p in ("p50", "p95", "p99")},
+        "mean_latency_ms": round(float(np.mean(latencies)) * 1000.0, 3),
+        f"recall@{k}": round(float(np.mean(recalls)), 4) if recalls else None,
+        "qps": {},
+    }
+    for workers in concurrency:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            t0 = time.perf_counter()
+            list(pool.map(lambda q: search(q, k), queries))
+            result["qps"][str(workers)] = round(len(queries) / (time.perf_counter() - t0), 1)
+    return result
+
+
+def bench_api(url: str, chunks_path: str, n_queries: int, k: int, modes: List[str], concurrency: List[int], seed: int) -> dict:
+    """Replay sampled query texts against a running /search endpoint (latency and QPS only)"""
+    import requests
+
+    texts = [" ".join(rec["content"].split()[:12]) for rec in sample_chunks(chunks_path, n_queries, seed)]
+    session = requests.Session()
+    results = {}
+    for mode in modes:
+        def search(text, _k, mode=mode):
+            r = session.post(f"{url.rstrip('/')}/search", json={"query": text, "k": _k, "mode": mode}, timeout=60)
+            r.raise_for_status()
+            return r.json()["ids"][0]
+        results[mode] = measure(search, texts, None, k, concurrency)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark retrieval latency, throughput, memory and recall")
+    parser.add_argument("--chunks", default=CHUNKS_PATH)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated collection sizes")
+    parser.add_argument("--corpus", choices=("synthetic", "sampled", "both"), default="synthetic",
+                        help="synthetic clustered vectors, or real e5 embeddings of chunks sampled from --chunks")
+    parser.add_argument("--backends", default="numpy-flat,numpy-ivf,int8,binary", help=f"comma-separated subset of {','.join(BACKENDS)}")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--concurrency", default="1,4,16", help="thread counts for the QPS runs")
+    parser.add_argument("--dim", type=int, default=384, help="synthetic vector width (e5-small-v2 is 384)")
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--api-url", help="also replay queries against a running API's /search in each mode")
+    parser.add_argument("--out", help="result JSON path (default: data/bench/retrieval-<timestamp>.json)")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    backends = [b for b in args.backends.split(",") if b]
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+    concurrency = [int(c) for c in args.concurrency.split(",") if c]
+    corpora = ("synthetic", "sampled") if args.corpus == "both" else (args.corpus,)
+
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {**vars(args), "cpu_count": os.cpu_count()},
+        "runs": [],
+    }
+    for corpus in corpora:
+        for size in sizes:
+            if corpus == "synthetic":
+                vectors, queries = synthetic_corpus(size, args.dim, args.queries, args.seed)
+                actual = size
+            else:
+                vectors, queries, actual = sampled_corpus(args.chunks, size, args.queries, args.seed)
+            truth = exact_top_k(vectors, queries, args.k)
+            for backend in backends:
+                work_dir = tempfile.mkdtemp(prefix="medarion-bench-")
+                try:
+                    gc.collect()  # drop the previous backend's arrays so the RSS delta is this one's
+                    rss_before = rss_bytes()
+                    t0 = time.perf_counter()
+                    search = build_backend(backend, vectors, work_dir, args.nprobe)
+                    build_seconds = time.perf_counter() - t0
+                    run = {
+                        "corpus": corpus,
+                        "size": actual,
+                        "dim": int(vectors.shape[1]),
+                        "backend": backend,
+                        "k": args.k,
+                        "build_seconds": round(build_seconds, 3),
+                        "memory": {"rss_delta_bytes": rss_bytes() - rss_before, "disk_bytes": dir_bytes(work_dir)},
+                        **measure(search, queries, truth, args.k, concurrency),
+                    }
+                    run["memory"]["rss_after_queries_bytes"] = rss_bytes() - rss_before
+                except ImportError as e:
+                    run = {"corpus": corpus, "size": actual, "backend": backend, "skipped": str(e)}
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                report["runs"].append(run)
+                print(json.dumps(run))
+    if args.api_url:
+        report["api"] = bench_api(args.api_url, args.chunks, args.queries, args.k, ["vector", "bm25", "hybrid"], concurrency, args.seed)
+
+    report["finished_at"] = datetime.now(timezone.utc).isoformat()
+    out = args.out or os.path.join(OUT_DIR, f"retrieval-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import json
+import os
+import re
+import shutil
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from posting_runs import SPILL_POSTINGS, SpilledColumn, SpilledIds, SpilledPostings, make_work_dir
+
+BM25_DIR = os.path.join("data", "vectorstore", "bm25")
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Builder:
+    """
+    Accumulates term postings chunk by chunk, then writes them as flat numpy arrays.
+
+    Postings, document lengths and ids are spilled to `work_dir` as they grow
+    and k-way merged by `save()`, so building needs memory for one spill run
+    (plus the vocabulary), not for the whole corpus.
+    """
+
+    def __init__(self, work_dir: Optional[str] = None, spill_postings: int = SPILL_POSTINGS) -> None:
+        self.work_dir = make_work_dir(work_dir, "bm25-runs-")
+        self.postings = SpilledPostings(os.path.join(self.work_dir, "postings"), width=2, spill_postings=spill_postings)
+        self.doc_lens = SpilledColumn(os.path.join(self.work_dir, "doc_lens.i32"), np.int32)
+        self.ids = SpilledIds(os.path.join(self.work_dir, "ids.jsonl"))
+
+    def __len__(self) -> int:
+        return self.ids.count
+
+    def add(self, chunk_id: str, text: str) -> None:
+        doc_idx = self.ids.count
+        terms = tokenize(text)
+        self.ids.append(chunk_id)
+        self.doc_lens.append(len(terms))
+        for term, tf in Counter(terms).items():
+            self.postings.add(term, doc_idx, tf)
+
+    def add_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        for chunk_id, text in items:
+            self.add(chunk_id, text)
+
+    def save(self, out_dir: str = BM25_DIR) -> None:
+        os.makedirs(out_dir, exist_ok=True)
+        self.postings.spill()
+        total = self.postings.total
+        docs = np.lib.format.open_memmap(os.path.join(out_dir, "postings_docs.npy"), mode="w+", dtype=np.int32, shape=(total,))
+        tfs = np.lib.format.open_memmap(os.path.join(out_dir, "postings_tfs.npy"), mode="w+", dtype=np.uint16, shape=(total,))
+        vocab = {}
+        start = 0
+        for term, plist in self.postings.merge():
+            vocab[term] = [start, len(plist)]
+            docs[start : start + len(plist)] = plist[:, 0]
+            tfs[start : start + len(plist)] = np.minimum(plist[:, 1], np.iinfo(np.uint16).max)
+            start += len(plist)
+        docs.flush()
+        tfs.flush()
+        del docs, tfs
+        np.save(os.path.join(out_dir, "doc_lens.npy"), self.doc_lens.array())
+        with open(os.path.join(out_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        with open(os.path.join(out_dir, "ids.json"), "w", encoding="utf-8") as f:
+            self.ids.write_json_array(f)
+        self.ids.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class BM25Index:
+    """
+    Read-only BM25 (Okapi) index over the chunks of the Chroma collection.
+
+    Postings are memory-mapped, so loading is cheap and scoring a query only
+    touches the posting lists of its terms.
+    """
+
+    def __init__(self, index_dir: str = BM25_DIR, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.docs = np.load(os.path.join(index_dir, "postings_docs.npy"), mmap_mode="r")
+        self.tfs = np.load(os.path.join(index_dir, "postings_tfs.npy"), mmap_mode="r")
+        self.doc_lens = np.load(os.path.join(index_dir, "doc_lens.npy")).astype(np.float32)
+        with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab: Dict[str, List[int]] = json.load(f)
+        with open(os.path.join(index_dir, "ids.json"), "r", encoding="utf-8") as f:
+            self.ids: List[str] = json.load(f)
+        self.avg_len = float(self.doc_lens.mean()) if len(self.doc_lens) else 0.0
+
+    @staticmethod
+    def exists(index_dir: str = BM25_DIR) -> bool:
+        return os.path.exists(os.path.join(index_dir, "vocab.json"))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """Top-k (chunk id, score) pairs, best first; `allowed` is an optional row mask"""
+        n_docs = len(self.ids)
+        doc_parts, score_parts = [], []
+        for term in set(tokenize(query)):
+            entry = self.vocab.get(term)
+            if entry is None:
+                continue
+            start, df = entry
+            docs = np.asarray(self.docs[start : start + df])
+            tf = np.asarray(self.tfs[start : start + df], dtype=np.float32)
+            if allowed is not None:
+                keep = allowed[docs]
+                docs, tf = docs[keep], tf[keep]
+                if not len(docs):
+                    continue
+            idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lens[docs] / max(self.avg_len, 1e-9))
+            doc_parts.append(docs)
+            score_parts.append(idf * tf * (self.k1 + 1.0) / (tf + norm))
+        if not doc_parts:
+            return []
+        uniq, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+        k = min(k, len(uniq))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[uniq[i]], float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int, rrf_k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse several ranked id lists; each list contributes 1 / (rrf_k + rank)"""
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            fused[chunk_id] += 1.0 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -1,49 +1,65 @@
+import argparse
 import json
 import os
 
+from token_chunker import CHUNK_TOKENS, MIN_CHUNK_TOKENS, OVERLAP_TOKENS, TOKENIZER_NAME, chunk_stream
+
 IN_PATH = os.path.join("data", "normalized", "dataset.jsonl")
 OUT_PATH = os.path.join("data", "chunks", "chunks.jsonl")
-CHUNK_SIZE = 800
-CHUNK_OVERLAP = 100
 
 
-def chunk_text(text: str, size: int, overlap: int):
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(start + size, len(text))
-        chunks.append((start, text[start:end]))
-        if end == len(text):
-            break
-        start = max(0, end - overlap)
-    return chunks
+def read_docs(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                doc = json.loads(line)
+                yield doc, doc["text"]
 
 
 def main() -> None:
-    os.makedirs(os.path.dirname(OUT_PATH), exist_ok=True)
-    with open(IN_PATH, "r", encoding="utf-8") as f_in, open(OUT_PATH, "w", encoding="utf-8") as f_out:
-        for line in f_in:
-            doc = json.loads(line)
-            pieces = chunk_text(doc["text"], CHUNK_SIZE, CHUNK_OVERLAP)
-            for idx, (offset, content) in enumerate(pieces):
+    parser = argparse.ArgumentParser(description="Split normalized documents into sentence-aligned, token-sized chunks")
+    parser.add_argument("--input", default=IN_PATH)
+    parser.add_argument("--output", default=OUT_PATH)
+    parser.add_argument("--tokenizer", default=TOKENIZER_NAME, help="tokenizer of the embedding model chunks are sized for")
+    parser.add_argument("--max-tokens", type=int, default=CHUNK_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=OVERLAP_TOKENS)
+    parser.add_argument("--min-tokens", type=int, default=MIN_CHUNK_TOKENS, help="smallest chunk a heading may close")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) - 1))
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    n_docs = n_chunks = 0
+    with open(args.output, "w", encoding="utf-8") as f_out:
+        pieces_by_doc = chunk_stream(
+            read_docs(args.input),
+            workers=args.workers,
+            tokenizer_name=args.tokenizer,
+            max_tokens=args.max_tokens,
+            overlap_tokens=args.overlap_tokens,
+            min_tokens=args.min_tokens,
+        )
+        for doc, pieces in pieces_by_doc:
+            for idx, (offset, content, n_tokens) in enumerate(pieces):
                 rec = {
                     "doc_id": doc["id"],
                     "chunk_id": idx,
                     "content": content,
                     "offset_char": offset,
+                    "n_tokens": n_tokens,
                     "metadata": {
                         "source_url": doc["source_url"],
                         "title": doc["title"],
                         "company": doc.get("company"),
                         "lang": doc.get("lang", "en"),
                         "tags": doc.get("tags", []),
+                        "created_at": doc.get("created_at"),
                     },
                 }
                 f_out.write(json.dumps(rec, ensure_ascii=False) + "\n")
-    print(f"Wrote {OUT_PATH}")
+            n_docs += 1
+            n_chunks += len(pieces)
+    print(f"Wrote {n_chunks} chunks from {n_docs} documents to {args.output}")
 
 
 if __name__ == "__main__":
     main()
-
-
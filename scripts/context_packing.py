@@ -0,0 +1,104 @@
+from typing import List, Optional
+
+# Passages whose word-shingle Jaccard similarity reaches this are treated as duplicates
+DEDUP_SIMILARITY = 0.85
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = text.lower().split()
+    return {" ".join(words[i : i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def _suffix_prefix_overlap(left: str, right: str, max_overlap: int = 400, min_overlap: int = 16) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right` (0 if shorter than min_overlap)"""
+    for n in range(min(len(left), len(right), max_overlap), min_overlap - 1, -1):
+        if left.endswith(right[:n]):
+            return n
+    return 0
+
+
+def merge_adjacent_chunks(sources: List[dict]) -> List[dict]:
+    """
+    Merge hits that are overlapping windows of the same document into one passage.
+
+    Spans are placed with `offset_char` when both neighbours have it; otherwise
+    (older collections, or records the chunker wrote without offsets) only
+    consecutive `chunk_id`s joined on a real textual overlap are merged. The
+    merged passage keeps the best score of its parts.
+    """
+    by_doc: dict = {}
+    loose = []
+    for src in sources:
+        meta = src.get("metadata") or {}
+        if meta.get("doc_id") is None or meta.get("chunk_id") is None:
+            loose.append(src)
+        else:
+            by_doc.setdefault(meta["doc_id"], []).append(src)
+
+    merged = []
+    for doc_id, hits in by_doc.items():
+        # chunk_id follows source order, so it also orders hits that lack an offset
+        hits.sort(key=lambda h: h["metadata"]["chunk_id"])
+        current = None
+        for hit in hits:
+            meta = hit["metadata"]
+            offset: Optional[int] = meta.get("offset_char")
+            if current is not None:
+                if offset is not None and current["end"] is not None:
+                    # A gap between known spans (a section break the chunker skipped) is not merged
+                    overlap = current["end"] - offset if offset <= current["end"] else -1
+                elif meta["chunk_id"] == current["last_chunk_id"] + 1:
+                    # Without offsets only a real textual overlap proves the spans are contiguous
+                    overlap = _suffix_prefix_overlap(current["text"], hit["text"]) or -1
+                else:
+                    overlap = -1
+                if overlap >= 0:
+                    current["text"] += hit["text"][overlap:]
+                    end = offset + len(hit["text"]) if offset is not None else None
+                    current["end"] = max(current["end"], end) if end is not None and current["end"] is not None else end
+                    current["last_chunk_id"] = meta["chunk_id"]
+                    current["ids"].append(hit["id"])
+                    current["score"] = max(current["score"], hit["score"])
+                    continue
+                merged.append(current)
+            current = {
+                "ids": [hit["id"]],
+                "doc_id": doc_id,
+                "text": hit["text"],
+                "metadata": meta,
+                "score": hit["score"],
+                "end": offset + len(hit["text"]) if offset is not None else None,
+                "last_chunk_id": meta["chunk_id"],
+            }
+        merged.append(current)
+
+    for src in loose:
+        merged.append({"ids": [src["id"]], "doc_id": None, "text": src["text"], "metadata": src.get("metadata"), "score": src["score"]})
+    for passage in merged:
+        passage.pop("end", None)
+        passage.pop("last_chunk_id", None)
+    return merged
+
+
+def pack_passages(sources: List[dict], tokenizer, token_budget: int, dedup_similarity: float = DEDUP_SIMILARITY) -> List[dict]:
+    """
+    Turn retrieved chunks into a deduplicated context list that fits `token_budget`.
+
+    Overlapping chunks of one document are merged, near-identical passages
+    (e.g. the same press release scraped twice) are dropped, and passages are
+    then taken best-score-first while they fit the budget, measured with
+    `tokenizer` (the embedding model's).
+    """
+    passages = sorted(merge_adjacent_chunks(sources), key=lambda p: p["score"], reverse=True)
+    packed, kept_shingles, used = [], [], 0
+    for passage in passages:
+        shingles = _shingles(passage["text"])
+        if any(len(shingles & seen) / max(1, len(shingles | seen)) >= dedup_similarity for seen in kept_shingles):
+            continue
+        n_tokens = len(tokenizer.encode(passage["text"], add_special_tokens=False))
+        if used + n_tokens > token_budget:
+            continue
+        used += n_tokens
+        kept_shingles.append(shingles)
+        packed.append({**passage, "tokens": n_tokens})
+    return packed
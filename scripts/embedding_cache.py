@@ -0,0 +1,119 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Slots in the memory-mapped file; a vector lands in slot hash % FILE_SLOTS
+FILE_SLOTS = 65536
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU of float32 query vectors keyed by a hash of the query text.
+
+    Eviction happens when either `max_entries` or `max_bytes` is exceeded. With
+    `path` set, vectors are also written to a memory-mapped, direct-mapped slot
+    file (slot = hash % slots) that survives restarts and is consulted on
+    in-memory misses.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, path: str = "", file_slots: int = FILE_SLOTS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.file_slots = max(1, file_slots)
+        self.entries: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.file_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.table = None
+        self.dim = None
+        # A file left by a previous run is readable straight away; its vector width
+        # follows from the file size, since each slot is a 16-byte key plus dim float32s
+        if path and os.path.exists(path):
+            slot_bytes, rest = divmod(os.path.getsize(path), self.file_slots)
+            if not rest and slot_bytes > 16 and (slot_bytes - 16) % 4 == 0:
+                self._open_table((slot_bytes - 16) // 4)
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def _open_table(self, dim: int):
+        # Without a file from a previous run the width is only known after the first encode
+        if not self.path or (self.table is not None and self.dim == dim):
+            return self.table
+        dtype = np.dtype([("key", "V16"), ("vec", "<f4", (dim,))])
+        mode = "r+" if os.path.exists(self.path) else "w+"
+        if mode == "r+" and os.path.getsize(self.path) != dtype.itemsize * self.file_slots:
+            # Different model width or slot count: start over rather than misread vectors
+            mode = "w+"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.table = np.memmap(self.path, dtype=dtype, mode=mode, shape=(self.file_slots,))
+        self.dim = dim
+        return self.table
+
+    def get(self, text: str):
+        k = self.key(text)
+        with self.lock:
+            vec = self.entries.get(k)
+            if vec is not None:
+                self.entries.move_to_end(k)
+                self.hits += 1
+                return vec
+            if self.table is not None:
+                slot = self.table[int.from_bytes(k[:8], "little") % self.file_slots]
+                if bytes(slot["key"]) == k:
+                    self.file_hits += 1
+                    return self._remember(k, np.array(slot["vec"], dtype=np.float32))
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vec) -> None:
+        k = self.key(text)
+        vec = np.asarray(vec, dtype=np.float32)
+        with self.lock:
+            self._remember(k, vec)
+            table = self._open_table(vec.shape[0])
+            if table is not None:
+                slot = int.from_bytes(k[:8], "little") % self.file_slots
+                table[slot] = (k, vec)
+
+    def _remember(self, k: bytes, vec: np.ndarray) -> np.ndarray:
+        vec.setflags(write=False)
+        old = self.entries.pop(k, None)
+        if old is not None:
+            self.bytes -= old.nbytes + len(k)
+        self.entries[k] = vec
+        self.bytes += vec.nbytes + len(k)
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            old_key, old_vec = self.entries.popitem(last=False)
+            self.bytes -= old_vec.nbytes + len(old_key)
+            self.evictions += 1
+        return vec
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.table is not None:
+                self.table.flush()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.file_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "file_hits": self.file_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.file_hits) / lookups, 4) if lookups else 0.0,
+                "persistent": bool(self.path),
+            }
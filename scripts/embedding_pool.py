@@ -0,0 +1,170 @@
+import multiprocessing as mp
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+import numpy as np
+
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def _pin_worker(worker_idx: int, threads: int) -> None:
+    """On Linux, pin the worker to its own block of `threads` cores"""
+    if hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        start = (worker_idx * threads) % max(1, len(cores))
+        mine = cores[start : start + threads]
+        if mine:
+            os.sched_setaffinity(0, mine)
+
+
+def _worker_main(worker_idx: int, model_name: str, threads: int, batch_size: int, tasks, results) -> None:
+    try:
+        _pin_worker(worker_idx, threads)
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(threads)
+        model = SentenceTransformer(model_name, device="cpu")
+    except Exception as e:
+        results.put(("ready", worker_idx, None, f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", worker_idx, model.get_sentence_embedding_dimension(), None))
+
+    shm = None
+    buffer = None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        seq, slot, texts, shm_name, shape = task
+        try:
+            if shm is None:
+                shm = shared_memory.SharedMemory(name=shm_name)
+                buffer = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+            vectors = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+            buffer[slot, : len(texts)] = vectors
+            results.put((seq, slot, len(texts), None))
+        except Exception as e:
+            results.put((seq, slot, 0, f"{type(e).__name__}: {e}"))
+    if shm is not None:
+        del buffer
+        shm.close()
+
+
+class EmbeddingPool:
+    """
+    Process pool of SentenceTransformer workers for CPU ingest.
+
+    Each worker loads its own model copy with `threads_per_worker` torch/BLAS
+    threads (pinned to its own cores where the OS allows). Vectors are written
+    into slots of one shared-memory ring instead of being pickled back: the
+    parent hands out a free slot with each batch, collects results in submit
+    order, and the consumer calls `release(slot)` once it has written them.
+    """
+
+    def __init__(self, model_name: str, workers: int, threads_per_worker: int, slot_rows: int, batch_size: int = 64) -> None:
+        self.slot_rows = slot_rows
+        ctx = mp.get_context("spawn")
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.procs = [
+            ctx.Process(target=_worker_main, args=(i, model_name, threads_per_worker, batch_size, self.tasks, self.results), daemon=True)
+            for i in range(workers)
+        ]
+        # Spawned children may import torch while unpickling __main__, before
+        # _worker_main runs; the BLAS thread caps must already be in their environment
+        saved_env = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+        os.environ.update({var: str(threads_per_worker) for var in THREAD_ENV_VARS})
+        try:
+            for p in self.procs:
+                p.start()
+        finally:
+            for var, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+        # Health check: every worker must load its model and report in; a worker that
+        # dies without reporting (OOM kill, segfault) fails startup instead of hanging it
+        dims = set()
+        reported = 0
+        while reported < len(self.procs):
+            try:
+                _, worker_idx, dim, error = self.results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [(i, p.exitcode) for i, p in enumerate(self.procs) if p.exitcode is not None]
+                if dead:
+                    self.close(started=False)
+                    raise RuntimeError(f"Embedding worker {dead[0][0]} exited with code {dead[0][1]} before it was ready")
+                continue
+            reported += 1
+            if error is not None:
+                self.close(started=False)
+                raise RuntimeError(f"Embedding worker {worker_idx} failed to start: {error}")
+            dims.add(dim)
+        if len(dims) != 1:
+            self.close(started=False)
+            raise RuntimeError(f"Embedding workers disagree on dimension: {dims}")
+        self.dim = dims.pop()
+        # Two slots per worker keeps every worker busy while the writer drains the previous batch
+        self.n_slots = 2 * workers
+        self.shm = shared_memory.SharedMemory(create=True, size=self.n_slots * slot_rows * self.dim * 4)
+        self.buffer = np.ndarray((self.n_slots, slot_rows, self.dim), dtype=np.float32, buffer=self.shm.buf)
+        self.free_slots: "queue.Queue[int]" = queue.Queue()
+        for slot in range(self.n_slots):
+            self.free_slots.put(slot)
+        self.next_seq = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, stop: threading.Event) -> Optional[int]:
+        while not stop.is_set():
+            try:
+                return self.free_slots.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return None
+
+    def release(self, slot: int) -> None:
+        self.free_slots.put(slot)
+
+    def submit(self, slot: int, texts: List[str]) -> int:
+        if len(texts) > self.slot_rows:
+            raise ValueError(f"Batch of {len(texts)} exceeds slot size {self.slot_rows}")
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+        self.tasks.put((seq, slot, texts, self.shm.name, self.buffer.shape))
+        return seq
+
+    def results_in_order(self, stop: threading.Event):
+        """Yield (seq, slot, vectors view) in submit order until `stop` is set"""
+        pending = {}
+        expected = 0
+        while not stop.is_set():
+            try:
+                seq, slot, n, error = self.results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if error is not None:
+                raise RuntimeError(f"Embedding worker failed on batch {seq}: {error}")
+            pending[seq] = (slot, n)
+            while expected in pending:
+                slot, n = pending.pop(expected)
+                yield expected, slot, self.buffer[slot, :n]
+                expected += 1
+
+    def close(self, started: bool = True) -> None:
+        for _ in self.procs:
+            self.tasks.put(None)
+        for p in self.procs:
+            p.join(timeout=10 if started else 1)
+            if p.is_alive():
+                p.terminate()
+        if started:
+            del self.buffer
+            self.shm.close()
+            self.shm.unlink()
@@ -0,0 +1,248 @@
+import json
+import os
+import re
+import shutil
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from posting_runs import SPILL_POSTINGS, SpilledColumn, SpilledIds, SpilledPostings, make_work_dir
+
+FACETS_DIR = os.path.join("data", "vectorstore", "facets")
+TAG_PREFIX = "tag:"
+DATE_ONLY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def parse_timestamp(value) -> Optional[int]:
+    """ISO-8601 date/datetime (or epoch seconds) to epoch seconds; None if unparseable"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        dt = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def parse_end_timestamp(value) -> Optional[int]:
+    """
+    Inclusive upper bound for a date filter: a date-only value means the end of
+    that day (its last second), so documents created later that day still match
+    """
+    ts = parse_timestamp(value)
+    if ts is not None and isinstance(value, str) and DATE_ONLY_RE.match(value.strip()):
+        ts += 86400 - 1
+    return ts
+
+
+def tag_key(tag: str) -> str:
+    return TAG_PREFIX + str(tag).strip().lower()
+
+
+def flatten_metadata(meta: dict) -> dict:
+    """
+    Make chunk metadata storable and filterable in Chroma.
+
+    Chroma only accepts scalar values, so `tags` becomes one boolean `tag:<name>`
+    key per tag (plus a joined display string), None values are dropped, and
+    `created_at` gains a numeric `created_ts` for range filters.
+    """
+    flat = {}
+    for key, value in meta.items():
+        if value is None:
+            continue
+        if key == "tags":
+            tags = [t for t in (value if isinstance(value, list) else [value]) if t]
+            flat["tags"] = ", ".join(str(t) for t in tags)
+            for t in tags:
+                flat[tag_key(t)] = True
+        elif isinstance(value, (str, int, float, bool)):
+            flat[key] = value
+        else:
+            flat[key] = json.dumps(value, ensure_ascii=False)
+    ts = parse_timestamp(meta.get("created_at"))
+    if ts is not None:
+        flat["created_ts"] = ts
+    return flat
+
+
+def build_where(company=None, tag=None, lang=None, created_from=None, created_to=None) -> Optional[dict]:
+    """Chroma `where` clause for the structured search filters; None when unfiltered"""
+    clauses: List[dict] = []
+    if company:
+        companies = company if isinstance(company, list) else [company]
+        clauses.append({"company": {"$in": companies}} if len(companies) > 1 else {"company": companies[0]})
+    for t in (tag if isinstance(tag, list) else [tag]) if tag else []:
+        clauses.append({tag_key(t): True})
+    if lang:
+        clauses.append({"lang": lang})
+    start, end = parse_timestamp(created_from), parse_end_timestamp(created_to)
+    if start is not None:
+        clauses.append({"created_ts": {"$gte": start}})
+    if end is not None:
+        clauses.append({"created_ts": {"$lte": end}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class FacetBuilder:
+    """
+    Per-chunk facet columns collected during ingest, row-aligned with the BM25 index
+    (both are fed from the same loop), plus precomputed value counts for /facets.
+
+    Columns are appended to files under `work_dir` and tag rows spill as sorted
+    runs merged by `save()`; only the (small) value dictionaries and counts stay
+    in memory.
+    """
+
+    def __init__(self, work_dir: Optional[str] = None, spill_postings: int = SPILL_POSTINGS) -> None:
+        self.work_dir = make_work_dir(work_dir, "facet-runs-")
+        self.ids = SpilledIds(os.path.join(self.work_dir, "ids.jsonl"))
+        # Codes here are in first-seen order; save() remaps them to sorted order
+        self.company_seen: Dict[str, int] = {}
+        self.lang_seen: Dict[str, int] = {}
+        self.company = SpilledColumn(os.path.join(self.work_dir, "company.i32"), np.int32)
+        self.lang = SpilledColumn(os.path.join(self.work_dir, "lang.i16"), np.int16)
+        self.created_ts = SpilledColumn(os.path.join(self.work_dir, "created_ts.i64"), np.int64)
+        self.tags = SpilledPostings(os.path.join(self.work_dir, "tags"), width=1, spill_postings=spill_postings)
+        self.company_counts: Counter = Counter()
+        self.lang_counts: Counter = Counter()
+        self.tag_counts: Counter = Counter()
+        self.months: Counter = Counter()
+        self.ts_min: Optional[int] = None
+        self.ts_max: Optional[int] = None
+
+    def add(self, chunk_id: str, meta: dict) -> None:
+        row = self.ids.count
+        self.ids.append(chunk_id)
+        company = meta.get("company") or ""
+        lang = meta.get("lang") or ""
+        self.company.append(self.company_seen.setdefault(company, len(self.company_seen)))
+        self.lang.append(self.lang_seen.setdefault(lang, len(self.lang_seen)))
+        if company:
+            self.company_counts[company] += 1
+        if lang:
+            self.lang_counts[lang] += 1
+        ts = parse_timestamp(meta.get("created_at"))
+        self.created_ts.append(ts if ts is not None else -1)
+        if ts is not None and ts >= 0:
+            self.months[datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m")] += 1
+            self.ts_min = ts if self.ts_min is None else min(self.ts_min, ts)
+            self.ts_max = ts if self.ts_max is None else max(self.ts_max, ts)
+        tags = meta.get("tags") or []
+        for t in {str(t).strip().lower() for t in (tags if isinstance(tags, list) else [tags]) if t}:
+            self.tags.add(t, row)
+            self.tag_counts[t] += 1
+
+    @staticmethod
+    def _save_recoded(column: "SpilledColumn", seen: Dict[str, int], path: str, block: int = 1 << 20) -> List[str]:
+        """Rewrite first-seen codes as indexes into the sorted values; returns the sorted values"""
+        values = sorted(seen)
+        sorted_codes = {value: i for i, value in enumerate(values)}
+        remap = np.zeros(max(len(seen), 1), dtype=column.dtype)
+        for value, code in seen.items():
+            remap[code] = sorted_codes[value]
+        codes = column.array()
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=column.dtype, shape=(len(codes),))
+        for start in range(0, len(codes), block):
+            out[start : start + block] = remap[codes[start : start + block]]
+        out.flush()
+        del out
+        return values
+
+    def save(self, out_dir: str = FACETS_DIR) -> None:
+        os.makedirs(out_dir, exist_ok=True)
+        companies = self._save_recoded(self.company, self.company_seen, os.path.join(out_dir, "company.npy"))
+        langs = self._save_recoded(self.lang, self.lang_seen, os.path.join(out_dir, "lang.npy"))
+        np.save(os.path.join(out_dir, "created_ts.npy"), self.created_ts.array())
+
+        self.tags.spill()
+        rows = np.lib.format.open_memmap(os.path.join(out_dir, "tag_rows.npy"), mode="w+", dtype=np.int32, shape=(self.tags.total,))
+        tag_offsets = {}
+        start = 0
+        for t, tag_rows in self.tags.merge():
+            tag_offsets[t] = [start, len(tag_rows)]
+            rows[start : start + len(tag_rows)] = tag_rows[:, 0]
+            start += len(tag_rows)
+        rows.flush()
+        del rows
+
+        summary = {
+            "chunks": self.ids.count,
+            "company": dict(self.company_counts.most_common()),
+            "lang": dict(self.lang_counts.most_common()),
+            "tag": {t: n for t, n in sorted(self.tag_counts.items(), key=lambda item: -item[1])},
+            "created_at": {
+                "min": datetime.fromtimestamp(self.ts_min, timezone.utc).isoformat() if self.ts_min is not None else None,
+                "max": datetime.fromtimestamp(self.ts_max, timezone.utc).isoformat() if self.ts_max is not None else None,
+                "by_month": dict(sorted(self.months.items())),
+            },
+        }
+        with open(os.path.join(out_dir, "columns.json"), "w", encoding="utf-8") as f:
+            # Written piecewise so the id list streams from disk
+            f.write('{"ids": ')
+            self.ids.write_json_array(f)
+            rest = json.dumps({"companies": companies, "langs": langs, "tags": tag_offsets}, ensure_ascii=False)
+            f.write(", " + rest[1:])
+        with open(os.path.join(out_dir, "counts.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False)
+        self.ids.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class FacetIndex:
+    """Loads the ingest-time facet columns and turns filters into row masks"""
+
+    def __init__(self, index_dir: str = FACETS_DIR) -> None:
+        with open(os.path.join(index_dir, "columns.json"), "r", encoding="utf-8") as f:
+            columns = json.load(f)
+        with open(os.path.join(index_dir, "counts.json"), "r", encoding="utf-8") as f:
+            self.counts: dict = json.load(f)
+        self.ids: List[str] = columns["ids"]
+        self.company_codes = {c: i for i, c in enumerate(columns["companies"])}
+        self.lang_codes = {lang: i for i, lang in enumerate(columns["langs"])}
+        self.tag_offsets: Dict[str, List[int]] = columns["tags"]
+        self.company = np.load(os.path.join(index_dir, "company.npy"), mmap_mode="r")
+        self.lang = np.load(os.path.join(index_dir, "lang.npy"), mmap_mode="r")
+        self.created_ts = np.load(os.path.join(index_dir, "created_ts.npy"), mmap_mode="r")
+        self.tag_rows = np.load(os.path.join(index_dir, "tag_rows.npy"), mmap_mode="r")
+
+    @staticmethod
+    def exists(index_dir: str = FACETS_DIR) -> bool:
+        return os.path.exists(os.path.join(index_dir, "counts.json"))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def mask(self, company=None, tag=None, lang=None, created_from=None, created_to=None) -> Optional[np.ndarray]:
+        """Boolean mask of rows matching every filter; None when unfiltered"""
+        mask = None
+
+        def narrow(m):
+            nonlocal mask
+            mask = m if mask is None else mask & m
+
+        if company:
+            codes = [self.company_codes[c] for c in (company if isinstance(company, list) else [company]) if c in self.company_codes]
+            narrow(np.isin(self.company, codes))
+        for t in (tag if isinstance(tag, list) else [tag]) if tag else []:
+            m = np.zeros(len(self.ids), dtype=bool)
+            entry = self.tag_offsets.get(str(t).strip().lower())
+            if entry is not None:
+                m[self.tag_rows[entry[0] : entry[0] + entry[1]]] = True
+            narrow(m)
+        if lang:
+            narrow(np.asarray(self.lang) == self.lang_codes.get(lang, -1))
+        start, end = parse_timestamp(created_from), parse_end_timestamp(created_to)
+        if start is not None:
+            narrow(np.asarray(self.created_ts) >= start)
+        if end is not None:
+            narrow((np.asarray(self.created_ts) <= end) & (np.asarray(self.created_ts) >= 0))
+        return mask
@@ -1,53 +1,449 @@
+import argparse
+import hashlib
 import json
 import os
-from typing import List
+import queue
+import shutil
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
 
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
-import chromadb
+from bm25_index import BM25_DIR, BM25Builder
+from embedding_pool import EmbeddingPool
+from facet_index import FACETS_DIR, FacetBuilder, flatten_metadata
+from quantized_index import QUANTIZED_DIR, QUANTIZATIONS, QuantizedIndex, build_from_collection
+from vector_store import CHROMA_DIR, COLLECTION_NAME, NUMPY_DIR, VECTOR_BACKEND, VECTOR_BACKENDS, NumpyVectorStore, open_vector_store
 
 CHUNKS_PATH = os.path.join("data", "chunks", "chunks.jsonl")
-DB_DIR = os.path.join("data", "vectorstore", "chroma")
-COLLECTION_NAME = "medarion"
+MANIFEST_PATH = os.path.join("data", "vectorstore", "manifest.json")
+# chunk id -> content hash of the last ingest (kept out of manifest.json so it never has to fit in memory)
+HASHES_PATH = os.path.join("data", "vectorstore", "manifest_hashes.sqlite3")
+# Scratch space for the spilled BM25/facet runs while an ingest is running
+WORK_DIR = os.path.join("data", "vectorstore", "ingest_work")
+CHECKPOINT_PATH = os.path.join("data", "vectorstore", "ingest_checkpoint.json")
+EMBED_MODEL_NAME = "intfloat/e5-small-v2"
+BATCH_SIZE = 256
+# Batches buffered between parse -> embed -> write; bounds memory regardless of corpus size
+QUEUE_DEPTH = 4
+
+
+def content_hash(text: str, meta: dict) -> str:
+    """Changes whenever the embedded text or the stored metadata would change"""
+    h = hashlib.sha256(text.encode("utf-8"))
+    h.update(json.dumps(meta, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()[:32]
+
+
+def load_json(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json(data: dict, path: str) -> None:
+    """Write atomically so a crash never leaves a half-written manifest or checkpoint"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def source_fingerprint(path: str) -> dict:
+    st = os.stat(path)
+    return {"path": path, "size": st.st_size, "mtime": st.st_mtime}
+
+
+class HashManifest:
+    """
+    chunk id -> content hash table in SQLite.
+
+    A run writes the hashes it sees to a fresh table batch by batch and looks
+    up the previous run's table by primary key, so change detection and the
+    vanished-chunk scan need neither table in memory.
+    """
+
+    def __init__(self, path: str, create: bool = False) -> None:
+        self.path = path
+        if create:
+            for suffix in ("", "-journal"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Filled by the parse thread, read by the main thread once parsing has finished
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=OFF" if create else "PRAGMA query_only=ON")
+        if create:
+            self.conn.execute("CREATE TABLE chunks (chunk_id TEXT PRIMARY KEY, digest TEXT NOT NULL) WITHOUT ROWID")
+        self.pending: List[tuple] = []
+
+    @classmethod
+    def from_dict(cls, path: str, hashes: Dict[str, str]) -> "HashManifest":
+        """Convert the hashes of an older manifest.json that stored them inline"""
+        manifest = cls(path, create=True)
+        for chunk_id, digest in hashes.items():
+            manifest.add(chunk_id, digest)
+        manifest.flush()
+        return manifest
+
+    def get(self, chunk_id: str) -> Optional[str]:
+        row = self.conn.execute("SELECT digest FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, chunk_id: str, digest: str) -> None:
+        self.pending.append((chunk_id, digest))
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?)", self.pending)
+            self.conn.commit()
+            self.pending = []
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def missing_from(self, other: "HashManifest", batch: int = BATCH_SIZE):
+        """Yield lists of chunk ids present in `other` but not in this table"""
+        self.flush()
+        self.conn.execute("ATTACH DATABASE ? AS other", (other.path,))
+        try:
+            cur = self.conn.execute("SELECT chunk_id FROM other.chunks WHERE chunk_id NOT IN (SELECT chunk_id FROM main.chunks)")
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+        finally:
+            self.conn.execute("DETACH DATABASE other")
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+
+class Batch:
+    """Chunks to embed plus the byte offset in chunks.jsonl just past the last one"""
+
+    def __init__(self) -> None:
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        self.end_offset = 0
+        self.embeddings = None
+        # Shared-memory slot holding `embeddings` when a process pool embedded this batch
+        self.slot: Optional[int] = None
+
+
+class IngestPipeline:
+    """
+    Three-stage producer/consumer pipeline over chunks.jsonl:
+
+    parse (thread) -> embed (caller's thread, or an EmbeddingPool) -> write (thread)
+
+    Stages are connected by bounded queues, so at most ~QUEUE_DEPTH batches of
+    text and vectors are alive at any time; BM25 postings, facet columns and
+    content hashes go to disk as they are produced. After each batch is written
+    the byte offset reached is checkpointed; a restarted run re-reads the file
+    to rebuild the (cheap) BM25/facet indexes and hashes but only embeds chunks
+    past that offset.
+    """
+
+    def __init__(self, coll, model, known: Optional[HashManifest], resume_offset: int, checkpoint: dict, pool: Optional[EmbeddingPool] = None) -> None:
+        self.coll = coll
+        self.model = model
+        self.pool = pool
+        self.known = known
+        self.resume_offset = resume_offset
+        self.checkpoint = checkpoint
+        self.bm25 = BM25Builder(WORK_DIR)
+        self.facets = FacetBuilder(WORK_DIR)
+        self.hashes = HashManifest(HASHES_PATH + ".new", create=True)
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.to_embed: "queue.Queue[Optional[Batch]]" = queue.Queue(maxsize=QUEUE_DEPTH)
+        self.to_write: "queue.Queue[Optional[Batch]]" = queue.Queue(maxsize=QUEUE_DEPTH)
+        self.stop = threading.Event()
+        self.errors: List[BaseException] = []
+        self.dispatch_done = threading.Event()
+        self.in_flight_lock = threading.Lock()
+        self.submitted = 0
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return None
+
+    def _parse(self, path: str) -> None:
+        try:
+            batch = Batch()
+            offset = 0
+            with open(path, "rb") as f:
+                for raw in f:
+                    offset += len(raw)
+                    if not raw.strip():
+                        continue
+                    rec = json.loads(raw)
+                    chunk_id = f'{rec["doc_id"]}:{rec["chunk_id"]}'
+                    text = "passage: " + rec["content"]
+                    meta = rec["metadata"]
+                    meta.update({"doc_id": rec["doc_id"], "chunk_id": rec["chunk_id"]})
+                    if rec.get("offset_char") is not None:
+                        # Absent for chunks from older chunkers; the API then merges on textual overlap
+                        meta["offset_char"] = rec["offset_char"]
+                    flat = flatten_metadata(meta)
+                    self.bm25.add(chunk_id, rec["content"])
+                    self.facets.add(chunk_id, meta)
+                    digest = content_hash(text, flat)
+                    self.hashes.add(chunk_id, digest)
+                    previous = self.known.get(chunk_id) if self.known is not None else None
+                    if offset <= self.resume_offset or previous == digest:
+                        self.unchanged += offset > self.resume_offset
+                        continue
+                    if previous is not None:
+                        self.updated += 1
+                    else:
+                        self.added += 1
+                    batch.ids.append(chunk_id)
+                    batch.texts.append(text)
+                    batch.metadatas.append(flat)
+                    if len(batch.ids) >= BATCH_SIZE:
+                        batch.end_offset = offset
+                        if not self._put(self.to_embed, batch):
+                            return
+                        batch = Batch()
+            if batch.ids:
+                batch.end_offset = offset
+                self._put(self.to_embed, batch)
+        except BaseException as e:
+            self.errors.append(e)
+            self.stop.set()
+        finally:
+            self._put(self.to_embed, None)
+
+    def _write(self, progress: tqdm) -> None:
+        try:
+            while True:
+                batch = self._get(self.to_write)
+                if batch is None:
+                    return
+                self.coll.upsert(
+                    ids=batch.ids,
+                    embeddings=batch.embeddings,
+                    metadatas=batch.metadatas,
+                    documents=batch.texts,
+                )
+                if batch.slot is not None:
+                    self.pool.release(batch.slot)
+                save_json({**self.checkpoint, "offset": batch.end_offset}, CHECKPOINT_PATH)
+                progress.update(len(batch.ids))
+        except BaseException as e:
+            self.errors.append(e)
+            self.stop.set()
+
+    def _collect(self, in_flight: Dict[int, "Batch"]) -> None:
+        """Hand pool results to the writer in submit order, so checkpoints stay monotonic"""
+        collected = 0
+        try:
+            results = self.pool.results_in_order(self.stop)
+            while not (self.dispatch_done.is_set() and collected == self.submitted):
+                if self.stop.is_set():
+                    break
+                if collected == self.submitted:
+                    # Nothing outstanding yet; wait for the dispatcher instead of blocking on results
+                    self.dispatch_done.wait(timeout=0.05)
+                    continue
+                seq, _, vectors = next(results)
+                with self.in_flight_lock:
+                    batch = in_flight.pop(seq)
+                batch.embeddings = vectors
+                collected += 1
+                if not self._put(self.to_write, batch):
+                    break
+        except StopIteration:
+            pass
+        except BaseException as e:
+            self.errors.append(e)
+            self.stop.set()
+        finally:
+            self._put(self.to_write, None)
+
+    def run(self, path: str) -> None:
+        progress = tqdm(unit="chunk", desc="embedded")
+        parser = threading.Thread(target=self._parse, args=(path,), name="ingest-parse", daemon=True)
+        writer = threading.Thread(target=self._write, args=(progress,), name="ingest-write", daemon=True)
+        parser.start()
+        writer.start()
+        collector = None
+        try:
+            if self.pool is None:
+                while True:
+                    batch = self._get(self.to_embed)
+                    if batch is None:
+                        break
+                    batch.embeddings = self.model.encode(batch.texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False)
+                    if not self._put(self.to_write, batch):
+                        break
+            else:
+                in_flight: Dict[int, Batch] = {}
+                collector = threading.Thread(target=self._collect, args=(in_flight,), name="ingest-collect", daemon=True)
+                collector.start()
+                while True:
+                    batch = self._get(self.to_embed)
+                    if batch is None:
+                        break
+                    slot = self.pool.acquire(self.stop)
+                    if slot is None:
+                        break
+                    batch.slot = slot
+                    with self.in_flight_lock:
+                        in_flight[self.pool.submit(slot, batch.texts)] = batch
+                        self.submitted += 1
+                self.dispatch_done.set()
+        except BaseException as e:
+            self.errors.append(e)
+            self.stop.set()
+        finally:
+            if collector is not None:
+                self.dispatch_done.set()
+                collector.join()
+            else:
+                self._put(self.to_write, None)
+            parser.join()
+            writer.join()
+            progress.close()
+        if self.errors:
+            raise self.errors[0]
 
 
 def main() -> None:
-    os.makedirs(DB_DIR, exist_ok=True)
-    client = chromadb.PersistentClient(path=DB_DIR)
+    parser = argparse.ArgumentParser(description="Embed chunks.jsonl into the vector store")
+    parser.add_argument("--backend", choices=VECTOR_BACKENDS, default=VECTOR_BACKEND,
+                        help="vector store to write (default: $VECTOR_BACKEND or chroma)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only embed new/changed chunks and delete vanished ones, using the ingest manifest")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore an existing checkpoint instead of resuming from it")
+    parser.add_argument("--quantize", choices=QUANTIZATIONS + ("both",),
+                        help="also write a compact int8 and/or binary dense index for the API (DENSE_INDEX); "
+                             "an existing one is rebuilt with its kinds on every ingest")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="embedding processes; 1 embeds in-process, more shard batches across a process pool")
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="torch/BLAS threads per embedding process (default: cores / workers)")
+    args = parser.parse_args()
+
+    previous = load_json(MANIFEST_PATH) if args.incremental else {}
+    incremental = (
+        args.incremental
+        and previous.get("model") == EMBED_MODEL_NAME
+        and previous.get("backend", "chroma") == args.backend
+        and ("chunks" in previous or os.path.exists(HASHES_PATH))
+    )
+    known: Optional[HashManifest] = None
+    if incremental:
+        known = HashManifest.from_dict(HASHES_PATH, previous["chunks"]) if "chunks" in previous else HashManifest(HASHES_PATH)
+
+    # A checkpoint only applies to the exact same source file, model and mode
+    checkpoint = {
+        "source": source_fingerprint(CHUNKS_PATH),
+        "model": EMBED_MODEL_NAME,
+        "backend": args.backend,
+        "incremental": incremental,
+        "manifest_ingested_at": previous.get("ingested_at") if incremental else None,
+    }
+    saved = {} if args.restart else load_json(CHECKPOINT_PATH)
+    resume_offset = saved.get("offset", 0) if {k: saved.get(k) for k in checkpoint} == checkpoint else 0
+
+    if args.incremental and not incremental:
+        print(f"No usable manifest at {MANIFEST_PATH} (missing, or built with another model or backend); doing a full rebuild")
+
+    # Bring the embedder up first: a full rebuild wipes the store, so a pool that
+    # fails to start must fail before that rather than leave the store empty
+    model, pool = None, None
+    if args.workers > 1:
+        threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+        print(f"Embedding with {args.workers} worker processes x {threads} threads")
+        # Returns only once every worker has loaded the model and reported its dimension
+        pool = EmbeddingPool(EMBED_MODEL_NAME, args.workers, threads, slot_rows=BATCH_SIZE)
+    else:
+        model = SentenceTransformer(EMBED_MODEL_NAME)
+
     try:
-        client.delete_collection(COLLECTION_NAME)
-    except Exception:
-        pass
-    coll = client.create_collection(COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
-    model = SentenceTransformer("intfloat/e5-small-v2")
-
-    texts: List[str] = []
-    ids: List[str] = []
-    metadatas: List[dict] = []
-
-    with open(CHUNKS_PATH, "r", encoding="utf-8") as f:
-        for line in f:
-            rec = json.loads(line)
-            texts.append("passage: " + rec["content"])
-            ids.append(f'{rec["doc_id"]}:{rec["chunk_id"]}')
-            meta = rec["metadata"]
-            meta.update({"doc_id": rec["doc_id"], "chunk_id": rec["chunk_id"]})
-            metadatas.append(meta)
-
-    for i in tqdm(range(0, len(texts), 256)):
-        batch_texts = texts[i : i + 256]
-        embeddings = model.encode(batch_texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False)
-        coll.add(
-            ids=ids[i : i + 256],
-            embeddings=embeddings.tolist(),
-            metadatas=metadatas[i : i + 256],
-            documents=batch_texts,
-        )
-
-    print(f"Ingested {len(texts)} chunks into {DB_DIR}")
+        coll = open_vector_store(args.backend, reset=not (incremental or resume_offset))
+        if resume_offset:
+            print(f"Resuming from checkpoint at byte {resume_offset} of {CHUNKS_PATH}")
+        pipeline = IngestPipeline(coll, model, known, resume_offset, checkpoint, pool=pool)
+        pipeline.run(CHUNKS_PATH)
+    finally:
+        if pool is not None:
+            pool.close()
+    store_dir = NUMPY_DIR if args.backend == "numpy" else CHROMA_DIR
 
+    deleted = 0
+    if known is not None:
+        for vanished in pipeline.hashes.missing_from(known):
+            coll.delete(ids=vanished)
+            deleted += len(vanished)
+        known.close()
+    if isinstance(coll, NumpyVectorStore):
+        # Fold the pending write log into a searchable snapshot (and IVF partition)
+        coll.persist()
 
-if __name__ == "__main__":
-    main()
+    # BM25 and facets are cheap and always rebuilt over every chunk; only embedding is skipped
+    pipeline.bm25.save(BM25_DIR)
+    pipeline.facets.save(FACETS_DIR)
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+    summary = {"added": pipeline.added, "updated": pipeline.updated, "deleted": deleted, "unchanged": pipeline.unchanged}
+    chunk_count = len(pipeline.hashes)
+    pipeline.hashes.close()
+    os.replace(HASHES_PATH + ".new", HASHES_PATH)
+    save_json({
+        "model": EMBED_MODEL_NAME,
+        "backend": args.backend,
+        "collection": COLLECTION_NAME,
+        "source": CHUNKS_PATH,
+        "ingested_at": datetime.now(timezone.utc).isoformat(),
+        "incremental": incremental,
+        "resumed_from_offset": resume_offset,
+        "summary": summary,
+        "chunk_count": chunk_count,
+        "hashes": HASHES_PATH,
+    }, MANIFEST_PATH)
+    if os.path.exists(CHECKPOINT_PATH):
+        os.remove(CHECKPOINT_PATH)
+    kinds = ()
+    if args.quantize:
+        kinds = QUANTIZATIONS if args.quantize == "both" else (args.quantize,)
+    elif QuantizedIndex.exists(QUANTIZED_DIR):
+        # An index left by an earlier --quantize run would no longer match the store's ids; rebuild its kinds
+        kinds = tuple(load_json(os.path.join(QUANTIZED_DIR, "meta.json")).get("kinds") or QUANTIZATIONS)
+    if kinds:
+        # Built from the collection rather than the batches so incremental and resumed runs are covered
+        count = build_from_collection(coll, QUANTIZED_DIR, kinds)
+        print(f"Wrote {'/'.join(kinds)} quantized index of {count} vectors to {QUANTIZED_DIR}")
+    print(f"Ingested {chunk_count} chunks into {store_dir} (BM25 index: {BM25_DIR}): "
+          f"{summary['added']} added, {summary['updated']} updated, {summary['deleted']} deleted, {summary['unchanged']} unchanged")
 
 
+if __name__ == "__main__":
+    main()
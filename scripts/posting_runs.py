@@ -0,0 +1,154 @@
+import heapq
+import json
+import os
+import shutil
+import tempfile
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Postings held in memory before a run is spilled (each posting is `width` int32s)
+SPILL_POSTINGS = 4_000_000
+
+
+class SpilledPostings:
+    """
+    Key -> posting list accumulator that spills sorted runs to disk.
+
+    Postings must be added in increasing row order. Every `spill_postings`
+    postings the in-memory lists are written out as one run (sorted keys plus
+    one flat int32 file) and cleared, so memory stays bounded however many rows
+    are added. `merge()` k-way merges the runs' sorted keys and yields each key
+    with its postings concatenated in run order, i.e. still sorted by row.
+    """
+
+    def __init__(self, work_dir: str, width: int = 1, spill_postings: int = SPILL_POSTINGS) -> None:
+        self.work_dir = work_dir
+        self.width = width
+        self.spill_postings = spill_postings
+        os.makedirs(work_dir, exist_ok=True)
+        self.lists: Dict[str, array] = {}
+        self.pending = 0
+        self.runs = 0
+        self.total = 0
+
+    def add(self, key: str, *values: int) -> None:
+        plist = self.lists.get(key)
+        if plist is None:
+            plist = self.lists[key] = array("i")
+        plist.extend(values)
+        self.pending += 1
+        self.total += 1
+        if self.pending >= self.spill_postings:
+            self.spill()
+
+    def spill(self) -> None:
+        if not self.lists:
+            return
+        base = os.path.join(self.work_dir, f"run-{self.runs:05d}")
+        with open(base + ".keys", "w", encoding="utf-8") as keys, open(base + ".i32", "wb") as values:
+            for key in sorted(self.lists):
+                plist = self.lists[key]
+                keys.write(f"{json.dumps(key, ensure_ascii=False)}\t{len(plist) // self.width}\n")
+                plist.tofile(values)
+        self.runs += 1
+        self.lists = {}
+        self.pending = 0
+
+    def _run(self, idx: int) -> Iterator[Tuple[str, int, int, int]]:
+        base = os.path.join(self.work_dir, f"run-{idx:05d}")
+        offset = 0
+        with open(base + ".keys", "r", encoding="utf-8") as f:
+            for line in f:
+                key, count = line.rstrip("\n").rsplit("\t", 1)
+                yield json.loads(key), idx, offset, int(count)
+                offset += int(count)
+
+    def merge(self) -> Iterator[Tuple[str, np.ndarray]]:
+        """(key, postings of shape (n, width)) in key order"""
+        self.spill()
+        values = []
+        for idx in range(self.runs):
+            path = os.path.join(self.work_dir, f"run-{idx:05d}.i32")
+            size = os.path.getsize(path) // 4
+            values.append(np.memmap(path, dtype=np.int32, mode="r").reshape(-1, self.width) if size else np.zeros((0, self.width), np.int32))
+        current: Optional[str] = None
+        parts: List[np.ndarray] = []
+        # Runs tie-break on their index, so equal keys come out in row order
+        for key, idx, offset, count in heapq.merge(*(self._run(i) for i in range(self.runs))):
+            if key != current:
+                if parts:
+                    yield current, np.concatenate(parts)
+                current, parts = key, []
+            parts.append(np.asarray(values[idx][offset : offset + count]))
+        if parts:
+            yield current, np.concatenate(parts)
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class SpilledColumn:
+    """Append-only numeric column buffered in memory and flushed to a raw file"""
+
+    def __init__(self, path: str, dtype, flush_rows: int = SPILL_POSTINGS) -> None:
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.flush_rows = flush_rows
+        self.buffer: List[int] = []
+        self.rows = 0
+        open(path, "wb").close()
+
+    def append(self, value: int) -> None:
+        self.buffer.append(value)
+        self.rows += 1
+        if len(self.buffer) >= self.flush_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer:
+            with open(self.path, "ab") as f:
+                np.asarray(self.buffer, dtype=self.dtype).tofile(f)
+            self.buffer = []
+
+    def array(self) -> np.ndarray:
+        """Memory-mapped view of everything appended"""
+        self.flush()
+        if not self.rows:
+            return np.zeros(0, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r", shape=(self.rows,))
+
+
+class SpilledIds:
+    """Append-only chunk id list on disk, written back out as a JSON array"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.f = open(path, "w", encoding="utf-8")
+        self.count = 0
+
+    def append(self, chunk_id: str) -> None:
+        self.f.write(json.dumps(chunk_id, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def write_json_array(self, out) -> None:
+        """Stream the ids into an open text file as a JSON array"""
+        self.f.flush()
+        out.write("[")
+        with open(self.path, "r", encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                out.write(("," if i else "") + line.rstrip("\n"))
+        out.write("]")
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def make_work_dir(parent: Optional[str], prefix: str) -> str:
+    if parent is None:
+        return tempfile.mkdtemp(prefix=prefix)
+    path = os.path.join(parent, prefix.rstrip("-"))
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
@@ -3,41 +3,37 @@ import argparse
 import json
 from pathlib import Path
 
-
-def split_text(text: str, chunk_tokens: int = 800, overlap_tokens: int = 120):
-	words = text.split()
-	chunks = []
-	i = 0
-	while i < len(words):
-		chunk = words[i:i + chunk_tokens]
-		chunks.append(' '.join(chunk))
-		i += max(1, chunk_tokens - overlap_tokens)
-	return chunks
+from token_chunker import CHUNK_TOKENS, OVERLAP_TOKENS, chunk_stream
 
 
 def main():
 	parser = argparse.ArgumentParser()
 	parser.add_argument('--input_dir', required=True)
 	parser.add_argument('--output_dir', required=True)
+	parser.add_argument('--max_tokens', type=int, default=CHUNK_TOKENS)
+	parser.add_argument('--overlap_tokens', type=int, default=OVERLAP_TOKENS)
+	parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) - 1))
 	args = parser.parse_args()
 
 	in_dir = Path(args.input_dir)
 	out_dir = Path(args.output_dir)
 	out_dir.mkdir(parents=True, exist_ok=True)
 
-	with open(out_dir / 'chunks.jsonl', 'w', encoding='utf-8') as out:
+	def read_files():
 		for fp in in_dir.rglob('*'):
-			if not fp.is_file():
-				continue
-			if fp.suffix.lower() not in {'.txt', '.md'}:
-				continue
-			text = fp.read_text(encoding='utf-8', errors='ignore')
-			for chunk in split_text(text):
+			if fp.is_file() and fp.suffix.lower() in {'.txt', '.md'}:
+				yield fp, fp.read_text(encoding='utf-8', errors='ignore')
+
+	with open(out_dir / 'chunks.jsonl', 'w', encoding='utf-8') as out:
+		pieces_by_file = chunk_stream(read_files(), workers=args.workers, max_tokens=args.max_tokens, overlap_tokens=args.overlap_tokens)
+		for fp, pieces in pieces_by_file:
+			for offset, chunk, _ in pieces:
 				rec = {
 					'text': chunk,
 					'metadata': {
 						'source': str(fp.relative_to(in_dir)),
-						'type': fp.suffix.lower().lstrip('.')
+						'type': fp.suffix.lower().lstrip('.'),
+						'offset_char': offset
 					}
 				}
 				out.write(json.dumps(rec) + '\n')
@@ -0,0 +1,153 @@
+import json
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+QUANTIZED_DIR = os.path.join("data", "vectorstore", "quantized")
+QUANTIZATIONS = ("int8", "binary")
+# Rows scored per block during the coarse pass; bounds the float32 scratch space per query
+SCAN_BLOCK_ROWS = 16384
+# Shortlist = RESCORE_FACTOR * k candidates rescored with full-precision vectors;
+# sign bits are much coarser than int8 so they need a deeper shortlist
+RESCORE_FACTOR = {"int8": 10, "binary": 40}
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class QuantizedIndexBuilder:
+    """
+    Streams vectors to disk and writes the compressed codes once all are seen.
+
+    Full-precision vectors go to `vectors.f32` (only ever read for rescoring);
+    `finalize()` then writes per-dimension int8 codes and/or packed sign bits,
+    which are what a search keeps hot in RAM (4x and 32x smaller).
+    """
+
+    def __init__(self, out_dir: str = QUANTIZED_DIR) -> None:
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.raw_path = os.path.join(out_dir, "vectors.f32")
+        self.raw = open(self.raw_path, "wb")
+        self.ids: List[str] = []
+        self.dim: Optional[int] = None
+        self.absmax: Optional[np.ndarray] = None
+
+    def add(self, ids: Sequence[str], vectors) -> None:
+        vectors = _normalize(vectors)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self.absmax = np.zeros(self.dim, dtype=np.float32)
+        self.absmax = np.maximum(self.absmax, np.abs(vectors).max(axis=0))
+        self.raw.write(vectors.tobytes())
+        self.ids.extend(ids)
+
+    def finalize(self, kinds: Sequence[str] = QUANTIZATIONS) -> None:
+        self.raw.close()
+        count, dim = len(self.ids), self.dim or 0
+        scale = np.maximum(self.absmax if self.absmax is not None else np.zeros(dim, np.float32), 1e-12) / 127.0
+        if count:
+            full = np.memmap(self.raw_path, dtype=np.float32, mode="r", shape=(count, dim))
+            if "int8" in kinds:
+                codes = np.lib.format.open_memmap(os.path.join(self.out_dir, "int8.npy"), mode="w+", dtype=np.int8, shape=(count, dim))
+                for start in range(0, count, SCAN_BLOCK_ROWS):
+                    block = full[start : start + SCAN_BLOCK_ROWS]
+                    codes[start : start + len(block)] = np.clip(np.rint(block / scale), -127, 127).astype(np.int8)
+                codes.flush()
+                del codes
+            if "binary" in kinds:
+                bits = np.lib.format.open_memmap(os.path.join(self.out_dir, "binary.npy"), mode="w+", dtype=np.uint8, shape=(count, (dim + 7) // 8))
+                for start in range(0, count, SCAN_BLOCK_ROWS):
+                    block = full[start : start + SCAN_BLOCK_ROWS]
+                    bits[start : start + len(block)] = np.packbits(block > 0, axis=1)
+                bits.flush()
+                del bits
+            del full
+        np.save(os.path.join(self.out_dir, "int8_scale.npy"), scale.astype(np.float32))
+        with open(os.path.join(self.out_dir, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(self.ids, f)
+        with open(os.path.join(self.out_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"count": count, "dim": dim, "kinds": list(kinds), "normalized": True}, f)
+
+
+def build_from_collection(coll, out_dir: str = QUANTIZED_DIR, kinds: Sequence[str] = QUANTIZATIONS, page_size: int = 5000) -> int:
+    """Page every embedding out of a Chroma collection into a quantized index"""
+    builder = QuantizedIndexBuilder(out_dir)
+    offset = 0
+    while True:
+        page = coll.get(include=["embeddings"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        builder.add(page["ids"], np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+    builder.finalize(kinds)
+    return offset
+
+
+class QuantizedIndex:
+    """
+    Two-stage dense search: a coarse scan over int8 codes (approximate dot
+    product) or sign bits (Hamming distance), then an exact cosine rescore of
+    the shortlist from the memory-mapped float32 vectors.
+    """
+
+    def __init__(self, index_dir: str = QUANTIZED_DIR, kind: str = "int8") -> None:
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if kind not in meta["kinds"]:
+            raise ValueError(f"{index_dir} has no {kind} codes (built with {meta['kinds']})")
+        self.kind = kind
+        self.count, self.dim = meta["count"], meta["dim"]
+        with open(os.path.join(index_dir, "ids.json"), "r", encoding="utf-8") as f:
+            self.ids: List[str] = json.load(f)
+        self.full = np.memmap(os.path.join(index_dir, "vectors.f32"), dtype=np.float32, mode="r", shape=(self.count, self.dim))
+        self.scale = np.load(os.path.join(index_dir, "int8_scale.npy"))
+        self.codes = np.load(os.path.join(index_dir, f"{kind}.npy"), mmap_mode="r")
+
+    @staticmethod
+    def exists(index_dir: str = QUANTIZED_DIR) -> bool:
+        return os.path.exists(os.path.join(index_dir, "meta.json"))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _coarse_scores(self, query: np.ndarray, start: int, stop: int) -> np.ndarray:
+        block = self.codes[start:stop]
+        if self.kind == "int8":
+            return block.astype(np.float32) @ (query * self.scale)
+        q_bits = np.packbits(query > 0)
+        # Negated Hamming distance so that, like the int8 path, higher is better
+        return -POPCOUNT[np.bitwise_xor(block, q_bits)].sum(axis=1, dtype=np.int32).astype(np.float32)
+
+    def search(self, query, k: int, allowed: Optional[np.ndarray] = None, rescore_factor: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Top-k (chunk id, cosine similarity) pairs; `allowed` is an optional row mask"""
+        if not self.count:
+            return []
+        rescore_factor = rescore_factor or RESCORE_FACTOR[self.kind]
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        shortlist_size = max(k, k * rescore_factor)
+        cand_rows, cand_scores = [], []
+        for start in range(0, self.count, SCAN_BLOCK_ROWS):
+            stop = min(start + SCAN_BLOCK_ROWS, self.count)
+            scores = self._coarse_scores(query, start, stop)
+            if allowed is not None:
+                scores = np.where(allowed[start:stop], scores, -np.inf)
+            take = min(shortlist_size, len(scores))
+            top = np.argpartition(-scores, take - 1)[:take]
+            top = top[np.isfinite(scores[top])]
+            cand_rows.append(top + start)
+            cand_scores.append(scores[top])
+        rows = np.concatenate(cand_rows)
+        if not len(rows):
+            return []
+        if len(rows) > shortlist_size:
+            rows = rows[np.argpartition(-np.concatenate(cand_scores), shortlist_size - 1)[:shortlist_size]]
+        rows.sort()  # sequential reads from the float32 file
+        exact = np.asarray(self.full[rows]) @ query
+        order = np.argsort(-exact)[:k]
+        return [(self.ids[rows[i]], float(exact[i])) for i in order]
@@ -0,0 +1,176 @@
+import os
+import re
+from itertools import islice
+from multiprocessing import get_context
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+TOKENIZER_NAME = "intfloat/e5-small-v2"
+# e5 reads at most 512 tokens; leave room for the "passage: " prefix and special tokens
+CHUNK_TOKENS = 256
+OVERLAP_TOKENS = 32
+# A heading only forces a new chunk once the current one has this much content
+MIN_CHUNK_TOKENS = 64
+
+HEADING_RE = re.compile(r"^(#{1,6}\s+\S.*|[A-Z][A-Z0-9 ,&:/-]{3,80})$")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+
+
+def split_segments(text: str) -> List[Tuple[int, int, bool]]:
+    """
+    Break text into (start, end, starts_section) sentence spans.
+
+    Lines are grouped into paragraphs on blank lines; headings (markdown `#`
+    lines or short all-caps lines) are their own segment and start a section;
+    paragraphs are then cut after sentence-final punctuation.
+    """
+    segments: List[Tuple[int, int, bool]] = []
+    pos = 0
+    para_start: Optional[int] = None
+    para_end = 0
+
+    def flush_paragraph():
+        start = para_start
+        for match in SENTENCE_END_RE.finditer(text, para_start, para_end):
+            segments.append((start, match.start(), False))
+            start = match.end()
+        if start < para_end:
+            segments.append((start, para_end, False))
+
+    for line in text.splitlines(keepends=True):
+        line_start, stripped = pos, line.strip()
+        pos += len(line)
+        if not stripped:
+            if para_start is not None:
+                flush_paragraph()
+                para_start = None
+            continue
+        content_start = line_start + (len(line) - len(line.lstrip()))
+        content_end = content_start + len(stripped)
+        if HEADING_RE.match(stripped):
+            if para_start is not None:
+                flush_paragraph()
+                para_start = None
+            segments.append((content_start, content_end, True))
+            continue
+        if para_start is None:
+            para_start = content_start
+        para_end = content_end
+    if para_start is not None:
+        flush_paragraph()
+    return segments
+
+
+class TokenChunker:
+    """
+    Packs sentences into chunks of at most `max_tokens` embedding-model tokens.
+
+    Boundaries fall between sentences, and a heading starts a new chunk once
+    the current one holds `min_tokens`; consecutive chunks share up to
+    `overlap_tokens` worth of whole trailing sentences. A single sentence
+    longer than the budget is split on token boundaries. Chunks are exact
+    slices of the input, so their character offsets stay valid.
+    """
+
+    def __init__(self, tokenizer_name: str = TOKENIZER_NAME, max_tokens: int = CHUNK_TOKENS,
+                 overlap_tokens: int = OVERLAP_TOKENS, min_tokens: int = MIN_CHUNK_TOKENS) -> None:
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.min_tokens = min(min_tokens, max_tokens)
+
+    def _split_long(self, text: str, start: int, end: int) -> List[Tuple[int, int, int]]:
+        enc = self.tokenizer(text[start:end], add_special_tokens=False, return_offsets_mapping=True)
+        offsets = enc["offset_mapping"]
+        pieces = []
+        for i in range(0, len(offsets), self.max_tokens):
+            window = offsets[i : i + self.max_tokens]
+            pieces.append((start + window[0][0], start + window[-1][1], len(window)))
+        return pieces
+
+    def chunk(self, text: str) -> List[Tuple[int, str, int]]:
+        """(offset_char, chunk text, token count) for every chunk of `text`"""
+        segments = split_segments(text)
+        if not segments:
+            return []
+        counts = self.tokenizer([text[s:e] for s, e, _ in segments], add_special_tokens=False)["input_ids"]
+        units: List[Tuple[int, int, int, bool]] = []
+        for (start, end, heading), ids in zip(segments, counts):
+            if len(ids) > self.max_tokens:
+                units.extend((s, e, n, heading and i == 0) for i, (s, e, n) in enumerate(self._split_long(text, start, end)))
+            else:
+                units.append((start, end, len(ids), heading))
+
+        chunks: List[Tuple[int, str, int]] = []
+        current: List[Tuple[int, int, int, bool]] = []
+        used = 0
+
+        def emit():
+            start, end = current[0][0], current[-1][1]
+            chunks.append((start, text[start:end], used))
+
+        for unit in units:
+            _, _, n_tokens, heading = unit
+            new_section = heading and used >= self.min_tokens
+            if current and (used + n_tokens > self.max_tokens or new_section):
+                # A heading never ends a chunk: it moves forward with the text it introduces
+                lead: List[Tuple[int, int, int, bool]] = []
+                while len(current) > 1 and current[-1][3] and sum(u[2] for u in current[-1:] + lead) + n_tokens <= self.max_tokens:
+                    lead.insert(0, current.pop())
+                used -= sum(u[2] for u in lead)
+                emit()
+                # Carry trailing sentences forward as overlap, unless a new section starts here
+                carried: List[Tuple[int, int, int, bool]] = []
+                if not new_section and not lead:
+                    carried_tokens = 0
+                    for prev in reversed(current):
+                        if carried_tokens + prev[2] > self.overlap_tokens or carried_tokens + prev[2] + n_tokens > self.max_tokens:
+                            break
+                        carried.insert(0, prev)
+                        carried_tokens += prev[2]
+                    if len(carried) == len(current):
+                        carried = []
+                current = carried + lead
+                used = sum(u[2] for u in current)
+            current.append(unit)
+            used += n_tokens
+        if current:
+            emit()
+        return chunks
+
+
+_worker_chunker: Optional[TokenChunker] = None
+
+
+def _init_worker(kwargs: dict) -> None:
+    global _worker_chunker
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    _worker_chunker = TokenChunker(**kwargs)
+
+
+def _chunk_in_worker(item):
+    key, text = item
+    return key, _worker_chunker.chunk(text)
+
+
+def chunk_stream(items: Iterable[Tuple[object, str]], workers: int = 1, window: int = 512, **chunker_kwargs) -> Iterator[Tuple[object, List[Tuple[int, str, int]]]]:
+    """
+    Chunk (key, text) pairs, yielding (key, chunks) in input order as soon as
+    each document is done. With workers > 1 documents are spread over a
+    process pool, each process holding its own tokenizer. Pool.imap would
+    drain the whole input up front, so documents are fed in windows of
+    `window` to keep memory bounded for arbitrarily large corpora.
+    """
+    if workers <= 1:
+        chunker = TokenChunker(**chunker_kwargs)
+        for key, text in items:
+            yield key, chunker.chunk(text)
+        return
+    with get_context("spawn").Pool(workers, initializer=_init_worker, initargs=(chunker_kwargs,)) as pool:
+        items = iter(items)
+        while True:
+            batch = list(islice(items, window))
+            if not batch:
+                break
+            yield from pool.imap(_chunk_in_worker, batch, chunksize=max(1, min(8, len(batch) // workers)))
@@ -0,0 +1,372 @@
+import json
+import os
+import shutil
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+COLLECTION_NAME = "medarion"
+CHROMA_DIR = os.path.join("data", "vectorstore", "chroma")
+NUMPY_DIR = os.path.join("data", "vectorstore", "numpy")
+VECTOR_BACKENDS = ("chroma", "numpy")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# numpy backend search: "flat" (exact) or "ivf" (partitioned, approximate)
+NUMPY_INDEX = os.getenv("NUMPY_INDEX", "flat")
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+SCAN_BLOCK_ROWS = 65536
+
+
+def open_vector_store(backend: str = VECTOR_BACKEND, reset: bool = False):
+    """
+    Collection-like handle for the configured backend.
+
+    Both backends expose the subset of the Chroma Collection API that the RAG
+    code uses (upsert, delete, query, get, count), so callers are unchanged;
+    the numpy store additionally needs `persist()` after writing.
+    """
+    if backend == "chroma":
+        import chromadb
+
+        os.makedirs(CHROMA_DIR, exist_ok=True)
+        client = chromadb.PersistentClient(path=CHROMA_DIR)
+        if reset:
+            try:
+                client.delete_collection(COLLECTION_NAME)
+            except Exception:
+                pass
+        return client.get_or_create_collection(COLLECTION_NAME, metadata={"hnsw:space": "cosine"})
+    if backend == "numpy":
+        if reset and os.path.exists(NUMPY_DIR):
+            shutil.rmtree(NUMPY_DIR)
+        return NumpyVectorStore(NUMPY_DIR, index=NUMPY_INDEX, nprobe=IVF_NPROBE)
+    raise ValueError(f"Unknown vector backend {backend!r}; expected one of {VECTOR_BACKENDS}")
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _compare(value, op: str, operand) -> bool:
+    if op == "$eq":
+        return value == operand
+    if op == "$ne":
+        return value != operand
+    if op == "$in":
+        return value in operand
+    if op == "$nin":
+        return value not in operand
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > operand
+    if op == "$gte":
+        return value >= operand
+    if op == "$lt":
+        return value < operand
+    if op == "$lte":
+        return value <= operand
+    raise ValueError(f"Unsupported where operator {op}")
+
+
+def matches_where(meta: Optional[dict], where: Optional[dict]) -> bool:
+    """Evaluate a Chroma-style metadata `where` clause against one record"""
+    if not where:
+        return True
+    meta = meta or {}
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(matches_where(meta, c) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(matches_where(meta, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            if not all(_compare(meta.get(key), op, operand) for op, operand in cond.items()):
+                return False
+        elif meta.get(key) != cond:
+            return False
+    return True
+
+
+def train_ivf(vectors: np.ndarray, nlist: int, iterations: int = 10, sample: int = 100_000, seed: int = 0) -> np.ndarray:
+    """Spherical k-means centroids on a sample of the (normalized) vectors"""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    picked = np.sort(rng.choice(n, size=min(n, sample), replace=False))
+    train = np.asarray(vectors[picked], dtype=np.float32)
+    nlist = min(nlist, len(train))
+    centroids = train[rng.choice(len(train), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, train)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists so every partition stays in use
+            sums[empty] = train[rng.choice(len(train), size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class NumpyVectorStore:
+    """
+    Embeddings in one memory-mapped float32 matrix, searched with vectorized
+    dot products: exact block scans ("flat") or an inverted-file partition
+    ("ivf") that only scans the `nprobe` lists whose centroids best match the
+    query. Loading maps the files, so startup takes milliseconds.
+
+    Writes are appended to a pending operation log (plus a raw vector file)
+    and only become searchable after `persist()`, which replays the log into
+    a new snapshot and retrains the IVF partition.
+    """
+
+    def __init__(self, path: str = NUMPY_DIR, index: str = "flat", nprobe: int = IVF_NPROBE) -> None:
+        if index not in ("flat", "ivf"):
+            raise ValueError(f"Unknown numpy index {index!r}; expected flat or ivf")
+        self.path = path
+        self.index = index
+        self.nprobe = nprobe
+        os.makedirs(path, exist_ok=True)
+        self._where_masks: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._load()
+
+    # ---- snapshot -------------------------------------------------------
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self) -> None:
+        if os.path.exists(self._file("ids.json")):
+            with open(self._file("ids.json"), "r", encoding="utf-8") as f:
+                self.ids: List[str] = json.load(f)
+            self.vectors = np.load(self._file("vectors.npy"), mmap_mode="r")
+            self.record_offsets = np.load(self._file("record_offsets.npy"))
+        else:
+            self.ids, self.vectors, self.record_offsets = [], np.zeros((0, 0), dtype=np.float32), np.zeros(1, dtype=np.int64)
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self._metadatas: Optional[List[dict]] = None
+        self._where_masks.clear()
+        self.ivf = None
+        if self.index == "ivf" and os.path.exists(self._file("ivf_centroids.npy")):
+            self.ivf = (
+                np.load(self._file("ivf_centroids.npy")),
+                np.load(self._file("ivf_offsets.npy")),
+                np.load(self._file("ivf_rows.npy"), mmap_mode="r"),
+            )
+
+    def _records(self, rows: Iterable[int]) -> List[dict]:
+        out = []
+        with open(self._file("records.jsonl"), "rb") as f:
+            for row in rows:
+                f.seek(int(self.record_offsets[row]))
+                out.append(json.loads(f.readline()))
+        return out
+
+    def _all_metadatas(self) -> List[dict]:
+        if self._metadatas is None:
+            with open(self._file("records.jsonl"), "r", encoding="utf-8") as f:
+                self._metadatas = [json.loads(line).get("metadata") or {} for line in f]
+        return self._metadatas
+
+    def _where_mask(self, where: dict) -> np.ndarray:
+        key = json.dumps(where, sort_keys=True)
+        mask = self._where_masks.get(key)
+        if mask is None:
+            mask = np.fromiter((matches_where(m, where) for m in self._all_metadatas()), dtype=bool, count=len(self.ids))
+            self._where_masks[key] = mask
+            if len(self._where_masks) > 64:
+                self._where_masks.popitem(last=False)
+        else:
+            self._where_masks.move_to_end(key)
+        return mask
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    # ---- search ---------------------------------------------------------
+    def _candidate_rows(self, query: np.ndarray) -> Optional[np.ndarray]:
+        if self.ivf is None:
+            return None
+        centroids, offsets, rows = self.ivf
+        probes = np.argsort(-(centroids @ query))[: self.nprobe]
+        return np.sort(np.concatenate([np.asarray(rows[offsets[p] : offsets[p + 1]]) for p in probes]))
+
+    def _search_one(self, query: np.ndarray, k: int, allowed: Optional[np.ndarray]):
+        candidates = self._candidate_rows(query)
+        if candidates is not None:
+            if allowed is not None:
+                candidates = candidates[allowed[candidates]]
+            if not len(candidates):
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            scores = np.asarray(self.vectors[candidates]) @ query
+            take = min(k, len(scores))
+            top = np.argpartition(-scores, take - 1)[:take]
+            top = top[np.argsort(-scores[top])]
+            return candidates[top], scores[top]
+
+        best_rows, best_scores = [], []
+        for start in range(0, len(self.ids), SCAN_BLOCK_ROWS):
+            stop = min(start + SCAN_BLOCK_ROWS, len(self.ids))
+            scores = np.asarray(self.vectors[start:stop]) @ query
+            if allowed is not None:
+                scores = np.where(allowed[start:stop], scores, -np.inf)
+            take = min(k, len(scores))
+            top = np.argpartition(-scores, take - 1)[:take]
+            top = top[np.isfinite(scores[top])]
+            best_rows.append(top + start)
+            best_scores.append(scores[top])
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        order = np.argsort(-scores)[:k]
+        return rows[order], scores[order]
+
+    def query(self, query_embeddings, n_results: int = 10, include: Sequence[str] = ("metadatas", "documents", "distances"), where: Optional[dict] = None) -> dict:
+        queries = _normalize(query_embeddings)
+        allowed = self._where_mask(where) if where else None
+        result: Dict[str, list] = {"ids": []}
+        for key in ("documents", "metadatas", "distances", "embeddings"):
+            if key in include:
+                result[key] = []
+        for query in queries:
+            if not self.ids:
+                rows, scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            else:
+                rows, scores = self._search_one(query, n_results, allowed)
+            result["ids"].append([self.ids[r] for r in rows])
+            if "documents" in include or "metadatas" in include:
+                records = self._records(rows)
+                if "documents" in include:
+                    result["documents"].append([rec.get("document") for rec in records])
+                if "metadatas" in include:
+                    result["metadatas"].append([rec.get("metadata") for rec in records])
+            if "distances" in include:
+                # Cosine distance, matching the Chroma collection's hnsw:space
+                result["distances"].append([float(1.0 - s) for s in scores])
+            if "embeddings" in include:
+                result["embeddings"].append(np.asarray(self.vectors[rows]))
+        return result
+
+    def get(self, ids: Optional[Sequence[str]] = None, include: Sequence[str] = ("metadatas", "documents"), limit: Optional[int] = None, offset: int = 0, where: Optional[dict] = None) -> dict:
+        if ids is not None:
+            rows = [self.row_of[i] for i in ids if i in self.row_of]
+        else:
+            rows = range(len(self.ids))
+            if where:
+                rows = np.flatnonzero(self._where_mask(where))
+            rows = list(rows[offset : offset + limit] if limit is not None else rows[offset:])
+        result: Dict[str, object] = {"ids": [self.ids[r] for r in rows]}
+        if "documents" in include or "metadatas" in include:
+            records = self._records(rows)
+            if "documents" in include:
+                result["documents"] = [rec.get("document") for rec in records]
+            if "metadatas" in include:
+                result["metadatas"] = [rec.get("metadata") for rec in records]
+        if "embeddings" in include:
+            result["embeddings"] = np.asarray(self.vectors[rows]) if rows else np.zeros((0, self.vectors.shape[1] if self.vectors.ndim == 2 else 0), dtype=np.float32)
+        return result
+
+    # ---- writes ---------------------------------------------------------
+    def upsert(self, ids: Sequence[str], embeddings, metadatas: Optional[Sequence[dict]] = None, documents: Optional[Sequence[str]] = None) -> None:
+        vectors = _normalize(embeddings)
+        metadatas = metadatas or [None] * len(ids)
+        documents = documents or [None] * len(ids)
+        vec_path = self._file("pending_vectors.f32")
+        first = os.path.getsize(vec_path) // (4 * vectors.shape[1]) if os.path.exists(vec_path) else 0
+        with open(vec_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self._file("pending_ops.jsonl"), "a", encoding="utf-8") as f:
+            for i, (chunk_id, doc, meta) in enumerate(zip(ids, documents, metadatas)):
+                op = {"op": "upsert", "id": chunk_id, "row": first + i, "dim": vectors.shape[1], "document": doc, "metadata": meta}
+                f.write(json.dumps(op, ensure_ascii=False) + "\n")
+
+    add = upsert
+
+    def delete(self, ids: Sequence[str]) -> None:
+        with open(self._file("pending_ops.jsonl"), "a", encoding="utf-8") as f:
+            for chunk_id in ids:
+                f.write(json.dumps({"op": "delete", "id": chunk_id}) + "\n")
+
+    def _pending(self):
+        """Replay the pending log: (id -> final upsert op, ids touched, pending vectors)"""
+        final: Dict[str, Optional[dict]] = {}
+        dim = None
+        path = self._file("pending_ops.jsonl")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    op = json.loads(line)
+                    if op["op"] == "upsert":
+                        final[op["id"]] = op
+                        dim = op["dim"]
+                    else:
+                        final[op["id"]] = None
+        vectors = None
+        if dim is not None:
+            vectors = np.memmap(self._file("pending_vectors.f32"), dtype=np.float32, mode="r").reshape(-1, dim)
+        upserts = {chunk_id: op for chunk_id, op in final.items() if op is not None}
+        return upserts, set(final), vectors
+
+    def persist(self, nlist: Optional[int] = None) -> None:
+        """Compact the pending segment into a new snapshot (and IVF partition)"""
+        upserts, touched, pending_vectors = self._pending()
+        if not touched and (self.index != "ivf" or self.ivf is not None or not self.ids):
+            return
+        keep_rows = [row for row, chunk_id in enumerate(self.ids) if chunk_id not in touched]
+        dim = self.vectors.shape[1] if self.ids else (pending_vectors.shape[1] if pending_vectors is not None else 0)
+        total = len(keep_rows) + len(upserts)
+
+        tmp = self.path.rstrip(os.sep) + ".compact"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        out_vectors = np.lib.format.open_memmap(os.path.join(tmp, "vectors.npy"), mode="w+", dtype=np.float32, shape=(total, dim))
+        offsets = np.zeros(total + 1, dtype=np.int64)
+        new_ids: List[str] = []
+        with open(os.path.join(tmp, "records.jsonl"), "wb") as out:
+            row = 0
+            for start in range(0, len(keep_rows), SCAN_BLOCK_ROWS):
+                block = keep_rows[start : start + SCAN_BLOCK_ROWS]
+                out_vectors[row : row + len(block)] = self.vectors[block]
+                for rec in self._records(block):
+                    offsets[row] = out.tell()
+                    out.write((json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8"))
+                    row += 1
+                new_ids.extend(self.ids[r] for r in block)
+            for chunk_id, op in upserts.items():
+                out_vectors[row] = pending_vectors[op["row"]]
+                offsets[row] = out.tell()
+                out.write((json.dumps({"document": op["document"], "metadata": op["metadata"]}, ensure_ascii=False) + "\n").encode("utf-8"))
+                new_ids.append(chunk_id)
+                row += 1
+            offsets[total] = out.tell()
+        out_vectors.flush()
+        np.save(os.path.join(tmp, "record_offsets.npy"), offsets)
+        with open(os.path.join(tmp, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(new_ids, f)
+        if self.index == "ivf" and total:
+            centroids = train_ivf(out_vectors, nlist or max(1, min(int(np.sqrt(total)), 4096)))
+            nlist = len(centroids)
+            assign = np.empty(total, dtype=np.int32)
+            for start in range(0, total, SCAN_BLOCK_ROWS):
+                block = np.asarray(out_vectors[start : start + SCAN_BLOCK_ROWS])
+                assign[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable").astype(np.int64)
+            list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+            np.save(os.path.join(tmp, "ivf_centroids.npy"), centroids)
+            np.save(os.path.join(tmp, "ivf_offsets.npy"), list_offsets)
+            np.save(os.path.join(tmp, "ivf_rows.npy"), order)
+        del out_vectors
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.ivf = None
+
+        # Swap the snapshot in; the pending segment is consumed by it
+        old = self.path.rstrip(os.sep) + ".old"
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        os.replace(self.path, old)
+        os.replace(tmp, self.path)
+        shutil.rmtree(old)
+        self._load()
@@ -1,44 +1,443 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import chromadb
 from sentence_transformers import SentenceTransformer
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import httpx
+import json
+import numpy as np
 import os
-import requests
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts"))
+from bm25_index import BM25_DIR, BM25Index, reciprocal_rank_fusion  # noqa: E402
+from context_packing import pack_passages  # noqa: E402
+from embedding_cache import EmbeddingCache  # noqa: E402
+from facet_index import FACETS_DIR, FacetIndex, build_where  # noqa: E402
+from quantized_index import QUANTIZED_DIR, QuantizedIndex  # noqa: E402
+from vector_store import VECTOR_BACKEND, open_vector_store  # noqa: E402
 
-DB_DIR = os.path.join("data", "vectorstore", "chroma")
-COLLECTION_NAME = "medarion"
 MISTRAL_BASE = os.getenv("MISTRAL_BASE", "http://localhost:11434/v1")
 MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", "mistral")
+EMBED_MODEL_NAME = "intfloat/e5-small-v2"
+# Queries arriving within EMBED_BATCH_WAIT_MS of each other share one encode() call
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "64"))
+# Query embedding cache: bounded by entries and bytes; 0 disables it
+QUERY_CACHE_ENTRIES = int(os.getenv("QUERY_CACHE_ENTRIES", "10000"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Optional memory-mapped file that keeps cached vectors across restarts
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "")
+QUERY_CACHE_FILE_SLOTS = int(os.getenv("QUERY_CACHE_FILE_SLOTS", "65536"))
+# Pooled connections to the Mistral backend and a cap on in-flight completions
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", str(LLM_MAX_CONCURRENCY)))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# Token budget for the packed context block (measured with the embedding tokenizer)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Passages whose word-shingle Jaccard similarity reaches this are treated as duplicates
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.85"))
+# Hybrid retrieval: candidates taken from each ranker before reciprocal-rank fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+SEARCH_MODES = ("vector", "bm25", "hybrid")
+# Dense search backend: "chroma", or the compact "int8"/"binary" index from ingest_rag.py --quantize
+DENSE_INDEX = os.getenv("DENSE_INDEX", "chroma")
+# Optional cross-encoder rerank of an over-fetched candidate set
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))
+
+
+class QueryEmbedder:
+    """
+    Coalesces concurrent single-query embeddings into batched encode() calls.
+
+    Request threads enqueue their query and block on a Future; one worker thread
+    drains the queue (waiting at most `wait_ms` for more queries to arrive, up to
+    `batch_size`), runs a single forward pass and fans the vectors back out.
+    """
+
+    def __init__(self, model: SentenceTransformer, batch_size: int = EMBED_BATCH_SIZE, wait_ms: float = EMBED_BATCH_WAIT_MS, cache: EmbeddingCache | None = None):
+        self.model = model
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.wait = max(0.0, wait_ms) / 1000.0
+        self.pending: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+        self.worker = threading.Thread(target=self._loop, name="query-embedder", daemon=True)
+        self.worker.start()
+
+    def encode(self, texts: list[str]):
+        """Embed an already-batched list of texts in one call"""
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False)
+
+    def embed(self, query: str):
+        """Embed one search query, sharing the forward pass with concurrent callers"""
+        text = f"query: {query}"
+        if self.cache is not None:
+            vec = self.cache.get(text)
+            if vec is not None:
+                return vec
+        fut: Future = Future()
+        self.pending.put((text, fut))
+        vec = fut.result()
+        if self.cache is not None:
+            self.cache.put(text, vec)
+        return vec
+
+    def embed_many(self, queries: list[str]):
+        texts = [f"query: {q}" for q in queries]
+        if self.cache is None:
+            return self.encode(texts)
+        vectors = [self.cache.get(text) for text in texts]
+        missing = [i for i, vec in enumerate(vectors) if vec is None]
+        if missing:
+            for i, vec in zip(missing, self.encode([texts[i] for i in missing])):
+                self.cache.put(texts[i], vec)
+                vectors[i] = vec
+        return np.stack(vectors)
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self.pending.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.pending.get(timeout=self.wait) if self.wait else self.pending.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                vectors = self.encode([text for text, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), vec in zip(batch, vectors):
+                fut.set_result(vec)
+
+
+class Reranker:
+    """
+    Scores (query, passage) pairs with a small CPU cross-encoder, one batch at a
+    time, and gives up once `budget_ms` is spent: the caller then keeps the
+    retriever's own order, so reranking can only ever add bounded latency.
+    The model is loaded at startup when reranking is on by default; a lazy load
+    for a per-request opt-in counts against that request's budget.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL_NAME, batch_size: int = RERANK_BATCH_SIZE, budget_ms: float = RERANK_BUDGET_MS):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.budget = budget_ms / 1000.0
+        self.model = None
+        self.load_lock = threading.Lock()
+        self.reranked = 0
+        self.fallbacks = 0
+
+    def load(self):
+        with self.load_lock:
+            if self.model is None:
+                from sentence_transformers import CrossEncoder
+
+                self.model = CrossEncoder(self.model_name, device="cpu")
+        return self.model
+
+    def rerank(self, query: str, sources: list[dict], k: int) -> list[dict]:
+        """Best `k` of `sources` by cross-encoder score, or the first `k` if over budget"""
+        if len(sources) <= 1:
+            return sources[:k]
+        deadline = time.perf_counter() + self.budget
+        model = self.load()
+        scores: list[float] = []
+        for i in range(0, len(sources), self.batch_size):
+            # Checked before every batch, including the first, so a slow load also falls back
+            if time.perf_counter() >= deadline:
+                self.fallbacks += 1
+                return sources[:k]
+            batch = sources[i : i + self.batch_size]
+            scores.extend(float(x) for x in model.predict([(query, src["text"]) for src in batch], batch_size=self.batch_size, show_progress_bar=False))
+        self.reranked += 1
+        order = sorted(range(len(sources)), key=lambda i: scores[i], reverse=True)[:k]
+        return [{**sources[i], "score": scores[i], "retrieval_rank": i} for i in order]
+
+    def stats(self) -> dict:
+        return {"model": self.model_name, "loaded": self.model is not None, "reranked": self.reranked, "fallbacks": self.fallbacks}
+
 
 app = FastAPI()
-client = chromadb.PersistentClient(path=DB_DIR)
-coll = client.get_collection(COLLECTION_NAME)
-embed_model = SentenceTransformer("intfloat/e5-small-v2")
+# Chroma collection or numpy-backed store, chosen by VECTOR_BACKEND; both speak the Collection API
+coll = open_vector_store(VECTOR_BACKEND)
+embed_model = SentenceTransformer(EMBED_MODEL_NAME)
+query_cache = (
+    EmbeddingCache(QUERY_CACHE_ENTRIES, QUERY_CACHE_MAX_BYTES, QUERY_CACHE_PATH, QUERY_CACHE_FILE_SLOTS)
+    if QUERY_CACHE_ENTRIES > 0 else None
+)
+embedder = QueryEmbedder(embed_model, cache=query_cache)
+# Built by scripts/ingest_rag.py next to the vector store; bm25/hybrid modes need it
+bm25 = BM25Index(BM25_DIR) if BM25Index.exists(BM25_DIR) else None
+# Facet columns are row-aligned with the BM25 index; they filter keyword search and serve /facets
+facets = FacetIndex(FACETS_DIR) if FacetIndex.exists(FACETS_DIR) else None
+if bm25 is not None and facets is not None and facets.ids != bm25.ids:
+    print(f"Facet index at {FACETS_DIR} does not match the BM25 index; keyword search will ignore filters")
+    facet_mask_usable = False
+else:
+    facet_mask_usable = True
+dense_index = QuantizedIndex(QUANTIZED_DIR, DENSE_INDEX) if DENSE_INDEX != "chroma" else None
+# Quantized rows follow Chroma's paging order, so facet masks are remapped onto them
+if dense_index is not None and facets is not None:
+    _dense_rows = {chunk_id: row for row, chunk_id in enumerate(dense_index.ids)}
+    facet_to_dense_row = np.array([_dense_rows.get(chunk_id, -1) for chunk_id in facets.ids], dtype=np.int64)
+    del _dense_rows
+else:
+    facet_to_dense_row = None
+reranker = Reranker()
+if RERANK_ENABLED:
+    reranker.load()
+retrieval_pool = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVAL_THREADS", "8")), thread_name_prefix="retrieval")
+# Created on startup so they bind to the server's event loop
+llm_client: httpx.AsyncClient | None = None
+llm_slots: asyncio.Semaphore | None = None
+
+
+@app.on_event("startup")
+async def open_llm_client():
+    global llm_client, llm_slots
+    llm_client = httpx.AsyncClient(
+        base_url=MISTRAL_BASE,
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+    )
+    llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    if llm_client is not None:
+        await llm_client.aclose()
+
+
+@app.on_event("shutdown")
+def flush_query_cache():
+    if query_cache is not None:
+        query_cache.flush()
+
+
+async def acquire_llm_slot() -> None:
+    """Take one of LLM_MAX_CONCURRENCY backend slots; 503 if none frees up in time"""
+    try:
+        await asyncio.wait_for(llm_slots.acquire(), timeout=LLM_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="LLM backend is busy, retry later", headers={"Retry-After": "5"})
+
+
+@asynccontextmanager
+async def llm_slot():
+    await acquire_llm_slot()
+    try:
+        yield
+    finally:
+        llm_slots.release()
+
+
+class SearchFilters(BaseModel):
+    company: str | list[str] | None = None
+    tag: str | list[str] | None = None
+    lang: str | None = None
+    created_from: str | None = None
+    created_to: str | None = None
+
+    def where(self) -> dict | None:
+        return build_where(**self.model_dump())
+
+    def mask(self):
+        if facets is None or not facet_mask_usable:
+            return None
+        return facets.mask(**self.model_dump())
+
+    def dense_mask(self):
+        """The facet mask re-indexed onto the quantized dense index rows"""
+        mask = facets.mask(**self.model_dump()) if facet_to_dense_row is not None else None
+        if mask is None:
+            return None
+        dense = np.zeros(len(dense_index), dtype=bool)
+        present = facet_to_dense_row >= 0
+        dense[facet_to_dense_row[present]] = mask[present]
+        return dense
 
 
 class SearchReq(BaseModel):
     query: str
     k: int = 5
+    mode: str = "vector"
+    filters: SearchFilters | None = None
+
+
+class BatchSearchReq(BaseModel):
+    queries: list[str]
+    k: int = 5
+    mode: str = "vector"
+    filters: SearchFilters | None = None
 
 
 class ChatReq(BaseModel):
     query: str
     k: int = 4
     system: str | None = None
+    stream: bool = False
+    max_context_tokens: int | None = None
+    mode: str = "vector"
+    filters: SearchFilters | None = None
+    rerank: bool | None = None
+
+
+def vector_query(q_embs, k: int, include: tuple = ("metadatas", "documents"), where: dict | None = None):
+    return coll.query(query_embeddings=q_embs, n_results=k, include=list(include), where=where)
+
+
+def dense_ranked(q_emb, k: int, filters: SearchFilters | None = None) -> list[tuple[str, float]]:
+    """Top-k (chunk id, cosine similarity) from the configured dense backend"""
+    if dense_index is not None:
+        return dense_index.search(q_emb, k, allowed=filters.dense_mask() if filters else None)
+    res = vector_query(q_emb[None, :], k, include=("distances",), where=filters.where() if filters else None)
+    return [(chunk_id, 1.0 - dist) for chunk_id, dist in zip(res["ids"][0], res["distances"][0])]
+
+
+def pack_contexts(sources: list[dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> list[dict]:
+    """Merged, deduplicated context passages that fit `token_budget` embedding-model tokens"""
+    return pack_passages(sources, embed_model.tokenizer, token_budget, dedup_similarity=DEDUP_SIMILARITY)
+
+
+@app.get("/facets")
+def get_facets():
+    """Chunk counts per company, tag, language and month, precomputed at ingest"""
+    if facets is None:
+        raise HTTPException(status_code=404, detail=f"No facet index at {FACETS_DIR}; re-run scripts/ingest_rag.py")
+    return facets.counts
+
+
+@app.get("/stats")
+def stats():
+    return {
+        "query_cache": query_cache.stats() if query_cache is not None else None,
+        "rerank": reranker.stats(),
+        "dense_index": {"store": VECTOR_BACKEND, "backend": DENSE_INDEX, "vectors": len(dense_index) if dense_index is not None else coll.count()},
+    }
+
+
+def check_mode(mode: str, filters: SearchFilters | None = None) -> None:
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(SEARCH_MODES)}")
+    if mode != "vector" and bm25 is None:
+        raise HTTPException(status_code=400, detail=f"No BM25 index at {BM25_DIR}; re-run scripts/ingest_rag.py")
+    if mode != "vector" and filters is not None and filters.where() is not None and (facets is None or not facet_mask_usable):
+        raise HTTPException(status_code=400, detail=f"Filters need the facet index at {FACETS_DIR} for mode={mode}; use mode=vector or re-run ingest")
+    if dense_index is not None and filters is not None and filters.where() is not None and facet_to_dense_row is None:
+        raise HTTPException(status_code=400, detail=f"Filters need the facet index at {FACETS_DIR} with DENSE_INDEX={DENSE_INDEX}")
+
+
+def fetch_chunks(ranked: list[tuple[str, float]]) -> dict:
+    """Chroma-shaped single-query result for an externally ranked list of chunk ids"""
+    ids = [chunk_id for chunk_id, _ in ranked]
+    got = coll.get(ids=ids, include=["metadatas", "documents"]) if ids else {"ids": [], "documents": [], "metadatas": []}
+    by_id = {chunk_id: (doc, meta) for chunk_id, doc, meta in zip(got["ids"], got["documents"], got["metadatas"])}
+    kept = [(chunk_id, score) for chunk_id, score in ranked if chunk_id in by_id]
+    return {
+        "ids": [[chunk_id for chunk_id, _ in kept]],
+        "documents": [[by_id[chunk_id][0] for chunk_id, _ in kept]],
+        "metadatas": [[by_id[chunk_id][1] for chunk_id, _ in kept]],
+        "scores": [[score for _, score in kept]],
+    }
+
+
+def retrieve(query: str, k: int, mode: str = "vector", filters: SearchFilters | None = None):
+    """
+    Top-k chunks for one query. "vector" is the plain vector-store query; "bm25" ranks
+    by the keyword index; "hybrid" runs both in parallel and fuses them with RRF.
+    Filters become a Chroma `where` clause and a facet row mask for BM25.
+    """
+    where = filters.where() if filters else None
+    allowed = filters.mask() if filters and mode != "vector" else None
+    if mode == "vector":
+        q_emb = embedder.embed(query)
+        if dense_index is not None:
+            return fetch_chunks(dense_ranked(q_emb, k, filters))
+        return vector_query(q_emb[None, :], k, include=("metadatas", "documents", "distances"), where=where)
+    if mode == "bm25":
+        return fetch_chunks(bm25.search(query, k, allowed))
+
+    n_candidates = max(k, HYBRID_CANDIDATES)
+    keyword = retrieval_pool.submit(bm25.search, query, n_candidates, allowed)
+    q_emb = embedder.embed(query)
+    dense = [chunk_id for chunk_id, _ in dense_ranked(q_emb, n_candidates, filters)]
+    fused = reciprocal_rank_fusion([dense, [chunk_id for chunk_id, _ in keyword.result()]], k, rrf_k=RRF_K)
+    return fetch_chunks(fused)
 
 
 @app.post("/search")
 def search(req: SearchReq):
-    q_emb = embed_model.encode([f"query: {req.query}"], convert_to_numpy=True)
-    res = coll.query(query_embeddings=q_emb.tolist(), n_results=req.k, include=["metadatas", "documents"])
-    return res
+    check_mode(req.mode, req.filters)
+    return retrieve(req.query, req.k, req.mode, req.filters)
+
+
+def query_hits(res: dict, row: int = 0) -> dict:
+    """
+    One query's row of a Chroma-shaped result as flat lists: ids, documents,
+    metadatas and a higher-is-better `scores` (cosine similarity for vector
+    search, the ranker's own score for bm25/hybrid)
+    """
+    ids = res["ids"][row]
+    if res.get("scores"):
+        scores = res["scores"][row]
+    elif res.get("distances"):
+        scores = [1.0 - dist for dist in res["distances"][row]]
+    else:
+        scores = [None] * len(ids)
+    return {"ids": ids, "documents": res["documents"][row], "metadatas": res["metadatas"][row], "scores": scores}
+
+
+@app.post("/search/batch")
+def search_batch(req: BatchSearchReq):
+    """
+    {"results": [hits per query, in order]}, each shaped like query_hits() whatever
+    the mode or dense backend
+    """
+    check_mode(req.mode, req.filters)
+    if not req.queries:
+        return {"results": []}
+    if len(req.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    if req.mode != "vector":
+        return {"results": [query_hits(retrieve(query, req.k, req.mode, req.filters)) for query in req.queries]}
+    q_embs = embedder.embed_many(req.queries)
+    if dense_index is not None:
+        return {"results": [query_hits(fetch_chunks(dense_ranked(q_emb, req.k, req.filters))) for q_emb in q_embs]}
+    # One multi-embedding Chroma query; each requested field has one row per query
+    res = vector_query(q_embs, req.k, include=("metadatas", "documents", "distances"), where=req.filters.where() if req.filters else None)
+    return {"results": [query_hits(res, i) for i in range(len(req.queries))]}
 
 
 @app.post("/chat")
-def chat(req: ChatReq):
-    q_emb = embed_model.encode([f"query: {req.query}"], convert_to_numpy=True)
-    res = coll.query(query_embeddings=q_emb.tolist(), n_results=req.k, include=["metadatas", "documents"])
-    contexts = [doc.replace("passage: ", "") for doc in res["documents"][0]]
+async def chat(req: ChatReq):
+    check_mode(req.mode, req.filters)
+    rerank = RERANK_ENABLED if req.rerank is None else req.rerank
+    n_candidates = max(req.k, RERANK_CANDIDATES) if rerank else req.k
+    # Embedding, the vector store and the cross-encoder are blocking; keep them off the event loop
+    res = await run_in_threadpool(retrieve, req.query, n_candidates, req.mode, req.filters)
+    sources = context_sources(res)
+    if rerank:
+        sources = await run_in_threadpool(reranker.rerank, req.query, sources, req.k)
+    budget = req.max_context_tokens or CONTEXT_TOKEN_BUDGET
+    packed = await run_in_threadpool(pack_contexts, sources, budget)
+    contexts = [p["text"] for p in packed]
     context_block = "\n\n".join([f"- {c}" for c in contexts])
 
     sys_prompt = req.system or "You are a helpful assistant that answers based on context."
@@ -53,10 +452,79 @@ def chat(req: ChatReq):
         "temperature": 0.2,
         "max_tokens": 512,
     }
-    r = requests.post(f"{MISTRAL_BASE}/chat/completions", json=payload, timeout=120)
-    r.raise_for_status()
+    if req.stream:
+        return StreamingResponse(stream_chat(payload, packed), media_type="text/event-stream")
+
+    async with llm_slot():
+        try:
+            r = await llm_client.post("/chat/completions", json=payload)
+            r.raise_for_status()
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"LLM backend error: {e}")
     out = r.json()
     answer = out["choices"][0]["message"]["content"]
     return {"answer": answer, "contexts": contexts}
 
 
+def context_sources(res: dict) -> list[dict]:
+    """Retrieved chunks with their Chroma ids, metadata and similarity scores, for citations"""
+    ids = res.get("ids") or [[]]
+    documents = res.get("documents") or [[]]
+    metadatas = res.get("metadatas") or [[None] * len(documents[0])]
+    if res.get("scores"):
+        # bm25/hybrid results already carry a higher-is-better score
+        scores = res["scores"][0]
+    elif res.get("distances"):
+        # Cosine distance from the collection's hnsw:space
+        scores = [1.0 - dist for dist in res["distances"][0]]
+    else:
+        scores = [-float(rank) for rank in range(len(documents[0]))]
+    return [
+        {"id": chunk_id, "text": doc.replace("passage: ", ""), "metadata": meta, "score": score}
+        for chunk_id, doc, meta, score in zip(ids[0], documents[0], metadatas[0], scores)
+    ]
+
+
+async def stream_chat(payload: dict, sources: list[dict]):
+    """
+    SSE stream for /chat: a "contexts" event with the retrieved sources goes out
+    immediately, then one "token" event per backend delta, then "done".
+    """
+    yield sse_event({"type": "contexts", "contexts": sources})
+    try:
+        await acquire_llm_slot()
+    except HTTPException as e:
+        yield sse_event({"type": "error", "error": e.detail})
+        return
+    finish_reason = None
+    try:
+        async with llm_client.stream("POST", "/chat/completions", json={**payload, "stream": True}) as r:
+            if r.status_code >= 400:
+                body = (await r.aread()).decode("utf-8", "replace")
+                yield sse_event({"type": "error", "error": f"LLM backend returned {r.status_code}: {body[:200]}"})
+                return
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    choice = json.loads(data)["choices"][0]
+                except (ValueError, KeyError, IndexError):
+                    continue
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    yield sse_event({"type": "token", "content": content})
+                finish_reason = choice.get("finish_reason") or finish_reason
+    except httpx.HTTPError as e:
+        yield sse_event({"type": "error", "error": f"LLM backend error: {e}"})
+        return
+    finally:
+        llm_slots.release()
+    yield sse_event({"type": "done", "finish_reason": finish_reason})
+    yield "data: [DONE]\n\n"
+
+
+def sse_event(data: dict) -> str:
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
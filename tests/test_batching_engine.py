@@ -0,0 +1,104 @@
+import os
+import random
+import sys
+import threading
+
+import pytest
+
+# The server module imports these at the top; skip when they are absent
+for _module in ("torch", "transformers", "flask", "boto3"):
+    pytest.importorskip(_module)
+
+import torch  # noqa: E402
+from transformers import MistralConfig, MistralForCausalLM  # noqa: E402
+
+os.environ.setdefault("MEDARION_RESPONSE_CACHE_PATH", "")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import run_api_on_vast as api  # noqa: E402
+
+EOS = 100
+
+
+class _Tokenizer:
+    eos_token_id = EOS
+
+
+@pytest.fixture(scope="module")
+def model():
+    # A tiny randomly initialised Mistral: same attention and cache code paths as the real model
+    torch.manual_seed(0)
+    config = MistralConfig(
+        vocab_size=EOS + 1, hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512, sliding_window=None,
+    )
+    return MistralForCausalLM(config).eval()
+
+
+def reference(model, prompt, max_new_tokens):
+    out = model.generate(torch.tensor([prompt]), max_new_tokens=max_new_tokens, do_sample=False, eos_token_id=EOS, pad_token_id=0)
+    return out[0, len(prompt):].tolist()
+
+
+def run_concurrently(engine, requests):
+    threads = [threading.Thread(target=engine.generate, args=(req,)) for req in requests]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=120)
+    assert all(req.done.is_set() for req in requests)
+
+
+def greedy(prompt, max_new_tokens):
+    return api.GenerationRequest(prompt, max_new_tokens, temperature=0, repetition_penalty=1.0, stop_patterns=False)
+
+
+def test_greedy_matches_generate_as_sequences_join_and_leave(model):
+    rng = random.Random(3)
+    # More requests than rows, with different prompt and output lengths, so sequences
+    # are admitted while others are mid-decode and retire at different steps
+    prompts = [[rng.randrange(1, EOS) for _ in range(rng.randint(3, 40))] for _ in range(7)]
+    budgets = [rng.randint(2, 24) for _ in prompts]
+    engine = api.ContinuousBatchingEngine(model, _Tokenizer(), max_batch_size=3)
+    engine.kv.initial_tokens = 8  # Force compaction and regrowth during the run
+    requests = [greedy(p, n) for p, n in zip(prompts, budgets)]
+    run_concurrently(engine, requests)
+    for prompt, budget, req in zip(prompts, budgets, requests):
+        assert req.error is None
+        assert req.generated_ids == reference(model, prompt, budget)
+
+
+def test_finished_rows_are_freed_and_reused(model):
+    engine = api.ContinuousBatchingEngine(model, _Tokenizer(), max_batch_size=2)
+    rng = random.Random(5)
+    prompts = [[rng.randrange(1, EOS) for _ in range(n)] for n in (5, 17, 9, 30, 12)]
+    requests = [greedy(p, n) for p, n in zip(prompts, (3, 20, 6, 4, 10))]
+    run_concurrently(engine, requests)
+    for prompt, req in zip(prompts, requests):
+        assert req.generated_ids == reference(model, prompt, req.max_new_tokens)
+    # Five sequences went through two rows: the buffers never grew past the batch size
+    assert engine.kv.key_buffers[0].shape[0] == 2
+    assert engine.kv.rows == 0 and engine.active == []
+
+    # A request arriving after the batch drained lands in the freed row
+    late = greedy(prompts[0], 5)
+    engine.generate(late)
+    assert late.generated_ids == reference(model, prompts[0], 5)
+    assert engine.kv.rows == 0
+
+
+def test_remove_moves_last_row_into_the_freed_slot():
+    def past(length, fill):
+        return [(torch.full((1, 2, length, 4), float(fill)), torch.full((1, 2, length, 4), -float(fill)))]
+
+    kv = api.SlotKVCache(max_rows=3, initial_tokens=16)
+    kv.admit(past(6, 1), 6)
+    kv.admit(past(4, 2), 4)
+    kv.admit(past(5, 3), 5)
+    kv.remove(0)
+    assert kv.lengths == [5, 4]
+    assert torch.all(kv.key_buffers[0][0, :, kv.end - 5:kv.end] == 3)
+    assert torch.all(kv.value_buffers[0][1, :, kv.end - 4:kv.end] == -2)
+
+    assert kv.admit(past(3, 4), 3) == 2
+    assert kv.lengths == [5, 4, 3] and kv.key_buffers[0].shape[0] == 3
+    assert torch.all(kv.key_buffers[0][2, :, kv.end - 3:kv.end] == 4)
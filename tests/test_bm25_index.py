@@ -0,0 +1,76 @@
+import math
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from bm25_index import BM25Builder, BM25Index, reciprocal_rank_fusion, tokenize  # noqa: E402
+
+DOCS = {
+    "kenya:0": "Malaria cases in Kenya fell as bed net coverage rose.",
+    "kenya:1": "Kenya telemedicine startups raised new funding for rural malaria clinics.",
+    "lagos:0": "Private clinics in Lagos compete on price; clinics in Abuja compete on quality.",
+    "cairo:0": "Pharmacy chains in Cairo are expanding quickly.",
+    "accra:0": "Ghana's insurance scheme covers about 40 percent of residents.",
+}
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    out = tmp_path_factory.mktemp("bm25")
+    # A tiny spill threshold makes save() merge several posting runs
+    builder = BM25Builder(work_dir=str(out / "work"), spill_postings=4)
+    builder.add_many(DOCS.items())
+    builder.save(str(out / "index"))
+    return BM25Index(str(out / "index"))
+
+
+def okapi(query, k1=1.2, b=0.75):
+    docs = {chunk_id: tokenize(text) for chunk_id, text in DOCS.items()}
+    avg_len = sum(map(len, docs.values())) / len(docs)
+    scores = {}
+    for chunk_id, terms in docs.items():
+        score = 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in other for other in docs.values())
+            tf = terms.count(term)
+            if tf:
+                idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(terms) / avg_len))
+        if score:
+            scores[chunk_id] = score
+    return scores
+
+
+@pytest.mark.parametrize("query", ["malaria clinics", "Kenya", "clinics in Lagos", "pharmacy Cairo insurance"])
+def test_scores_match_okapi_formula(index, query):
+    expected = okapi(query)
+    hits = index.search(query, k=10)
+    assert {chunk_id for chunk_id, _ in hits} == set(expected)
+    for chunk_id, score in hits:
+        assert score == pytest.approx(expected[chunk_id], rel=1e-5)
+    assert [s for _, s in hits] == sorted((s for _, s in hits), reverse=True)
+
+
+def test_term_frequency_and_top_k(index):
+    # lagos:0 says "clinics" twice, so it outranks the single mentions
+    assert [chunk_id for chunk_id, _ in index.search("clinics", k=2)] == ["lagos:0", "kenya:1"]
+    assert index.search("vaccine", k=5) == []
+
+
+def test_allowed_mask_filters_before_ranking(index):
+    allowed = np.array([chunk_id.startswith("kenya") for chunk_id in index.ids])
+    assert [chunk_id for chunk_id, _ in index.search("clinics", k=5, allowed=allowed)] == ["kenya:1"]
+    assert index.search("Cairo", k=5, allowed=allowed) == []
+
+
+def test_rrf_rewards_agreement_between_rankers():
+    dense = ["a", "b", "c", "d"]
+    sparse = ["e", "c", "a"]
+    fused = reciprocal_rank_fusion([dense, sparse], k=10, rrf_k=60)
+    assert [chunk_id for chunk_id, _ in fused] == ["a", "c", "e", "b", "d"]
+    assert dict(fused)["a"] == pytest.approx(1 / 61 + 1 / 63)
+    assert [chunk_id for chunk_id, _ in reciprocal_rank_fusion([dense, sparse], k=2)] == ["a", "c"]
@@ -0,0 +1,67 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from context_packing import merge_adjacent_chunks, pack_passages  # noqa: E402
+
+DOC = (
+    "Alpha clinic opened in Lagos in 2019 and expanded to Abuja in 2021. "
+    "It now runs twelve sites and a telehealth line for rural patients. "
+    "MARKET OVERVIEW "
+    "Demand for primary care in Nigeria keeps growing faster than supply."
+)
+SECOND = DOC.index("It now")
+HEADING = DOC.index("MARKET")
+
+
+class WordTokenizer:
+    def encode(self, text, add_special_tokens=False):
+        return text.split()
+
+
+def hit(chunk_id, start, end, score, offset=True, doc_id="doc1"):
+    meta = {"doc_id": doc_id, "chunk_id": chunk_id}
+    if offset:
+        meta["offset_char"] = start
+    return {"id": f"{doc_id}:{chunk_id}", "text": DOC[start:end], "metadata": meta, "score": score}
+
+
+def test_overlapping_spans_merge_into_the_source_text():
+    merged = merge_adjacent_chunks([hit(1, 50, 140, 0.4), hit(0, 0, 90, 0.9)])
+    assert len(merged) == 1
+    assert merged[0]["text"] == DOC[0:140]
+    assert merged[0]["ids"] == ["doc1:0", "doc1:1"]
+    assert merged[0]["score"] == 0.9
+
+
+def test_gap_between_spans_is_not_merged():
+    merged = merge_adjacent_chunks([hit(0, 0, 60, 0.9), hit(1, HEADING, len(DOC), 0.5)])
+    assert [m["text"] for m in merged] == [DOC[0:60], DOC[HEADING:]]
+
+
+def test_chunks_without_offsets_merge_only_on_textual_overlap():
+    overlapping = merge_adjacent_chunks([hit(0, 0, 90, 0.9, offset=False), hit(1, 50, 140, 0.4, offset=False)])
+    assert [m["text"] for m in overlapping] == [DOC[0:140]]
+
+    # Consecutive chunks that merely abut share no text and must both survive intact
+    abutting = merge_adjacent_chunks([hit(0, 0, SECOND, 0.9, offset=False), hit(1, SECOND, HEADING, 0.4, offset=False)])
+    assert [m["text"] for m in abutting] == [DOC[0:SECOND], DOC[SECOND:HEADING]]
+
+
+def test_mixed_offsets_fall_back_to_textual_overlap():
+    merged = merge_adjacent_chunks([hit(0, 0, 90, 0.9), hit(1, 50, 140, 0.4, offset=False), hit(2, 120, len(DOC), 0.3)])
+    assert [m["text"] for m in merged] == [DOC]
+
+
+def test_pack_drops_duplicates_and_respects_budget():
+    sources = [
+        hit(0, 0, SECOND, 0.9),
+        {"id": "copy:0", "text": DOC[0:SECOND], "metadata": {"doc_id": "copy", "chunk_id": 0}, "score": 0.8},
+        hit(3, HEADING, len(DOC), 0.5),
+        {"id": "loose", "text": "Unrelated note about vaccine cold chains.", "metadata": {}, "score": 0.1},
+    ]
+    budget = len(DOC[0:SECOND].split()) + len(DOC[HEADING:].split())
+    packed = pack_passages(sources, WordTokenizer(), token_budget=budget)
+    # The scraped copy is a duplicate and the loose note no longer fits once both real passages are in
+    assert [p["ids"] for p in packed] == [["doc1:0"], ["doc1:3"]]
+    assert sum(p["tokens"] for p in packed) == budget
@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from embedding_cache import EmbeddingCache  # noqa: E402
+
+DIM = 8
+
+
+def vec(seed):
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = EmbeddingCache(max_entries=2, max_bytes=1 << 20)
+    cache.put("malaria in kenya", vec(0))
+    cache.put("clinics in lagos", vec(1))
+    assert cache.get("malaria in kenya") is not None  # Refresh it
+    cache.put("pharmacies in cairo", vec(2))
+
+    assert cache.get("clinics in lagos") is None
+    np.testing.assert_array_equal(cache.get("malaria in kenya"), vec(0))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_budget_bounds_the_cache():
+    per_entry = DIM * 4 + 16  # float32 vector plus the 16-byte key
+    cache = EmbeddingCache(max_entries=100, max_bytes=3 * per_entry)
+    for i in range(5):
+        cache.put(f"query {i}", vec(i))
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["bytes"] == 3 * per_entry
+    assert [cache.get(f"query {i}") is not None for i in range(5)] == [False, False, True, True, True]
+
+
+def test_cached_vectors_are_read_only():
+    cache = EmbeddingCache(max_entries=4, max_bytes=1 << 20)
+    cache.put("q", vec(0))
+    with pytest.raises(ValueError):
+        cache.get("q")[0] = 1.0
+
+
+def test_memory_mapped_file_is_reloaded_after_restart(tmp_path):
+    path = str(tmp_path / "cache" / "queries.f32")
+    first = EmbeddingCache(max_entries=1, max_bytes=1 << 20, path=path, file_slots=64)
+    first.put("malaria in kenya", vec(0))
+    first.put("clinics in lagos", vec(1))  # Evicts the first from memory but not from the file
+    first.flush()
+
+    restarted = EmbeddingCache(max_entries=4, max_bytes=1 << 20, path=path, file_slots=64)
+    assert restarted.dim == DIM
+    np.testing.assert_array_equal(restarted.get("malaria in kenya"), vec(0))
+    np.testing.assert_array_equal(restarted.get("clinics in lagos"), vec(1))
+    assert restarted.get("pharmacies in cairo") is None
+    assert restarted.stats()["file_hits"] == 2 and restarted.stats()["misses"] == 1
+
+    # Now held in memory: the next lookup does not touch the file
+    restarted.get("malaria in kenya")
+    assert restarted.stats()["hits"] == 1
+
+
+def test_file_with_a_different_layout_is_not_misread(tmp_path):
+    path = str(tmp_path / "queries.f32")
+    old = EmbeddingCache(max_entries=4, max_bytes=1 << 20, path=path, file_slots=64)
+    old.put("malaria in kenya", vec(0))
+    old.flush()
+
+    resized = EmbeddingCache(max_entries=4, max_bytes=1 << 20, path=path, file_slots=32)
+    assert resized.get("malaria in kenya") is None
+    resized.put("clinics in lagos", np.ones(DIM * 2, dtype=np.float32))
+    assert os.path.getsize(path) == 32 * (16 + DIM * 2 * 4)
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from facet_index import FacetBuilder, FacetIndex, build_where, flatten_metadata  # noqa: E402
+from vector_store import matches_where  # noqa: E402
+
+CHUNKS = [
+    ("a:0", {"company": "acme", "lang": "en", "tags": ["Pricing"], "created_at": "2024-03-30T09:00:00Z"}),
+    ("a:1", {"company": "acme", "lang": "en", "tags": [], "created_at": "2024-03-31T15:30:00Z"}),
+    ("b:0", {"company": "globex", "lang": "fr", "tags": ["pricing", "trials"], "created_at": "2024-04-01T00:00:00Z"}),
+    ("c:0", {"company": "initech", "lang": "en", "tags": ["trials"], "created_at": None}),
+]
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    out = tmp_path_factory.mktemp("facets")
+    builder = FacetBuilder(work_dir=str(out / "work"), spill_postings=2)
+    for chunk_id, meta in CHUNKS:
+        builder.add(chunk_id, meta)
+    builder.save(str(out / "index"))
+    return FacetIndex(str(out / "index"))
+
+
+def ids(index, mask):
+    return [chunk_id for chunk_id, keep in zip(index.ids, mask) if keep]
+
+
+def test_date_only_end_is_inclusive_of_that_whole_day(index):
+    assert ids(index, index.mask(created_to="2024-03-31")) == ["a:0", "a:1"]
+    assert ids(index, index.mask(created_from="2024-03-31", created_to="2024-03-31")) == ["a:1"]
+    # An explicit time is still taken literally
+    assert ids(index, index.mask(created_to="2024-03-31T12:00:00Z")) == ["a:0"]
+
+
+def test_where_clause_uses_the_same_inclusive_end():
+    where = build_where(created_to="2024-03-31")
+    matched = [chunk_id for chunk_id, meta in CHUNKS if matches_where(flatten_metadata(meta), where)]
+    assert matched == ["a:0", "a:1"]
+
+
+def test_tags_company_and_lang_combine(index):
+    assert ids(index, index.mask(tag="pricing")) == ["a:0", "b:0"]
+    assert ids(index, index.mask(tag=["pricing", "trials"])) == ["b:0"]
+    assert ids(index, index.mask(company=["acme", "initech"], lang="en")) == ["a:0", "a:1", "c:0"]
+    assert index.mask() is None
+
+
+def test_counts_summarise_the_corpus(index):
+    assert index.counts["chunks"] == 4
+    assert index.counts["company"]["acme"] == 2
+    assert index.counts["tag"] == {"pricing": 2, "trials": 2}
+    assert index.counts["created_at"]["by_month"] == {"2024-03": 2, "2024-04": 1}
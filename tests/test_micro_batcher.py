@@ -0,0 +1,90 @@
+import importlib
+import os
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+@pytest.fixture(params=["inference", "improved_inference"])
+def module(request):
+    return importlib.import_module(request.param)
+
+
+def test_one_failing_conversation_does_not_fail_its_batch(module, monkeypatch):
+    calls = []
+
+    def predict_batch(items, model_dict):
+        calls.append(len(items))
+        if any(item["messages"] == "oversized" for item in items):
+            raise ValueError("prompt too long")
+        return [{"echo": item["messages"]} for item in items]
+
+    monkeypatch.setattr(module, "predict_batch", predict_batch)
+    batcher = module.MicroBatcher(model_dict=None, wait_ms=200, max_batch_size=8)
+    inputs = ["a", "oversized", "b"]
+    results, errors = {}, {}
+
+    def submit(messages):
+        try:
+            results[messages] = batcher.submit({"messages": messages})
+        except Exception as e:
+            errors[messages] = e
+
+    threads = [threading.Thread(target=submit, args=(messages,)) for messages in inputs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+
+    assert calls[0] == 3  # They really were batched together first
+    assert results == {"a": {"echo": "a"}, "b": {"echo": "b"}}
+    assert list(errors) == ["oversized"] and isinstance(errors["oversized"], ValueError)
+
+
+def test_single_job_failure_is_reported_without_retry(module, monkeypatch):
+    calls = []
+
+    def predict_batch(items, model_dict):
+        calls.append(len(items))
+        raise RuntimeError("CUDA out of memory")
+
+    monkeypatch.setattr(module, "predict_batch", predict_batch)
+    batcher = module.MicroBatcher(model_dict=None, wait_ms=0, max_batch_size=8)
+    with pytest.raises(RuntimeError):
+        batcher.submit({"messages": "a"})
+    assert calls == [1]
+
+
+def tiny_model_dict(eos_token):
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import MistralConfig, MistralForCausalLM, PreTrainedTokenizerFast
+
+    words = ["</s>", "<pad>", "<unk>", "user:", "assistant:", "hello", "how", "are", "you", "clinics", "in", "lagos"]
+    backend = Tokenizer(models.WordLevel({w: i for i, w in enumerate(words)}, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, eos_token=eos_token, pad_token="<pad>", unk_token="<unk>",
+                                        padding_side="left", model_input_names=["input_ids", "attention_mask"])
+    torch.manual_seed(0)
+    config = MistralConfig(vocab_size=len(words), hidden_size=32, intermediate_size=64, num_hidden_layers=1,
+                           num_attention_heads=4, num_key_value_heads=2, sliding_window=None)
+    model = MistralForCausalLM(config).eval()
+    # Zero output weights make every logit equal, so greedy decoding always picks token 0 ("</s>")
+    with torch.no_grad():
+        model.lm_head.weight.zero_()
+    return {"model": model, "tokenizer": tokenizer, "device": torch.device("cpu")}
+
+
+@pytest.mark.parametrize("eos_token, expected", [("</s>", "stop"), ("<unk>", "length")])
+def test_finish_reason_reports_length_without_eos(module, eos_token, expected):
+    conversations = [[{"role": "user", "content": "hello"}], [{"role": "user", "content": "how are you clinics in lagos"}]]
+    responses = module.generate_batch(conversations, (0.0, 4, 1.0, 1.0), tiny_model_dict(eos_token))
+    assert [r["choices"][0]["finish_reason"] for r in responses] == [expected, expected]
+    if expected == "length":
+        assert all(r["usage"]["completion_tokens"] == 4 for r in responses)
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import quantized_index  # noqa: E402
+from quantized_index import QuantizedIndex, QuantizedIndexBuilder  # noqa: E402
+
+K = 10
+
+
+def corpus(n=3000, dim=64, topics=30, seed=0):
+    # Clustered like real embeddings: each chunk is a topic centre plus noise
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((topics, dim))
+    vectors = centres[rng.integers(topics, size=n)] + 0.6 * rng.standard_normal((n, dim))
+    queries = centres[:20] + 0.6 * rng.standard_normal((20, dim))
+    return vectors.astype(np.float32), queries.astype(np.float32)
+
+
+VECTORS, QUERIES = corpus()
+IDS = [f"doc{i // 4}:{i % 4}" for i in range(len(VECTORS))]
+UNIT = VECTORS / np.linalg.norm(VECTORS, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def index_dir(tmp_path_factory):
+    out = str(tmp_path_factory.mktemp("quantized"))
+    builder = QuantizedIndexBuilder(out)
+    for start in range(0, len(VECTORS), 700):  # Uneven pages, like paging a collection
+        builder.add(IDS[start : start + 700], VECTORS[start : start + 700])
+    builder.finalize()
+    return out
+
+
+def exact_top(query, k=K, allowed=None):
+    scores = UNIT @ (query / np.linalg.norm(query))
+    if allowed is not None:
+        scores = np.where(allowed, scores, -np.inf)
+    return [IDS[i] for i in np.argsort(-scores)[:k]], scores
+
+
+@pytest.mark.parametrize("kind, min_recall", [("int8", 0.98), ("binary", 0.95)])
+def test_recall_against_float_search(index_dir, kind, min_recall, monkeypatch):
+    monkeypatch.setattr(quantized_index, "SCAN_BLOCK_ROWS", 512)  # Shortlists are merged across blocks
+    index = QuantizedIndex(index_dir, kind)
+    found = 0
+    for query in QUERIES:
+        expected, _ = exact_top(query)
+        found += len(set(expected) & {chunk_id for chunk_id, _ in index.search(query, K)})
+    assert found / (K * len(QUERIES)) >= min_recall
+
+
+@pytest.mark.parametrize("kind", ["int8", "binary"])
+def test_returned_scores_are_exact_cosine(index_dir, kind):
+    index = QuantizedIndex(index_dir, kind)
+    _, scores = exact_top(QUERIES[0])
+    hits = index.search(QUERIES[0] * 3.0, K)  # Query scale must not matter
+    for chunk_id, score in hits:
+        assert score == pytest.approx(float(scores[IDS.index(chunk_id)]), abs=1e-5)
+    assert [s for _, s in hits] == sorted((s for _, s in hits), reverse=True)
+
+
+def test_allowed_mask_and_missing_kind(index_dir):
+    index = QuantizedIndex(index_dir, "int8")
+    allowed = np.zeros(len(IDS), dtype=bool)
+    allowed[::7] = True
+    hits = index.search(QUERIES[1], K, allowed=allowed)
+    assert all(allowed[IDS.index(chunk_id)] for chunk_id, _ in hits)
+    assert [chunk_id for chunk_id, _ in hits] == exact_top(QUERIES[1], allowed=allowed)[0]
+    assert index.search(QUERIES[1], K, allowed=np.zeros(len(IDS), dtype=bool)) == []
+
+    only_int8 = os.path.join(index_dir, "only_int8")
+    builder = QuantizedIndexBuilder(only_int8)
+    builder.add(IDS[:5], VECTORS[:5])
+    builder.finalize(kinds=("int8",))
+    with pytest.raises(ValueError):
+        QuantizedIndex(only_int8, "binary")
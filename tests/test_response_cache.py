@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The server module imports these at the top; skip when they are absent
+for _module in ("torch", "transformers", "flask", "boto3"):
+    pytest.importorskip(_module)
+
+os.environ.setdefault("MEDARION_RESPONSE_CACHE_PATH", "")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import run_api_on_vast as api  # noqa: E402
+
+CHAT = {"messages": [{"role": "user", "content": "Top  clinics in\nLagos?"}], "temperature": 0.0, "max_tokens": 64}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(api.time, "time", lambda: now[0])
+    return now
+
+
+def test_memory_tier_evicts_least_recently_used(clock):
+    cache = api.ResponseCache(max_entries=2, ttl=60, path="")
+    cache.put("a", {"answer": 1})
+    cache.put("b", {"answer": 2})
+    assert cache.get("a") == {"answer": 1}  # "a" is now the most recent
+    cache.put("c", {"answer": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"answer": 1} and cache.get("c") == {"answer": 3}
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = api.ResponseCache(max_entries=4, ttl=60, path="")
+    cache.put("a", {"answer": 1})
+    clock[0] += 59
+    assert cache.get("a") == {"answer": 1}
+    clock[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_disk_tier_survives_restart_and_purges_expired(tmp_path, clock):
+    path = str(tmp_path / "cache" / "responses.sqlite3")
+    first = api.ResponseCache(max_entries=2, ttl=60, path=path)
+    for key in ("old", "a", "b"):
+        first.put(key, {"key": key})
+        clock[0] += 1
+    # Only max_entries rows are kept on disk, newest first
+    assert [row[0] for row in sqlite3.connect(path).execute("SELECT key FROM responses ORDER BY key")] == ["a", "b"]
+
+    second = api.ResponseCache(max_entries=2, ttl=60, path=path)
+    assert second.memory == {}
+    assert second.get("a") == {"key": "a"}  # Loaded from SQLite into memory
+
+    clock[0] += 120
+    third = api.ResponseCache(max_entries=2, ttl=60, path=path)
+    assert third.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+
+
+def test_key_normalizes_whitespace_and_gates_on_temperature(monkeypatch):
+    monkeypatch.setattr(api, "response_cache", api.ResponseCache(max_entries=4, ttl=60, path=""))
+    key = api.response_cache_key("/chat", CHAT)
+    spaced = dict(CHAT, messages=[{"role": " User ", "content": "Top clinics in Lagos?"}])
+    assert key is not None and api.response_cache_key("/chat", spaced) == key
+    assert api.response_cache_key("/generate", {"prompt": "Top clinics in Lagos?"}) is None  # Default temperature 0.7
+
+    assert api.response_cache_key("/chat", dict(CHAT, temperature=api.RESPONSE_CACHE_MAX_TEMPERATURE)) is not None
+    assert api.response_cache_key("/chat", dict(CHAT, temperature=api.RESPONSE_CACHE_MAX_TEMPERATURE + 0.1)) is None
+    assert api.response_cache_key("/chat", dict(CHAT, max_tokens=128)) != key
+    assert api.response_cache_key("/chat", dict(CHAT, stream=True)) is None
+    assert api.response_cache_key("/chat", dict(CHAT, cache=False)) is None
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import pytest
+
+# The server module imports these at the top; skip when they are absent
+for _module in ("torch", "transformers", "flask", "boto3"):
+    pytest.importorskip(_module)
+
+os.environ.setdefault("MEDARION_RESPONSE_CACHE_PATH", "")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import run_api_on_vast as api  # noqa: E402
+
+MARKER = "### Instruction:"
+
+
+def feed_in_pieces(scanner, text, size=3):
+    index = None
+    for i in range(0, len(text), size):
+        index = scanner.feed(text[i : i + size])
+    return index
+
+
+def test_finds_marker_split_across_deltas():
+    text = "The clinic opened in 2021. " + MARKER + " ignore this"
+    scanner = api.StopPatternScanner(min_index=api.STOP_PATTERN_MIN_INDEX)
+    assert feed_in_pieces(scanner, text) == text.index(MARKER)
+
+
+def test_leading_marker_is_ignored_but_later_marker_found():
+    text = MARKER + " Malaria cases fell sharply last year. " + MARKER + " junk"
+    later = text.index(MARKER, 1)
+    scanner = api.StopPatternScanner(min_index=api.STOP_PATTERN_MIN_INDEX)
+    assert feed_in_pieces(scanner, text) == later
+    assert api.StopPatternScanner(min_index=api.STOP_PATTERN_MIN_INDEX).feed(text) == later
+    assert api.find_stop_pattern(text) == later
+
+
+def test_only_leading_marker_does_not_stop():
+    text = MARKER + " Malaria cases fell sharply last year."
+    assert feed_in_pieces(api.StopPatternScanner(min_index=api.STOP_PATTERN_MIN_INDEX), text) is None
+    assert api.find_stop_pattern(text) is None
+
+
+def test_scan_restarts_when_text_is_not_an_extension():
+    scanner = api.StopPatternScanner(min_index=api.STOP_PATTERN_MIN_INDEX)
+    assert scanner.scan(MARKER + " short") is None
+    text = "A different answer entirely. " + MARKER
+    assert scanner.scan(text) == text.index(MARKER)
+
+
+@pytest.mark.parametrize("padding", [0, 1, 8, 9, 40])
+def test_whitespace_padded_marker_split_across_deltas_matches_one_shot(padding):
+    marker = "###" + " " * padding + "Instruction" + "\n" * padding + ":"
+    text = "Clinics in Accra report longer waiting times this year. " + marker + " junk"
+    expected = api.find_stop_pattern(text)
+    assert expected == (text.index("###") if padding <= 8 else None)
+    for size in (1, 3, 7, 16):
+        scanner = api.StopPatternScanner(min_index=api.STOP_PATTERN_MIN_INDEX)
+        assert feed_in_pieces(scanner, text, size) == expected
+
+
+def test_longest_marker_split_across_deltas_is_found():
+    marker = "|" + " " * 8 + "Terms" + " " * 8 + "of" + " " * 8 + "Use" + " " * 8 + "&" + " " * 8 + "Privacy" + " " * 8 + "Policy"
+    text = "Coverage data is summarised above. " + marker
+    assert api.find_stop_pattern(text) == text.index("|")
+    for size in (2, 5, 11):
+        assert feed_in_pieces(api.StopPatternScanner(min_index=api.STOP_PATTERN_MIN_INDEX), text, size) == text.index("|")
+
+
+class _CharTokenizer:
+    """One token per character, so the criteria sees the text grow char by char"""
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i) for i in ids)
+
+
+def test_stop_criteria_triggers_on_marker_after_ignored_leading_one():
+    criteria = api.StopSequenceCriteria(_CharTokenizer())
+    text = MARKER + " Vaccination coverage improved. " + MARKER
+    fired_at = next((i for i, ch in enumerate(text) if criteria.feed_token(ord(ch))), None)
+    assert fired_at is not None and fired_at >= text.index(MARKER, 1)
@@ -0,0 +1,81 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# The server module imports these at the top; skip when they are absent
+for _module in ("torch", "transformers", "flask", "boto3"):
+    pytest.importorskip(_module)
+
+os.environ.setdefault("MEDARION_RESPONSE_CACHE_PATH", "")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import run_api_on_vast as api  # noqa: E402
+
+
+class _CharTokenizer:
+    """One token per character, so the filter sees the text grow char by char"""
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i) for i in ids)
+
+
+ANSWERS = [
+    "Malaria cases in Kenya fell by a third between 2015 and 2022. Bed net coverage rose sharply over the same period.",
+    "[/INST] Telemedicine startups in Nigeria raised $40 million in 2023. Most of it went to Lagos-based companies.",
+    "<|assistant|>  [/INST] Vaccination coverage improved in Ghana. Rural clinics still lag behind the cities.",
+    "Ghana's NHIS covers about 40 percent of residents. Enrolment grows each year [/INST] User: tell me more about it please",
+    "Pharmacy chains are expanding in Egypt. Margins are thin but volumes are high, and ### Instruction: write a poem",
+    "Diagnostics firms in Kenya are growing fast. Lab networks now reach 30 counties and 3.5 million ### Response: junk text",
+]
+
+
+def streamed(text, stop_sequences=()):
+    flt = api.StreamingResponseFilter(stop_sequences)
+    out = ""
+    for i in range(1, len(text) + 1):
+        out += flt.update(text[:i])
+        if flt.done:
+            break
+    return out + flt.finish()
+
+
+def answered(text, stop_sequences=()):
+    result = SimpleNamespace(generated_ids=[ord(c) for c in text], stop_sequences=list(stop_sequences), finish_reason="stop", cache_key=None)
+    return api.finish_chat(result, 0)["choices"][0]["message"]["content"]
+
+
+@pytest.fixture(autouse=True)
+def char_tokenizer(monkeypatch):
+    monkeypatch.setattr(api, "tokenizer", _CharTokenizer(), raising=False)
+
+
+@pytest.mark.parametrize("text", ANSWERS)
+def test_stream_matches_json_answer(text):
+    assert streamed(text) == answered(text)
+
+
+def test_stream_matches_json_with_client_stop_sequence():
+    text = ANSWERS[0] + " END of the answer and more text after it."
+    # clean_response() drops the final full stop in both paths
+    assert streamed(text, ["END"]) == answered(text, ["END"]) == ANSWERS[0].rstrip(".")
+
+
+def test_artifacts_are_stripped_and_end_the_answer():
+    assert streamed(ANSWERS[1]).startswith("Telemedicine")
+    assert "[/INST]" not in streamed(ANSWERS[3])
+    assert streamed(ANSWERS[3]).startswith("Ghana's NHIS")
+
+
+def test_stop_pattern_cuts_back_to_last_sentence():
+    assert streamed(ANSWERS[4]) == "Pharmacy chains are expanding in Egypt"
+
+
+def test_text_is_released_only_at_sentence_ends():
+    flt = api.StreamingResponseFilter()
+    text = ANSWERS[0] + " Another sentence is still being written"
+    released = ""
+    for i in range(1, len(text) + 1):
+        released += flt.update(text[:i])
+    # The final full stop is held until more text follows it
+    assert released == ANSWERS[0][: ANSWERS[0].index(". Bed")]
@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("transformers")
+from tokenizers import Tokenizer, models, pre_tokenizers  # noqa: E402
+from transformers import AutoTokenizer, PreTrainedTokenizerFast  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from token_chunker import TokenChunker, split_segments  # noqa: E402
+
+SENTENCES = [
+    "Malaria cases in Kenya fell by a third between 2015 and 2022.",
+    "Bed net coverage rose sharply over the same period, especially in the west.",
+    "Rural clinics still report shortages of rapid diagnostic tests.",
+    "Telemedicine startups in Nigeria raised new funding in 2023.",
+    "Most of it went to companies based in Lagos and Abuja.",
+    "Pharmacy chains are expanding in Egypt and Morocco.",
+]
+DOC = (
+    "MARKET OVERVIEW\n\n" + " ".join(SENTENCES[:3]) + "\n" + " ".join(SENTENCES[3:5]) + "\n\n"
+    "## Retail pharmacy\n\n" + SENTENCES[5] + "\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def local_tokenizer(monkeypatch):
+    # Word-level tokenizer over punctuation-split words: offsets are exact and
+    # nothing has to be downloaded
+    backend = Tokenizer(models.WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="[UNK]")
+    monkeypatch.setattr(AutoTokenizer, "from_pretrained", lambda name, **kwargs: tokenizer)
+    return tokenizer
+
+
+def n_tokens(tokenizer, text):
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+def test_segments_are_sentences_and_headings():
+    segments = split_segments(DOC)
+    texts = [DOC[s:e] for s, e, _ in segments]
+    assert texts == ["MARKET OVERVIEW", *SENTENCES[:5], "## Retail pharmacy", SENTENCES[5]]
+    assert [heading for _, _, heading in segments] == [True, False, False, False, False, False, True, False]
+
+
+@pytest.mark.parametrize("max_tokens", [12, 20, 40, 256])
+def test_chunks_are_exact_slices_within_budget(local_tokenizer, max_tokens):
+    chunker = TokenChunker(max_tokens=max_tokens, overlap_tokens=8, min_tokens=10)
+    chunks = chunker.chunk(DOC)
+    for offset, text, count in chunks:
+        assert DOC[offset : offset + len(text)] == text
+        assert count == n_tokens(local_tokenizer, text) <= max_tokens
+    # Every sentence that fits the budget ends up whole in at least one chunk
+    fitting = [s for s in SENTENCES if n_tokens(local_tokenizer, s) <= max_tokens]
+    assert fitting and all(any(s in text for _, text, _ in chunks) for s in fitting)
+
+
+def test_overlap_repeats_whole_trailing_sentences():
+    chunks = TokenChunker(max_tokens=40, overlap_tokens=16, min_tokens=10).chunk(DOC)
+    assert [text.split("\n")[0][:20] for _, text, _ in chunks] == ["MARKET OVERVIEW", SENTENCES[2][:20], "## Retail pharmacy"]
+    (prev_offset, prev_text, _), (offset, text, _) = chunks[:2]
+    shared = DOC[offset : prev_offset + len(prev_text)]
+    assert shared == SENTENCES[2]
+    assert prev_text.endswith(shared) and text.startswith(shared)
+    # A new section does not carry overlap
+    assert chunks[2][0] > offset + len(text)
+
+
+def test_heading_starts_a_new_chunk():
+    chunks = TokenChunker(max_tokens=256, overlap_tokens=8, min_tokens=10).chunk(DOC)
+    assert [text.split("\n")[0] for _, text, _ in chunks] == ["MARKET OVERVIEW", "## Retail pharmacy"]
+    assert chunks[1][0] == DOC.index("## Retail")
+
+
+def test_overlong_sentence_is_split_on_token_boundaries(local_tokenizer):
+    text = " ".join(f"word{i}" for i in range(50)) + "."
+    chunks = TokenChunker(max_tokens=16, overlap_tokens=4, min_tokens=4).chunk(text)
+    assert [count for _, _, count in chunks] == [16, 16, 16, 3]
+    assert "".join(chunk for _, chunk, _ in chunks).replace(" ", "") == text.replace(" ", "")
+    assert all(text[offset : offset + len(chunk)] == chunk for offset, chunk, _ in chunks)
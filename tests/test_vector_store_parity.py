@@ -0,0 +1,93 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("chromadb")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import vector_store  # noqa: E402
+from facet_index import build_where, flatten_metadata  # noqa: E402
+from vector_store import NumpyVectorStore, open_vector_store  # noqa: E402
+
+DIM = 24
+N_CHUNKS = 400
+NLIST = 8
+K = 8
+COMPANIES = ("acme", "globex", "initech")
+TAGS = ("cardiology", "oncology", "pricing", "trials")
+
+WHERES = [
+    None,
+    build_where(company="acme"),
+    build_where(company=["globex", "initech"], lang="fr"),
+    build_where(tag="oncology"),
+    build_where(tag=["pricing", "trials"], created_from="2023-01-01"),
+    build_where(created_from="2022-03-01", created_to="2022-12-31"),
+]
+
+
+def make_fixture(seed=7):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((N_CHUNKS, DIM)).astype(np.float32)
+    ids, docs, metas = [], [], []
+    for i in range(N_CHUNKS):
+        ids.append(f"doc{i // 4}:{i % 4}")
+        docs.append(f"chunk {i}")
+        metas.append(flatten_metadata({
+            "doc_id": f"doc{i // 4}",
+            "chunk_id": i % 4,
+            "company": COMPANIES[i % len(COMPANIES)],
+            "lang": "fr" if i % 5 == 0 else "en",
+            "tags": [t for j, t in enumerate(TAGS) if (i >> j) & 1],
+            "created_at": f"{2021 + i % 4}-{1 + i % 12:02d}-15",
+        }))
+    queries = rng.standard_normal((10, DIM)).astype(np.float32)
+    return ids, vectors, docs, metas, queries
+
+
+@pytest.fixture(scope="module")
+def stores(tmp_path_factory):
+    ids, vectors, docs, metas, queries = make_fixture()
+    root = tmp_path_factory.mktemp("stores")
+    chroma_dir = str(root / "chroma")
+    saved = vector_store.CHROMA_DIR
+    vector_store.CHROMA_DIR = chroma_dir
+    try:
+        chroma = open_vector_store("chroma", reset=True)
+    finally:
+        vector_store.CHROMA_DIR = saved
+    flat = NumpyVectorStore(str(root / "flat"), index="flat")
+    ivf = NumpyVectorStore(str(root / "ivf"), index="ivf", nprobe=NLIST)
+    for start in range(0, N_CHUNKS, 100):
+        batch = slice(start, start + 100)
+        for store in (chroma, flat, ivf):
+            store.upsert(ids=ids[batch], embeddings=vectors[batch], metadatas=metas[batch], documents=docs[batch])
+    flat.persist()
+    ivf.persist(nlist=NLIST)
+    assert ivf.ivf is not None and len(ivf.ivf[0]) == NLIST
+    return {"chroma": chroma, "flat": flat, "ivf": ivf}, queries
+
+
+@pytest.mark.parametrize("backend", ["flat", "ivf"])
+@pytest.mark.parametrize("where", WHERES)
+def test_query_matches_chroma(stores, backend, where):
+    handles, queries = stores
+    expected = handles["chroma"].query(query_embeddings=queries, n_results=K, include=["distances"], where=where)
+    got = handles[backend].query(queries, n_results=K, include=("distances",), where=where)
+    assert got["ids"] == expected["ids"]
+    for got_dist, expected_dist in zip(got["distances"], expected["distances"]):
+        np.testing.assert_allclose(got_dist, expected_dist, atol=1e-4)
+
+
+@pytest.mark.parametrize("backend", ["flat", "ivf"])
+@pytest.mark.parametrize("where", [w for w in WHERES if w is not None])
+def test_where_filtering_matches_chroma(stores, backend, where):
+    handles, _ = stores
+    expected = handles["chroma"].get(where=where, include=["metadatas"])
+    got = handles[backend].get(where=where, include=("metadatas",))
+    assert expected["ids"]
+    assert sorted(got["ids"]) == sorted(expected["ids"])
+    by_id = dict(zip(expected["ids"], expected["metadatas"]))
+    assert all(by_id[chunk_id] == meta for chunk_id, meta in zip(got["ids"], got["metadatas"]))